@@ -0,0 +1,96 @@
+"""
+Compare get_changelog_diff, which parses the to changelog lazily and stops at the
+first version also in the from changelog, against fully parsing both changelogs.
+
+Run against large changelogs, by default the largest ones installed on this system:
+
+    python -m benchmarks.changelog_diff
+    python -m benchmarks.changelog_diff linux.changelog systemd.changelog
+
+For each changelog the from changelog is the same changelog without its newest
+--new-blocks blocks, as for a package that was updated a few times.
+"""
+
+import glob
+import gzip
+import os
+import tempfile
+import time
+
+import click
+from debian.changelog import Changelog
+
+from ubuntu_cloud_image_changelog import lib
+
+
+def full_parse_changelog_diff(from_changelog_filename, to_changelog_filename):
+    """get_changelog_diff as it was before changelogs were parsed lazily"""
+    with open(from_changelog_filename, "r") as from_changelog_file:
+        from_changelog_versions = {version.full_version for version in Changelog(from_changelog_file.read()).versions}
+    changelog_diff = []
+    with open(to_changelog_filename, "r") as to_changelog_file:
+        for changelog_block in Changelog(to_changelog_file.read()):
+            if changelog_block._no_trailer:
+                continue
+            if changelog_block.version.full_version not in from_changelog_versions:
+                changelog_diff.append(changelog_block)
+    return changelog_diff
+
+
+def read_changelog(filename):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rb") as changelog_file:
+        return changelog_file.read()
+
+
+@click.command()
+@click.argument("changelogs", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option("--new-blocks", type=int, default=3, show_default=True, help="Blocks in the diff of each changelog")
+@click.option("--repeat", type=int, default=3, show_default=True, help="Best of this many runs is reported")
+def main(changelogs, new_blocks, repeat):
+    if not changelogs:
+        changelogs = sorted(glob.glob("/usr/share/doc/*/changelog.Debian.gz"), key=os.path.getsize, reverse=True)[:10]
+
+    with tempfile.TemporaryDirectory() as directory:
+        pairs = []
+        for index, changelog in enumerate(changelogs):
+            content = read_changelog(changelog)
+            starts = [header.start() for header in lib.CHANGELOG_HEADER_PATTERN.finditer(content)]
+            if len(starts) <= new_blocks:
+                continue
+            from_filename = os.path.join(directory, "{}.from".format(index))
+            to_filename = os.path.join(directory, "{}.to".format(index))
+            with open(from_filename, "wb") as from_file, open(to_filename, "wb") as to_file:
+                # the changelog as it was before its newest new_blocks blocks
+                from_file.write(content[slice(starts[new_blocks], None)])
+                to_file.write(content)
+            pairs.append((changelog, len(starts), from_filename, to_filename))
+
+        click.echo("{:>9} {:>9} {:>11} {:>9}  {}".format("blocks", "full (ms)", "lazy (ms)", "speedup", "changelog"))
+        total_full = total_lazy = 0.0
+        for changelog, blocks, from_filename, to_filename in pairs:
+            full = lazy = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                expected = full_parse_changelog_diff(from_filename, to_filename)
+                full = min(full, time.perf_counter() - start)
+
+                # A new cache each time so that every run loads and parses from scratch
+                lib.parsed_changelogs = lib.ParsedChangelogs()
+                start = time.perf_counter()
+                changelog_diff = lib.get_changelog_diff(from_filename, to_filename, None)
+                lazy = min(lazy, time.perf_counter() - start)
+            if [str(block.version) for block in changelog_diff] != [str(block.version) for block in expected]:
+                click.echo("Different diff for {}".format(changelog), err=True)
+            total_full += full
+            total_lazy += lazy
+            click.echo(
+                "{:>9} {:>9.1f} {:>11.1f} {:>8.1f}x  {}".format(
+                    blocks, full * 1000, lazy * 1000, full / lazy, changelog
+                )
+            )
+        click.echo("total: {:.1f} ms full, {:.1f} ms lazy".format(total_full * 1000, total_lazy * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compare parsing ubuntu-cve-tracker files with the single pass parser against the
+previous line scanning approach.
+
+Run against a checkout or tarball of ubuntu-cve-tracker:
+
+    git clone https://git.launchpad.net/ubuntu-cve-tracker
+    python -m benchmarks.cve_parser ubuntu-cve-tracker
+
+Every CVE is looked up --references times, as it would be when several changelog
+entries reference it. Previously the file was read and parsed again for every
+reference, now each CVE's record is parsed once and memoised by the tracker.
+"""
+
+import time
+
+import click
+
+from ubuntu_cloud_image_changelog import lib
+
+
+def line_scanning_parse(cve_details):
+    """The CVE details parsing used before parse_cve_record"""
+    cve_details_lines = iter(cve_details.splitlines())
+    cve_ubuntu_description = ""
+    cve_priority = "n/a"
+    cve_description = ""
+    cve_public_date = ""
+    try:
+        for cve_details_line in cve_details_lines:
+            if not cve_ubuntu_description and cve_details_line.startswith("Ubuntu-Description:"):
+                while True:
+                    next_line = next(cve_details_lines)
+                    if next_line.startswith("Notes"):
+                        break
+                    cve_ubuntu_description += next_line
+            if not cve_description and cve_details_line.startswith("Description:"):
+                while True:
+                    next_line = next(cve_details_lines)
+                    if next_line.startswith("Ubuntu-Description:"):
+                        break
+                    cve_description += next_line
+            if "Priority:" in cve_details_line:
+                cve_priority = cve_details_line.split("Priority:")[1].strip()
+            if "PublicDate:" in cve_details_line:
+                cve_public_date = cve_details_line.split("PublicDate:")[1].strip()
+    except StopIteration:
+        pass  # the previous parser failed here, carry on so the whole corpus can be timed
+    return (
+        cve_priority,
+        cve_public_date,
+        cve_ubuntu_description.lstrip() if cve_ubuntu_description else cve_description.lstrip(),
+    )
+
+
+@click.command()
+@click.argument("cve_tracker_path", type=click.Path(exists=True))
+@click.option("--references", type=int, default=5, show_default=True, help="Lookups of each CVE")
+def main(cve_tracker_path, references):
+    cve_tracker = lib.LocalCveTracker(cve_tracker_path)
+    cves = sorted(list(cve_tracker._cve_files) + list(cve_tracker._compressed_cve_details))
+    click.echo("{} CVE files, {} references each".format(len(cves), references))
+
+    start = time.perf_counter()
+    for _ in range(references):
+        for cve in cves:
+            line_scanning_parse(cve_tracker.get_cve_details(cve))
+    line_scanning_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(references):
+        for cve in cves:
+            cve_tracker.get_cve_record(cve)
+    single_pass_time = time.perf_counter() - start
+
+    corpus = [cve_tracker.get_cve_details(cve) for cve in cves]
+    start = time.perf_counter()
+    for cve_details in corpus:
+        line_scanning_parse(cve_details)
+    line_scanning_once_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for cve_details in corpus:
+        lib.parse_cve_record(cve_details)
+    single_pass_once_time = time.perf_counter() - start
+
+    # The line scanning parser never reached an Ubuntu-Description following the Description,
+    # so only the priority and public date are compared
+    differences = [
+        cve
+        for cve in cves
+        if line_scanning_parse(cve_tracker.get_cve_details(cve))[:2] != cve_tracker.get_cve_record(cve)[:2]
+    ]
+
+    click.echo("read and parse on every reference: {:8.3f}s".format(line_scanning_time))
+    click.echo(
+        "memoised records:                  {:8.3f}s ({:.1f}x)".format(
+            single_pass_time, line_scanning_time / single_pass_time
+        )
+    )
+    click.echo("parsing every file once, line scanning: {:8.3f}s".format(line_scanning_once_time))
+    click.echo(
+        "parsing every file once, single pass:   {:8.3f}s (also extracts package statuses)".format(
+            single_pass_once_time
+        )
+    )
+    click.echo("{} CVEs with a different priority or public date".format(len(differences)))
+    for cve in differences[:10]:
+        click.echo("  {}".format(cve))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+A local stand-in for Launchpad and ubuntu-cve-tracker, for running generate offline.
+
+FakeLaunchpadServer serves a Corpus of source packages over HTTP on localhost with
+a configurable latency and error rate: the Launchpad API queries generate makes,
+the changelogs and the ubuntu-cve-tracker files. FakeLaunchpad stands in for the
+launchpadlib Launchpad object and makes every API call as a request to the server,
+so API calls are counted, delayed and failed the same way as downloads are.
+launchpadlib itself is not used as it needs Launchpad's full WADL description of
+the API.
+"""
+
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+from types import SimpleNamespace
+from typing import Dict, List, NamedTuple, Tuple
+
+from ubuntu_cloud_image_changelog import lib, transport
+
+SERIES = "noble"
+ARCHITECTURE = "amd64"
+CVE_RECORD = """Candidate: {cve}
+PublicDate: 2024-01-01
+References:
+ https://www.cve.org/CVERecord?id={cve}
+Description:
+ A synthetic vulnerability used to benchmark CVE lookups.
+Ubuntu-Description:
+Notes:
+Priority: medium
+"""
+
+
+class SourcePackage(NamedTuple):
+    name: str
+    content: bytes
+    #: versions of the changelog blocks, newest first, and the offset each block starts at
+    versions: List[str]
+    starts: List[int]
+    binary_package_names: List[str]
+
+
+class Corpus:
+    """
+    size source packages with real changelogs, each updated by new_blocks changelog
+    blocks between the from and the to manifest. changelogs, the content of the
+    changelogs, are reused round robin when there are fewer than size of them.
+    """
+
+    def __init__(self, changelogs: List[bytes], size: int, new_blocks: int = 3):
+        self.new_blocks = new_blocks
+        self.source_packages: Dict[str, SourcePackage] = {}
+        # binary package name -> source package name
+        self.binary_packages: Dict[str, str] = {}
+        changelogs = [
+            changelog
+            for changelog in changelogs
+            if len(list(lib.CHANGELOG_HEADER_PATTERN.finditer(changelog))) > new_blocks
+        ]
+        if not changelogs:
+            raise ValueError("No changelog has more than {} blocks".format(new_blocks))
+        for index in range(size):
+            name = "src{:05d}".format(index)
+            content = changelogs[index % len(changelogs)]
+            headers = list(lib.CHANGELOG_HEADER_PATTERN.finditer(content))
+            binary_package_names = [name]
+            # some source packages build several binary packages that share one changelog
+            if index % 5 == 0:
+                binary_package_names.append("{}-data".format(name))
+            self.source_packages[name] = SourcePackage(
+                name,
+                content,
+                [header.group(2).decode("utf-8") for header in headers],
+                [header.start() for header in headers],
+                binary_package_names,
+            )
+            for binary_package_name in binary_package_names:
+                self.binary_packages[binary_package_name] = name
+
+    def changelog(self, source_package_name: str, version: str) -> bytes:
+        """returns the changelog as published with version, None if there is no such version"""
+        source_package = self.source_packages.get(source_package_name)
+        if source_package is None or version not in source_package.versions:
+            return None
+        return source_package.content[slice(source_package.starts[source_package.versions.index(version)], None)]
+
+    def manifests(self) -> Tuple[str, str]:
+        """
+        returns the from and to manifest. Every binary package is changed except for
+        one in 50 source packages that is only in the from manifest, as if removed, and
+        one in 50 that is only in the to manifest, as if added.
+        """
+        from_lines = []
+        to_lines = []
+        for index, source_package in enumerate(self.source_packages.values()):
+            from_version = source_package.versions[self.new_blocks]
+            to_version = source_package.versions[0]
+            for binary_package_name in source_package.binary_package_names:
+                if index % 50 != 49:
+                    from_lines.append("{}\t{}\n".format(binary_package_name, from_version))
+                if index % 50 != 48:
+                    to_lines.append("{}\t{}\n".format(binary_package_name, to_version))
+        return "".join(from_lines), "".join(to_lines)
+
+
+class FakeLaunchpadServer(http.server.ThreadingHTTPServer):
+    """
+    Serve corpus on localhost. Every request waits latency seconds and fails with a
+    503 with probability error_rate. requests counts the requests of each kind:
+    binaries, sources, published-binaries, +changelog and ubuntu-cve-tracker.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, corpus: Corpus, latency: float = 0.0, error_rate: float = 0.0):
+        super(FakeLaunchpadServer, self).__init__(("127.0.0.1", 0), FakeLaunchpadHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-launchpad", daemon=True).start()
+
+    def count(self, kind, error):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            self.errors += error
+
+
+class FakeLaunchpadHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, don't wait for an ACK in between
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        path = [urllib.parse.unquote(part) for part in parts.path.strip("/").split("/")]
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        kind = path[2] if path[:2] == ["api", "devel"] and len(path) > 2 else path[0]
+        error = random.random() < self.server.error_rate
+        self.server.count(kind, error)
+        time.sleep(self.server.latency)
+        if error:
+            self._respond(503, b"Service unavailable")
+            return
+        corpus = self.server.corpus
+        if kind == "binaries":
+            source_package = corpus.source_packages.get(corpus.binary_packages.get(query["binary_name"]))
+            published = []
+            if source_package and query["version"] in source_package.versions:
+                published.append(
+                    {"source_package_name": source_package.name, "source_package_version": query["version"]}
+                )
+            self._respond_json(published)
+        elif kind == "sources":
+            source_package = corpus.source_packages.get(query["source_name"])
+            published = []
+            if source_package and query["version"] in source_package.versions:
+                published.append({"source_package_name": source_package.name, "version": query["version"]})
+            self._respond_json(published)
+        elif kind == "published-binaries":
+            source_package = corpus.source_packages[query["source_name"]]
+            self._respond_json(
+                [
+                    {
+                        "distro_arch_series_link": "{}/ubuntu/{}/{}".format(self.server.url, SERIES, ARCHITECTURE),
+                        "binary_package_name": binary_package_name,
+                        "binary_package_version": query["version"],
+                    }
+                    for binary_package_name in source_package.binary_package_names
+                ]
+            )
+        elif kind == "+changelog":
+            changelog = corpus.changelog(path[3], path[4])
+            if changelog is None:
+                self._respond(404, b"Not found")
+            else:
+                self._respond(200, changelog)
+        elif kind == "ubuntu-cve-tracker" and path[2] == "active":
+            self._respond(200, CVE_RECORD.format(cve=path[3]).encode("utf-8"))
+        else:
+            self._respond(404, b"Not found")
+
+    def _respond_json(self, value):
+        self._respond(200, json.dumps(value).encode("utf-8"))
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LocalFetcher(transport.HTTPFetcher):
+    """A transport.HTTPFetcher that fetches ubuntu-cve-tracker files from server_url"""
+
+    def __init__(self, server_url, *args, **kwargs):
+        super(LocalFetcher, self).__init__(*args, **kwargs)
+        self.server_url = server_url
+
+    def get(self, url):
+        return super(LocalFetcher, self).get(url.replace("https://git.launchpad.net", self.server_url, 1))
+
+
+class _RootUri:
+    def __init__(self, url):
+        self.url = url
+
+    def append(self, path):
+        return self.url + path
+
+
+class FakeLaunchpad:
+    """The parts of a launchpadlib Launchpad object that generate uses, backed by a FakeLaunchpadServer"""
+
+    def __init__(self, server_url):
+        self._root_uri = _RootUri("{}/api/devel/".format(server_url))
+        self._browser = LocalFetcher(server_url)
+        self.distributions = {"ubuntu": FakeDistribution(self, server_url)}
+        # PPAs are not part of the corpus
+        self.people = {}
+
+    def call(self, operation, **parameters):
+        return json.loads(
+            self._browser.get(self._root_uri.append(operation + "?" + urllib.parse.urlencode(parameters)))
+        )
+
+
+class FakeDistribution:
+    def __init__(self, launchpad, server_url):
+        self.self_link = "{}/ubuntu".format(server_url)
+        self.main_archive = FakeArchive(launchpad)
+
+    def getSeries(self, name_or_version):
+        return FakeSeries(self, name_or_version)
+
+
+class FakeSeries:
+    def __init__(self, distribution, name):
+        self.name = name
+        self.self_link = "{}/{}".format(distribution.self_link, name)
+
+    def getDistroArchSeries(self, archtag):
+        return SimpleNamespace(
+            self_link="{}/{}".format(self.self_link, archtag), architecture_tag=archtag, distro_series=self
+        )
+
+
+class FakeArchive:
+    def __init__(self, launchpad):
+        self.launchpad = launchpad
+
+    def getPublishedBinaries(self, binary_name, distro_arch_series, version, **kwargs):
+        return [
+            SimpleNamespace(**binary)
+            for binary in self.launchpad.call(
+                "binaries", binary_name=binary_name, arch=distro_arch_series.architecture_tag, version=version
+            )
+        ]
+
+    def getPublishedSources(self, source_name, distro_series, version, **kwargs):
+        return [
+            FakeSourcePublication(self.launchpad, **source)
+            for source in self.launchpad.call("sources", source_name=source_name, version=version)
+        ]
+
+
+class FakeSourcePublication:
+    def __init__(self, launchpad, source_package_name, version):
+        self.launchpad = launchpad
+        self.source_package_name = source_package_name
+        self.source_package_version = version
+
+    def changelogUrl(self):
+        return "https://launchpad.net/+changelog/{}/{}".format(
+            urllib.parse.quote(self.source_package_name), urllib.parse.quote(self.source_package_version)
+        )
+
+    def getPublishedBinaries(self, **kwargs):
+        return [
+            SimpleNamespace(**binary)
+            for binary in self.launchpad.call(
+                "published-binaries", source_name=self.source_package_name, version=self.source_package_version
+            )
+        ]
@@ -0,0 +1,166 @@
+"""
+Run generate end to end against a local stand-in for Launchpad and ubuntu-cve-tracker,
+with no network access, and report the wall time, the API calls and the peak RSS.
+
+Run from the directory above benchmarks, by default with the changelogs installed on
+this system as the corpus:
+
+    python -m benchmarks.generate
+    python -m benchmarks.generate --size 500 --latency 0.05 --error-rate 0.02
+    python -m benchmarks.generate --highlight-cves /usr/share/doc/*/changelog.Debian.gz
+
+Each size is run twice in a new process: "cold" with an empty cache directory and
+"warm" with the cache left behind by the cold run.
+"""
+
+import contextlib
+import glob
+import gzip
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import click
+
+from benchmarks.fake_launchpad import (
+    ARCHITECTURE,
+    SERIES,
+    Corpus,
+    FakeLaunchpad,
+    FakeLaunchpadServer,
+    LocalFetcher,
+)
+from ubuntu_cloud_image_changelog import cli, launchpadagent, lib, transport
+
+REQUEST_KINDS = ["binaries", "sources", "published-binaries", "+changelog", "ubuntu-cve-tracker"]
+
+
+def read_changelog(filename):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rb") as changelog_file:
+        return changelog_file.read()
+
+
+def run_generate(connection, corpus, directory, cache_dir, latency, error_rate, jobs, highlight_cves):
+    """Run generate in this process against a new FakeLaunchpadServer and send the results to connection"""
+    server = FakeLaunchpadServer(corpus, latency=latency, error_rate=error_rate)
+    server.start()
+    # This process only runs generate, so the stand-ins are patched in for good
+    launchpadagent.get_launchpad = lambda **kwargs: FakeLaunchpad(server.url)
+    transport.HTTPFetcher = lambda *args, **kwargs: LocalFetcher(server.url, *args, **kwargs)
+    # Retry quickly, the errors are injected and the point is to measure the work done
+    lib.retry_policy = lib.RetryPolicy(base_delay=0.01, max_delay=0.1)
+
+    args = [
+        "--from-series",
+        SERIES,
+        "--to-series",
+        SERIES,
+        "--image-architecture",
+        ARCHITECTURE,
+        "--from-manifest",
+        os.path.join(directory, "from.manifest"),
+        "--to-manifest",
+        os.path.join(directory, "to.manifest"),
+        "--output-json",
+        os.path.join(directory, "changelog.json"),
+        "--jobs",
+        str(jobs),
+        "--cache-dir",
+        cache_dir,
+    ]
+    if highlight_cves:
+        args.append("--highlight-cves")
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            cli.generate.main(args, standalone_mode=False)
+            error = None
+        except Exception as ex:
+            error = "{}: {}".format(type(ex).__name__, ex)
+    wall_time = time.perf_counter() - start
+    server.shutdown()
+    connection.send(
+        {
+            "wall_time": wall_time,
+            "requests": server.requests,
+            "errors": server.errors,
+            "retries": lib.retry_policy.retries,
+            # kilobytes on Linux
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "error": error,
+        }
+    )
+
+
+@click.command()
+@click.argument("changelogs", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--size",
+    "sizes",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=[50, 500, 5000],
+    show_default=True,
+    help="Number of changed source packages. Can be specified multiple times.",
+)
+@click.option("--new-blocks", type=int, default=3, show_default=True, help="Changelog blocks in each package update")
+@click.option("--latency", type=float, default=0.005, show_default=True, help="Seconds each request takes")
+@click.option("--error-rate", type=float, default=0.0, show_default=True, help="Fraction of requests that fail")
+@click.option("--jobs", type=int, default=4, show_default=True, help="generate --jobs")
+@click.option("--highlight-cves", is_flag=True, help="generate --highlight-cves")
+def main(changelogs, sizes, new_blocks, latency, error_rate, jobs, highlight_cves):
+    if not changelogs:
+        changelogs = sorted(glob.glob("/usr/share/doc/*/changelog.Debian.gz"))
+    contents = [read_changelog(changelog) for changelog in changelogs]
+    # fork so that each run starts from the same state and has its own peak RSS
+    context = multiprocessing.get_context("fork")
+
+    click.echo(
+        "{:>6} {:>5} {:>9} {:>9} {:>9} {:>10} {:>9} {:>6} {:>8} {:>10}".format(
+            "size", "cache", "wall (s)", "binaries", "sources", "changelogs", "cves", "errors", "retries", "RSS (MiB)"
+        )
+    )
+    for size in sizes:
+        corpus = Corpus(contents, size, new_blocks=new_blocks)
+        with tempfile.TemporaryDirectory() as directory:
+            from_manifest, to_manifest = corpus.manifests()
+            with open(os.path.join(directory, "from.manifest"), "w") as manifest:
+                manifest.write(from_manifest)
+            with open(os.path.join(directory, "to.manifest"), "w") as manifest:
+                manifest.write(to_manifest)
+            cache_dir = os.path.join(directory, "cache")
+            for cache_state in ["cold", "warm"]:
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=run_generate,
+                    args=(sender, corpus, directory, cache_dir, latency, error_rate, jobs, highlight_cves),
+                )
+                process.start()
+                result = receiver.recv()
+                process.join()
+                requests = result["requests"]
+                click.echo(
+                    "{:>6} {:>5} {:>9.2f} {:>9} {:>9} {:>10} {:>9} {:>6} {:>8} {:>10.1f}".format(
+                        size,
+                        cache_state,
+                        result["wall_time"],
+                        requests.get("binaries", 0),
+                        requests.get("sources", 0) + requests.get("published-binaries", 0),
+                        requests.get("+changelog", 0),
+                        requests.get("ubuntu-cve-tracker", 0),
+                        result["errors"],
+                        result["retries"],
+                        result["max_rss"] / 1024,
+                    )
+                )
+                if result["error"]:
+                    click.echo("generate failed: {}".format(result["error"]), err=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measure how long starting the command line interface takes with python -X importtime,
+and check that it does not import the heavy dependencies only generating a changelog
+needs.
+
+Run from the directory above benchmarks:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --max-ms 150
+
+For each command the best of --repeat runs is reported, as the wall time of the whole
+process and as the time spent importing modules, followed by the slowest imports of
+that run. The exit status is 1 if a command imports a heavy dependency it does not
+need or if --help spends longer than --max-ms importing.
+"""
+
+import subprocess
+import sys
+import time
+from typing import NamedTuple
+
+import click
+
+CLI_MODULE = "ubuntu_cloud_image_changelog.cli"
+# Only needed to generate a changelog, or for the schema command in the case of pydantic
+HEAVY_MODULES = ["launchpadlib", "lazr.restfulclient", "httplib2", "debian", "pydantic"]
+COMMANDS = {
+    "--help": [],
+    "schema": ["pydantic"],
+}
+
+
+class Import(NamedTuple):
+    module: str
+    #: 0 for modules imported by __main__, 1 for modules imported by those and so on
+    depth: int
+    cumulative_us: int
+
+
+def run_importtime(args):
+    """returns the wall time of running the cli with args and the Imports it made"""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", CLI_MODULE] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    wall_time = time.perf_counter() - start
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, module = line.partition("import time:")[2].split("|")
+        name = module.lstrip()
+        # nested imports are indented by two spaces per level after the separating space
+        imports.append(Import(name, (len(module) - len(name) - 1) // 2, int(cumulative_us)))
+    return wall_time, imports
+
+
+@click.command()
+@click.option("--repeat", type=int, default=5, show_default=True, help="Best of this many runs is reported")
+@click.option("--top", type=int, default=10, show_default=True, help="Number of slowest imports to list")
+@click.option("--max-ms", type=float, default=None, help="Fail if --help spends longer than this importing")
+def main(repeat, top, max_ms):
+    failed = False
+    for command, allowed_modules in COMMANDS.items():
+        runs = [run_importtime([command]) for _ in range(repeat)]
+        wall_time, imports = min(runs, key=lambda run: run[0])
+        # The cli module runs as __main__ and is not listed, only what it and the interpreter import
+        import_time = sum(imported.cumulative_us for imported in imports if imported.depth == 0)
+        click.echo("{}: {:.1f} ms wall, {:.1f} ms importing".format(command, wall_time * 1000, import_time / 1000))
+        for imported in sorted(imports, key=lambda imported: imported.cumulative_us, reverse=True)[:top]:
+            click.echo("  {:>9.1f} ms  {}".format(imported.cumulative_us / 1000, imported.module))
+
+        heavy_modules = sorted(
+            {
+                heavy_module
+                for imported in imports
+                for heavy_module in HEAVY_MODULES
+                if heavy_module not in allowed_modules
+                and (imported.module == heavy_module or imported.module.startswith(heavy_module + "."))
+            }
+        )
+        if heavy_modules:
+            click.echo("{} imports {}".format(command, ", ".join(heavy_modules)), err=True)
+            failed = True
+        if command == "--help" and max_ms is not None and import_time / 1000 > max_ms:
+            click.echo("{} imports take longer than {} ms".format(command, max_ms), err=True)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Persistent on-disk cache shared between runs."""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+CACHE_DIRECTORY_NAME = "ubuntu-cloud-image-changelog"
+LOCK_FILENAME = ".lock"
+# Entries used more recently than this are never evicted so that a concurrent run
+# does not lose a cached file between looking it up and reading it.
+EVICTION_GRACE_PERIOD = 60 * 60
+# Leftover temporary files from interrupted writes older than this are removed.
+STALE_TEMPORARY_FILE_AGE = 24 * 60 * 60
+
+
+def default_cache_directory():
+    """returns the default persistent cache directory. Under the snap this is
+    $SNAP_USER_COMMON/cache, otherwise $XDG_CACHE_HOME/ubuntu-cloud-image-changelog"""
+    if os.environ.get("SNAP_USER_COMMON"):
+        return os.path.join(os.environ["SNAP_USER_COMMON"], "cache")
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(xdg_cache_home, CACHE_DIRECTORY_NAME)
+
+
+def write_cache_file(cache_filename, content):
+    """
+    Atomically write content to cache_filename.
+
+    The content is written to a temporary file in the same directory and renamed
+    into place so that a concurrent reader never sees a partially written file.
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(cache_filename), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_filename, cache_filename)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+
+
+def touch(filename):
+    """Record that a cache entry was just used. Entry modification times are used
+    as last used times for LRU eviction; the content of an entry never changes."""
+    try:
+        os.utime(filename)
+    except OSError:
+        pass  # evicted by another process, the caller will notice when reading
+
+
+class DiskCache:
+    """
+    A size and age bounded directory of cache entries.
+
+    Entries are written atomically (see write_cache_file) so several processes
+    can share one cache directory. Eviction removes the least recently used entries
+    and is serialised between processes with a lock file.
+    """
+
+    def __init__(self, directory: str, max_size: int, max_age: int):
+        """
+        :param str directory: Cache root directory, created if missing
+        :param int max_size: Maximum total size of all entries in bytes
+        :param int max_age: Entries not used for this many seconds are evicted
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, *names):
+        """returns a directory under the cache root, creating it if needed"""
+        path = os.path.join(self.directory, *names)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def store(self, name):
+        """returns the JsonStore called name in the cache root"""
+        return JsonStore(os.path.join(self.directory, "{}.json".format(name)))
+
+    def _entries(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(LOCK_FILENAME):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # removed by another process
+                entries.append((stat.st_mtime, stat.st_size, path, filename))
+        return entries
+
+    def evict(self):
+        """
+        Remove entries not used within max_age and then the least recently used
+        entries until the cache is no larger than max_size. If another process
+        is already evicting, this is a no-op.
+        """
+        with open(os.path.join(self.directory, LOCK_FILENAME), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            now = time.time()
+            entries = sorted(self._entries())
+            total_size = sum(size for _, size, _, _ in entries)
+            evicted = 0
+            for mtime, size, path, filename in entries:
+                age = now - mtime
+                if age < EVICTION_GRACE_PERIOD:
+                    break  # entries are sorted by last use so the rest are recent too
+                is_stale_tmp = filename.startswith(".tmp-") and age > STALE_TEMPORARY_FILE_AGE
+                if not is_stale_tmp and age < self.max_age and total_size <= self.max_size:
+                    continue
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+                evicted += 1
+            if evicted:
+                logging.debug("Evicted %d entries from cache %s", evicted, self.directory)
+
+
+class JsonStore:
+    """
+    A JSON object of immutable entries shared between runs and processes.
+
+    Entries are only ever added. Concurrent updates from several processes are
+    merged under a lock so no process loses another's entries.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def load(self) -> dict:
+        try:
+            with open(self.filename, "rb") as store_file:
+                entries = json.load(store_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning("Ignoring corrupt cache file %s", self.filename)
+            return {}
+        # A store read by every run but rarely added to is still in use
+        touch(self.filename)
+        return entries
+
+    def update(self, entries: dict, keep: Optional[Callable[[str, Any], bool]] = None):
+        """Add entries. If keep is set, stored entries for which keep(key, value) is false are dropped"""
+        if not entries:
+            return
+        with open("{}{}".format(self.filename, LOCK_FILENAME), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            stored_entries = self.load()
+            if keep:
+                stored_entries = {key: value for key, value in stored_entries.items() if keep(key, value)}
+            stored_entries.update(entries)
+            write_cache_file(self.filename, json.dumps(stored_entries).encode("utf-8"))
+
+
+class NegativeCache:
+    """
+    Lookups that found nothing, remembered for ttl seconds.
+
+    Something that is missing may be published later, so unlike the other cache
+    entries misses expire. A miss is identified by the parts of its key, e.g.
+    ("binary", series, name, version, archive). If store is set, misses are
+    shared between runs.
+    """
+
+    def __init__(self, store: Optional[JsonStore] = None, ttl: int = 24 * 60 * 60):
+        self.store = store
+        self.ttl = ttl
+        # lookups skipped because they are known to find nothing
+        self.hits = 0
+        # lookups that found nothing during this run
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._missed_at: Dict[str, float] = self.store.load() if self.store else {}
+        self._new_missed_at: Dict[str, float] = {}
+
+    def _is_current(self, missed_at: float) -> bool:
+        return time.time() - missed_at < self.ttl
+
+    def is_missing(self, *key: str) -> bool:
+        """returns True if the lookup for key found nothing less than ttl seconds ago"""
+        with self._lock:
+            missed_at = self._missed_at.get(" ".join(key))
+            if missed_at is None or not self._is_current(missed_at):
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, *key: str):
+        """Record that the lookup for key found nothing"""
+        with self._lock:
+            self._missed_at[" ".join(key)] = self._new_missed_at[" ".join(key)] = time.time()
+            self.misses += 1
+
+    def save(self):
+        """Add the misses of this run to the store and drop expired ones"""
+        if not self.store:
+            return
+        with self._lock:
+            new_missed_at, self._new_missed_at = self._new_missed_at, {}
+        self.store.update(new_missed_at, keep=lambda _, missed_at: self._is_current(missed_at))
+
+
+class JsonEntryStore:
+    """
+    A directory of JSON entries, one file per key, for values too large or too
+    many to keep in one JsonStore. Entries are written atomically and evicted
+    like any other file in the DiskCache.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _filename(self, key: str):
+        return os.path.join(self.directory, "{}.json".format(hashlib.sha256(key.encode("utf-8")).hexdigest()))
+
+    def get(self, key: str) -> Optional[dict]:
+        """returns the entry stored for key, or None if there is none"""
+        filename = self._filename(key)
+        try:
+            with open(filename, "rb") as entry_file:
+                entry = json.load(entry_file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.warning("Ignoring corrupt cache file %s", filename)
+            return None
+        touch(filename)
+        return entry
+
+    def put(self, key: str, entry: dict):
+        write_cache_file(self._filename(key), json.dumps(entry).encode("utf-8"))
+
+
+class ChangelogStore:
+    """
+    Downloaded source package changelogs, compressed and deduplicated.
+
+    The changelog of a source package version is nearly always the changelog of
+    the previous version with new entries added at the top. Each source package
+    has a directory of zlib compressed base changelogs and an index of the base
+    that every stored version is the tail of, so a version that is the tail of
+    a newer stored version takes no space of its own. Storing a newer version
+    replaces the bases it extends.
+    """
+
+    INDEX_FILENAME = "index.json"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _source_directory(self, source_package_name):
+        return os.path.join(self.directory, source_package_name)
+
+    def _index(self, source_package_name):
+        return JsonStore(os.path.join(self._source_directory(source_package_name), self.INDEX_FILENAME))
+
+    def _base_filename(self, source_package_name, base_version):
+        return os.path.join(self._source_directory(source_package_name), "{}.zlib".format(base_version))
+
+    def _read_base(self, source_package_name, base_version):
+        with open(self._base_filename(source_package_name, base_version), "rb") as base_file:
+            return zlib.decompress(base_file.read())
+
+    def get(self, source_package_name: str, source_package_version: str) -> Optional[bytes]:
+        """returns the stored changelog or None if it is not stored"""
+        index = self._index(source_package_name)
+        entry = index.load().get(source_package_version)
+        if not entry:
+            return None
+        try:
+            base = self._read_base(source_package_name, entry["base"])
+        except (OSError, zlib.error):
+            return None  # evicted or replaced by a newer base since the index was read
+        touch(self._base_filename(source_package_name, entry["base"]))
+        offset = entry["offset"]
+        return base[offset:]
+
+    def put(self, source_package_name: str, source_package_version: str, content: bytes):
+        os.makedirs(self._source_directory(source_package_name), exist_ok=True)
+        index = self._index(source_package_name)
+        entries = index.load()
+        bases = {version: entry["length"] for version, entry in entries.items() if entry["base"] == version}
+
+        # Is this version the tail of a stored base?
+        for base_version, base_length in bases.items():
+            if base_length < len(content):
+                continue
+            try:
+                base = self._read_base(source_package_name, base_version)
+            except (OSError, zlib.error):
+                continue
+            if base.endswith(content):
+                index.update(
+                    {
+                        source_package_version: {
+                            "base": base_version,
+                            "offset": len(base) - len(content),
+                            "length": len(content),
+                        }
+                    }
+                )
+                return
+
+        write_cache_file(self._base_filename(source_package_name, source_package_version), zlib.compress(content, 9))
+        updated_entries = {
+            source_package_version: {"base": source_package_version, "offset": 0, "length": len(content)}
+        }
+        # Stored bases that are the tail of this version are no longer needed
+        replaced_bases = []
+        for base_version, base_length in bases.items():
+            if base_length >= len(content):
+                continue
+            try:
+                base = self._read_base(source_package_name, base_version)
+            except (OSError, zlib.error):
+                continue
+            if content.endswith(base):
+                replaced_bases.append(base_version)
+                for version, entry in entries.items():
+                    if entry["base"] == base_version:
+                        updated_entries[version] = {
+                            "base": source_package_version,
+                            "offset": len(content) - base_length + entry["offset"],
+                            "length": entry["length"],
+                        }
+        index.update(updated_entries)
+        for base_version in replaced_bases:
+            try:
+                os.unlink(self._base_filename(source_package_name, base_version))
+            except FileNotFoundError:
+                pass
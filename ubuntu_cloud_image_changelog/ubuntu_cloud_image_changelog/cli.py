@@ -1,26 +1,18 @@
 """Console script for ubuntu_cloud_image_changelog."""
 
+import concurrent.futures
+import functools
 import json
 import os
-import tempfile
 from typing import List, Optional
 
 import click
 
-from ubuntu_cloud_image_changelog import launchpadagent, lib
-from ubuntu_cloud_image_changelog.models import (
-    Added,
-    ChangelogModel,
-    DebPackage,
-    DebSummary,
-    Diff,
-    FromVersion,
-    Removed,
-    SnapPackage,
-    SnapSummary,
-    Summary,
-    ToVersion,
-)
+from ubuntu_cloud_image_changelog import cache, tracing
+
+# launchpadlib, python-debian and pydantic take a noticeable fraction of a second to
+# import, so the modules that use them are imported by the commands that need them:
+# ubuntu_cloud_image_changelog.generation, lib, launchpadagent and models.
 
 
 @click.group()
@@ -31,14 +23,97 @@ def cli(ctx):
     ctx.ensure_object(dict)
 
 
-@cli.command()
-@click.option(
-    "--lp-credentials-store",
-    envvar="LP_CREDENTIALS_STORE",
-    required=False,
-    help="An optional path to an already configured launchpad credentials store.",
+def launchpad_and_cache_options(func):
+    """Options shared by the generate and generate-batch commands"""
+    options = [
+        click.option(
+            "--lp-credentials-store",
+            envvar="LP_CREDENTIALS_STORE",
+            required=False,
+            help="An optional path to an already configured launchpad credentials store.",
+            default=None,
+        ),
+        click.option(
+            "--jobs",
+            "-j",
+            help="Number of packages to resolve and download changelogs for concurrently.",
+            type=click.IntRange(min=1),
+            default=4,
+            show_default=True,
+        ),
+        click.option(
+            "--cache-dir",
+            envvar="UBUNTU_CLOUD_IMAGE_CHANGELOG_CACHE_DIR",
+            help="Directory to cache downloaded changelogs and Launchpad API data in between runs. "
+            "Default: {}".format(cache.default_cache_directory()),
+            type=click.Path(file_okay=False, writable=True),
+            default=cache.default_cache_directory,
+        ),
+        click.option(
+            "--cache-max-size",
+            help="Maximum size of the cache in MiB. Least recently used entries are evicted after each run.",
+            type=click.IntRange(min=0),
+            default=2048,
+            show_default=True,
+        ),
+        click.option(
+            "--cache-max-age",
+            help="Evict cache entries that have not been used for this many days.",
+            type=click.IntRange(min=0),
+            default=90,
+            show_default=True,
+        ),
+        click.option(
+            "--record",
+            "record_dir",
+            help="Record the Launchpad data, changelogs and ubuntu-cve-tracker files used by this run "
+            "in this directory, instead of the --cache-dir, so that the run can be repeated with --replay.",
+            type=click.Path(file_okay=False, writable=True),
+            default=None,
+        ),
+        click.option(
+            "--replay",
+            "replay_dir",
+            help="Replay a directory recorded with --record: use only the data in it, with no Launchpad "
+            "login and no network access.",
+            type=click.Path(exists=True, file_okay=False),
+            default=None,
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+cve_tracker_option = click.option(
+    "--cve-tracker-dir",
+    help="A local ubuntu-cve-tracker checkout, or a tarball of one, to look up CVE details in "
+    "instead of git.launchpad.net. Only used when highlighting CVEs.",
+    type=click.Path(exists=True),
     default=None,
 )
+
+trace_file_option = click.option(
+    "--trace-file",
+    help="Write timing spans of the run, e.g. of every Launchpad query, changelog download and changelog "
+    "parse and of each package, to this file in Chrome trace event format. Open it in chrome://tracing "
+    "or https://ui.perfetto.dev to see where the time went.",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+)
+
+
+def start_tracing(ctx, trace_file: Optional[str]):
+    """Record timing spans if trace_file is set, writing them to it when the command finishes"""
+    if trace_file:
+        tracing.start()
+        ctx.call_on_close(functools.partial(tracing.stop, trace_file))
+
+
+@cli.command()
+@launchpad_and_cache_options
+@cve_tracker_option
+@trace_file_option
 @click.option("--from-series", help='the Ubuntu series eg. "20.04" or "focal"', required=True)
 @click.option("--to-series", help='the Ubuntu series eg. "20.04" or "focal"', required=True)
 @click.option(
@@ -50,8 +125,8 @@ def cli(ctx):
 @click.option(
     "--from-manifest",
     required=True,
-    type=click.File("rb"),
-    help="From manifest."
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    help="From manifest. Use - to read it from stdin. Manifests ending in .gz or .xz are decompressed."
     "{}".format(
         "When using the ubuntu-cloud-image-changelog " "snap this config must reside under $HOME."
         if os.environ.get("SNAP", None)
@@ -61,8 +136,8 @@ def cli(ctx):
 @click.option(
     "--to-manifest",
     required=True,
-    type=click.File("rb"),
-    help="From manifest."
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    help="To manifest. Use - to read it from stdin. Manifests ending in .gz or .xz are decompressed."
     "{}".format(
         "When using the ubuntu-cloud-image-changelog " "snap this config must reside under $HOME."
         if os.environ.get("SNAP", None)
@@ -112,6 +187,16 @@ def cli(ctx):
     default=None,
     show_default=True,
 )
+@click.option(
+    "--previous-changelog-json",
+    "previous_changelog_jsons",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="A JSON changelog previously generated with --output-json, e.g. for serials in between "
+    "--from-manifest and --to-manifest. Changed packages whose changes link up through previous "
+    "changelogs are composed from them instead of being resolved again. "
+    "Multiple --previous-changelog-json options can be specified",
+)
 @click.pass_context
 def generate(
     ctx,
@@ -120,571 +205,181 @@ def generate(
     to_series: str,
     from_serial: str,
     to_serial: str,
-    from_manifest: click.File,
-    to_manifest: click.File,
+    from_manifest: str,
+    to_manifest: str,
     ppas: List[str],
     image_architecture: str,
     highlight_cves: bool,
     output_json: Optional[str],
     output_json_pretty: bool,
     notes: Optional[str],
+    previous_changelog_jsons: List[str],
+    jobs: int,
+    cache_dir: str,
+    cache_max_size: int,
+    cache_max_age: int,
+    record_dir: Optional[str],
+    replay_dir: Optional[str],
+    cve_tracker_dir: Optional[str],
+    trace_file: Optional[str],
 ):
-    from_manifest_lines = from_manifest.readlines()
-    to_manifest_lines = to_manifest.readlines()
-    from_deb_packages = {}
-    to_deb_packages = {}
-    from_snap_packages = {}
-    to_snap_packages = {}
-    snap_package_prefix = "snap:"
-
-    removed_deb_packages = []
-
-    deb_package_added = {}
-
-    deb_package_diffs = {}
-
-    removed_snap_packages = []
-
-    snap_package_added = {}
-
-    snap_package_diffs = {}
-    with tempfile.TemporaryDirectory(prefix="ubuntu-cloud-image-changelog") as tmp_cache_directory:
-        launchpad = launchpadagent.get_launchpad(
-            launchpadlib_dir=tmp_cache_directory,
-            lp_credentials_store=lp_credentials_store,
-        )
-        ubuntu = launchpad.distributions["ubuntu"]
-        to_lp_series = ubuntu.getSeries(name_or_version=to_series)
-        from_lp_series = ubuntu.getSeries(name_or_version=from_series)
-        to_lp_arch_series = to_lp_series.getDistroArchSeries(archtag=image_architecture)
-        from_lp_arch_series = from_lp_series.getDistroArchSeries(archtag=image_architecture)
-
-        # Store all changelog items in a ChangelogModel object so we can output in different formats and not just txt.
-        changelog = ChangelogModel(
-            notes=notes,
-            from_series=from_series,
-            to_series=to_series,
-            from_serial=from_serial,
-            to_serial=to_serial,
-            from_manifest_filename=from_manifest.name,
-            to_manifest_filename=to_manifest.name,
-            summary=Summary(
-                snap=SnapSummary(added=[], removed=[], diff=[]),
-                deb=DebSummary(added=[], removed=[], diff=[]),
-            ),
-            diff=Diff(deb=[], snap=[]),
-            added=Added(deb=[], snap=[]),
-            removed=Removed(deb=[], snap=[]),
-        )
-
-        # parse the from manifest
-        for from_manifest_line in from_manifest_lines:
-            package, *version = from_manifest_line.decode("utf-8").strip().split("\t")
-            if package.startswith(snap_package_prefix):
-                package = package.replace(snap_package_prefix, "")
-                from_snap_packages[package] = version[1]
-            else:
-                # packages ending with ':amd64' or ':arm64' are special
-                package = lib.arch_independent_package_name(package)
-                from_deb_packages[package] = version[0]
-
-        # parse the to manifest
-        for to_manifest_line in to_manifest_lines:
-            package, *version = to_manifest_line.decode("utf-8").strip().split("\t")
-            if package.startswith(snap_package_prefix):
-                package = package.replace(snap_package_prefix, "")
-                to_snap_packages[package] = version[1]
-            else:
-                # packages ending with ':amd64' or ':arm64' are special
-                package = lib.arch_independent_package_name(package)
-                to_deb_packages[package] = version[0]
-
-        # Are there any snap package diffs?
-        if from_snap_packages or to_snap_packages:
-            for package, version in from_snap_packages.items():
-                if package not in to_snap_packages.keys():
-                    removed_snap_packages.append(package)
-                    removed_snap_package = SnapPackage(
-                        name=package,
-                        from_version=FromVersion(version=version),
-                        to_version=ToVersion(version=None),
-                    )
-                    changelog.removed.snap.append(removed_snap_package)
-
-            for package, version in to_snap_packages.items():
-                if package not in from_snap_packages.keys():
-                    snap_package_added[package] = {
-                        "from": None,
-                        "to": version,
-                    }
-
-            for to_package, to_package_version in to_snap_packages.items():
-                # only need to find diff for packages that are not new
-                if to_package not in snap_package_added.keys():
-                    from_package_version = from_snap_packages[to_package]
-                    if from_package_version != to_package_version:
-                        snap_package_diffs[to_package] = {
-                            "from": from_package_version,
-                            "to": to_package_version,
-                        }
-
-            changelog.summary.snap = SnapSummary(
-                added=list(snap_package_added.keys()),
-                removed=removed_snap_packages,
-                diff=list(snap_package_diffs.keys()),
-            )
-
-            click.echo("Snap packages added: {}".format(list(snap_package_added.keys())))
-            click.echo("Snap packages removed: {}".format(removed_snap_packages))
-            click.echo("Snap packages changed: {}".format(list(snap_package_diffs.keys())))
-
-        # Are there any deb package diffs?
-        if from_deb_packages or to_deb_packages:
-            for package, version in from_deb_packages.items():
-                if package not in to_deb_packages.keys():
-                    removed_deb_packages.append(package)
-                    # Get the source package name and source package version for the removed package
-                    (
-                        removed_source_package_name,
-                        removed_source_package_version,
-                    ) = lib.get_source_package_details(
-                        ubuntu,
-                        launchpad,
-                        to_lp_arch_series,
-                        package,
-                        version,
-                        ppas,
-                    )
-
-                    removed_deb_package = DebPackage(
-                        name=package,
-                        from_version=FromVersion(
-                            version=version,
-                            source_package_name=removed_source_package_name,
-                            source_package_version=removed_source_package_version,
-                        ),
-                        to_version=ToVersion(version=None),
-                        is_version_downgrade=False,
-                    )
-
-                    changelog.removed.deb.append(removed_deb_package)
-
-            for to_package, to_package_version in to_deb_packages.items():
-                if to_package not in from_deb_packages.keys():
-                    # add the summary of version changes for this package fo easier parsing later
-                    deb_package_added[to_package] = {
-                        "from": None,
-                        "to": to_package_version,
-                    }
-
-            for to_package, to_package_version in to_deb_packages.items():
-                # only need to find diff for packages that are not new
-                if to_package not in deb_package_added.keys():
-                    from_package_version = from_deb_packages[to_package]
-                    if from_package_version != to_package_version:
-                        # add the summary of version changes for this package fo easier parsing later
-                        deb_package_diffs[to_package] = {
-                            "from": from_package_version,
-                            "to": to_package_version,
-                        }
-
-            changelog.summary.deb = DebSummary(
-                added=list(deb_package_added.keys()),
-                removed=removed_deb_packages,
-                diff=list(deb_package_diffs.keys()),
-            )
-            click.echo("Deb packages added: {}".format(list(deb_package_added.keys())))
-            click.echo("Deb packages removed: {}".format(removed_deb_packages))
-            click.echo("Deb packages changed: {}".format(list(deb_package_diffs.keys())))
-
-        if snap_package_diffs or snap_package_added:
-            click.echo(
-                "\n** Package version diffs for for changed snap packages "
-                "below. Full changelog for snap packages are not listed **\n"
+    start_tracing(ctx, trace_file)
+    if from_manifest == "-" and to_manifest == "-":
+        raise click.UsageError("Only one of --from-manifest and --to-manifest can be read from stdin")
+    from ubuntu_cloud_image_changelog import generation, lib
+
+    disk_cache, session, source_packages, changelog_diffs = generation.open_run(
+        lp_credentials_store,
+        cache_dir,
+        cache_max_size,
+        cache_max_age,
+        record_dir,
+        replay_dir,
+        [(to_series, image_architecture), (from_series, image_architecture)],
+    )
+    resolver = lib.ChangelogResolver(
+        session,
+        from_series=from_series,
+        to_series=to_series,
+        image_architecture=image_architecture,
+        cache_directory=disk_cache.path("changelogs"),
+        ppas=ppas,
+        highlight_cves=highlight_cves,
+        source_packages=source_packages,
+        missing=source_packages.missing,
+        changelog_diffs=changelog_diffs,
+        cve_tracker=generation.get_cve_tracker(cve_tracker_dir, disk_cache, highlight_cves, replay_dir),
+        previous_changelogs=generation.load_previous_changelogs(
+            previous_changelog_jsons, [from_series, to_series], image_architecture
+        ),
+    )
+    try:
+        with lib.open_manifest(from_manifest) as from_manifest_lines, lib.open_manifest(
+            to_manifest
+        ) as to_manifest_lines, concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            changelog = generation.generate_changelog(
+                executor,
+                resolver,
+                from_manifest_filename=from_manifest,
+                from_manifest_lines=from_manifest_lines,
+                to_manifest_filename=to_manifest,
+                to_manifest_lines=to_manifest_lines,
+                from_serial=from_serial,
+                to_serial=to_serial,
+                notes=notes,
             )
+    finally:
+        generation.save_run(source_packages)
 
-            # for each of the snap package diffs list the diff in versions
-            for package, from_to in snap_package_added.items():
-                click.echo(
-                    "==========================================================="
-                    "==========================================================="
-                )
-                click.echo(
-                    "{} version '{}' was added.".format(
-                        package,
-                        from_to["to"],
-                    )
-                )
-
-                added_snap_package_to_version = ToVersion(version=from_to["to"])
-                added_snap_package_from_version = FromVersion(version=from_to["from"])
-                added_snap_package = SnapPackage(
-                    name=package,
-                    from_version=added_snap_package_from_version,
-                    to_version=added_snap_package_to_version,
-                )
-
-                changelog.added.snap.append(added_snap_package)
-                click.echo()
-
-            # for each of the snap package diffs list the diff in versions
-            for package, from_to in snap_package_diffs.items():
-                click.echo(
-                    "==========================================================="
-                    "==========================================================="
-                )
-                click.echo(
-                    "{} changed from version '{}' to version '{}'".format(package, from_to["from"], from_to["to"])
-                )
-
-                diff_snap_package_to_version = ToVersion(version=from_to["to"])
-                diff_snap_package_from_version = FromVersion(version=from_to["from"])
-                diff_snap_package = SnapPackage(
-                    name=package,
-                    from_version=diff_snap_package_from_version,
-                    to_version=diff_snap_package_to_version,
-                )
-
-                changelog.diff.snap.append(diff_snap_package)
-                click.echo()
+    generation.finish_run(disk_cache, source_packages, changelog_diffs, evict=not (record_dir or replay_dir))
 
-        if deb_package_diffs or deb_package_added:
-            click.echo("\n** Changelogs for added and changed deb packages " "below: **\n")
-
-            # for each of the deb package diffs and new packages download the
-            # changelog
-            for package, from_to in deb_package_added.items():
-                click.echo(
-                    "==========================================================="
-                    "==========================================================="
-                )
-                (
-                    to_source_package_name,
-                    to_source_package_version,
-                ) = lib.get_source_package_details(
-                    ubuntu,
-                    launchpad,
-                    to_lp_arch_series,
-                    package,
-                    from_to["to"],
-                    ppas,
-                )
-                to_package_changelog_file = lib.get_changelog(
-                    launchpad,
-                    ubuntu,
-                    to_lp_series,
-                    tmp_cache_directory,
-                    to_source_package_name,
-                    to_source_package_version,
-                    ppas,
-                )
-
-                # Is the source package of this added binary package the same as the source package of a removed
-                # binary package? If so then this is likley a binary package rename and we can get the changelog between
-                # the source package version removed and the source package version added.
-                notes = None
-                version_added_changelogs = []
-                for removed_deb_package in changelog.removed.deb:
-                    if removed_deb_package.from_version.source_package_name == to_source_package_name:
-                        removed_source_package_name = removed_deb_package.from_version.source_package_name
-                        removed_source_package_version = removed_deb_package.from_version.source_package_version
-                        removed_source_package_changelog_file = lib.get_changelog(
-                            launchpad,
-                            ubuntu,
-                            from_lp_series,
-                            tmp_cache_directory,
-                            removed_source_package_name,
-                            removed_source_package_version,
-                            ppas,
-                        )
-                        # Version downgrade check is ignored here as it is not relevant
-                        _, version_added_changelogs = lib.parse_changelog(
-                            launchpad,
-                            to_changelog_filename=to_package_changelog_file,
-                            to_version=to_source_package_version,
-                            from_changelog_filename=removed_source_package_changelog_file,
-                            count=None,
-                            highlight_cves=highlight_cves,
-                        )
-                        added_deb_package_from_version = FromVersion(
-                            version=None,
-                            source_package_name=removed_source_package_name,
-                            source_package_version=removed_source_package_version,
-                        )
-                        notes = (
-                            "{} version '{}' (source package {} version '{}') was added. "
-                            "{} version '{}' has the same source package name, "
-                            "{}, as removed package {}. As such we can use the source package version of the "
-                            "removed package, '{}', as the starting point in our changelog diff. Kernel packages "
-                            "are an example of where the binary package name changes for the same source "
-                            "package. Using the removed package source package version as our starting point "
-                            "means we can still get meaningful changelog diffs even for what appears to be "
-                            "a new package.".format(
-                                package,
-                                from_to["to"],
-                                to_source_package_name,
-                                to_source_package_version,
-                                package,
-                                from_to["to"],
-                                to_source_package_name,
-                                removed_deb_package.name,
-                                removed_deb_package.from_version.source_package_version,
-                            )
-                        )
-                        click.echo(notes)
-                        break
-
-                # If the source package of this added binary package is not the same as the source package of a removed
-                # binary package then get the three most recent changelog entries
-                if not version_added_changelogs:
-                    # Version downgrade check is ignored here as it is not relevant
-                    _, version_added_changelogs = lib.parse_changelog(
-                        launchpad,
-                        to_changelog_filename=to_package_changelog_file,
-                        to_version=to_source_package_version,
-                        count=3,
-                        highlight_cves=highlight_cves,
-                    )
-                    added_deb_package_from_version = FromVersion(version=None)
-                    notes = "For a newly added package only the three most recent changelog entries are shown."
-                    click.echo(
-                        "{} version '{}' (source package {} version '{}') was added. "
-                        "Below are the three most recent changelog entries".format(
-                            package,
-                            from_to["to"],
-                            to_source_package_name,
-                            to_source_package_version,
-                        )
-                    )
-                click.echo()
-
-                added_deb_package_to_version = ToVersion(
-                    version=from_to["to"],
-                    source_package_name=to_source_package_name,
-                    source_package_version=to_source_package_version,
-                )
-                added_deb_package = DebPackage(
-                    name=package,
-                    from_version=added_deb_package_from_version,
-                    to_version=added_deb_package_to_version,
-                    notes=notes,
-                    is_version_downgrade=False,
-                )
-
-                for version_added_changelog_change in version_added_changelogs:
-                    added_deb_package.cves.extend(version_added_changelog_change.cves)
-                    added_deb_package.launchpad_bugs_fixed.extend(version_added_changelog_change.launchpad_bugs_fixed)
-                    added_deb_package.changes.append(version_added_changelog_change)
-
-                click.echo("Source: {}".format(to_source_package_name))
-                click.echo("Version: {}".format(to_source_package_version))
-                click.echo("Distribution: {}".format(added_deb_package.changes[0].distributions))
-                click.echo("Urgency: {}".format(added_deb_package.changes[0].urgency))
-                click.echo("Maintainer: {}".format(added_deb_package.changes[0].author))
-                click.echo("Date: {}".format(added_deb_package.changes[0].date))
-                click.echo(
-                    "Launchpad-Bugs-Fixed: {}".format(
-                        ", ".join(
-                            [str(launchpad_bug_fixed) for launchpad_bug_fixed in added_deb_package.launchpad_bugs_fixed]
-                        )
-                    )
-                )
-                if highlight_cves and added_deb_package.cves:
-                    click.echo(
-                        "CVEs referenced: {}".format(
-                            ", ".join([cve_referenced.cve for cve_referenced in added_deb_package.cves])
-                        )
-                    )
-
-                for changelog_entry in added_deb_package.changes:
-                    echo_changes(highlight_cves, changelog_entry)
-
-                changelog.added.deb.append(added_deb_package)
-
-            for package, from_to in deb_package_diffs.items():
-                (
-                    from_source_package_name,
-                    from_source_package_version,
-                ) = lib.get_source_package_details(
-                    ubuntu,
-                    launchpad,
-                    from_lp_arch_series,
-                    package,
-                    from_to["from"],
-                    ppas,
-                )
-                (
-                    to_source_package_name,
-                    to_source_package_version,
-                ) = lib.get_source_package_details(ubuntu, launchpad, to_lp_arch_series, package, from_to["to"], ppas)
-
-                from_package_changelog_file = lib.get_changelog(
-                    launchpad,
-                    ubuntu,
-                    from_lp_series,
-                    tmp_cache_directory,
-                    from_source_package_name,
-                    from_source_package_version,
-                    ppas,
-                )
-
-                to_package_changelog_file = lib.get_changelog(
-                    launchpad,
-                    ubuntu,
-                    to_lp_series,
-                    tmp_cache_directory,
-                    to_source_package_name,
-                    to_source_package_version,
-                    ppas,
-                )
-
-                # get changelog just between the from and to version
-
-                is_version_downgrade, version_diff_changelogs = lib.parse_changelog(
-                    launchpad,
-                    to_changelog_filename=to_package_changelog_file,
-                    to_version=to_source_package_version,
-                    from_changelog_filename=from_package_changelog_file,
-                    count=None,
-                    highlight_cves=highlight_cves,
-                )
+    if output_json:
+        generation.write_changelog_json(changelog, output_json, output_json_pretty)
 
-                click.echo(
-                    "==========================================================="
-                    "==========================================================="
-                )
-                click.echo(
-                    "{} changed from version '{}' to version '{}'. "
-                    "(source package changed from {} version '{}' to {} version '{}')".format(
-                        package,
-                        from_to["from"],
-                        from_to["to"],
-                        from_source_package_name,
-                        from_source_package_version,
-                        to_source_package_name,
-                        to_source_package_version,
-                    )
-                )
-                if is_version_downgrade:
-                    click.echo(
-                        "This is a version downgrade. "
-                        "The following details for this package indicates changes that have been rolled back."
-                    )
-
-                click.echo()
-
-                diff_deb_package_to_version = ToVersion(
-                    version=from_to["to"],
-                    source_package_name=to_source_package_name,
-                    source_package_version=to_source_package_version,
-                )
-                diff_deb_package_from_version = FromVersion(
-                    version=from_to["from"],
-                    source_package_name=from_source_package_name,
-                    source_package_version=from_source_package_version,
-                )
-                diff_deb_package = DebPackage(
-                    name=package,
-                    from_version=diff_deb_package_from_version,
-                    to_version=diff_deb_package_to_version,
-                    is_version_downgrade=is_version_downgrade,
-                )
 
-                for version_diff_changelog_change in version_diff_changelogs:
-                    diff_deb_package.cves.extend(version_diff_changelog_change.cves)
-                    diff_deb_package.launchpad_bugs_fixed.extend(version_diff_changelog_change.launchpad_bugs_fixed)
-                    diff_deb_package.changes.append(version_diff_changelog_change)
+@cli.command(name="generate-batch")
+@launchpad_and_cache_options
+@cve_tracker_option
+@trace_file_option
+@click.argument("job_file", type=click.File("rb"))
+@click.option(
+    "--concurrent-jobs",
+    help="Number of jobs to generate changelogs for at the same time. "
+    "Package lookups of all jobs share the --jobs worker threads.",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+)
+@click.pass_context
+def generate_batch(
+    ctx,
+    lp_credentials_store: Optional[str],
+    jobs: int,
+    cache_dir: str,
+    cache_max_size: int,
+    cache_max_age: int,
+    record_dir: Optional[str],
+    replay_dir: Optional[str],
+    cve_tracker_dir: Optional[str],
+    trace_file: Optional[str],
+    job_file: click.File,
+    concurrent_jobs: int,
+):
+    """
+    Generate changelogs for many manifest pairs in one process.
+
+    JOB_FILE is a JSON file of the form {"jobs": [...]} where each job has the same
+    settings as the generate command, for example
+    {"from_series": "noble", "to_series": "noble", "from_manifest": "a.manifest",
+    "to_manifest": "b.manifest", "output": "changelog.txt", "output_json": "changelog.json"}.
+    All jobs share one Launchpad session, one cache and one pool of worker threads,
+    so packages common to several jobs are only looked up once.
+    """
+    start_tracing(ctx, trace_file)
+    from pydantic import ValidationError
+
+    from ubuntu_cloud_image_changelog import generation
+    from ubuntu_cloud_image_changelog.models import GenerateBatch
+
+    try:
+        batch = GenerateBatch.model_validate_json(job_file.read())
+    except ValidationError as ex:
+        raise click.ClickException("Invalid job file {}: {}".format(job_file.name, ex))
+
+    disk_cache, session, source_packages, changelog_diffs = generation.open_run(
+        lp_credentials_store,
+        cache_dir,
+        cache_max_size,
+        cache_max_age,
+        record_dir,
+        replay_dir,
+        [(series, job.image_architecture) for job in batch.jobs for series in [job.to_series, job.from_series]],
+    )
+    cve_tracker = generation.get_cve_tracker(
+        cve_tracker_dir, disk_cache, any(job.highlight_cves for job in batch.jobs), replay_dir
+    )
 
-                changes_present = len(diff_deb_package.changes) > 0
-                no_changes_string = "missing"
-                click.echo("Source: {}".format(to_source_package_name))
-                click.echo("Version: {}".format(to_source_package_version))
-                click.echo(
-                    "Distribution: {}".format(
-                        diff_deb_package.changes[0].distributions if changes_present else no_changes_string
-                    )
-                )
-                click.echo(
-                    "Urgency: {}".format(diff_deb_package.changes[0].urgency if changes_present else no_changes_string)
-                )
-                click.echo(
-                    "Maintainer: {}".format(
-                        diff_deb_package.changes[0].author if changes_present else no_changes_string
-                    )
-                )
-                click.echo(
-                    "Date: {}".format(diff_deb_package.changes[0].date if changes_present else no_changes_string)
-                )
+    failed_jobs = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor, concurrent.futures.ThreadPoolExecutor(
+        max_workers=concurrent_jobs
+    ) as job_executor:
+        job_futures = [
+            job_executor.submit(
+                generation.run_generate_job,
+                executor,
+                session,
+                disk_cache,
+                source_packages,
+                changelog_diffs,
+                cve_tracker,
+                job,
+            )
+            for job in batch.jobs
+        ]
+        for job, job_future in zip(batch.jobs, job_futures):
+            try:
+                job_future.result()
+                click.echo("Generated changelog for {} to {}".format(job.from_manifest, job.to_manifest))
+            except Exception as ex:
+                failed_jobs += 1
                 click.echo(
-                    "Launchpad-Bugs-Fixed: {}".format(
-                        ",".join(
-                            [str(launchpad_bug_fixed) for launchpad_bug_fixed in diff_deb_package.launchpad_bugs_fixed]
-                        )
-                    )
+                    "Unable to generate changelog for {} to {}: {}".format(job.from_manifest, job.to_manifest, ex),
+                    err=True,
                 )
-                if highlight_cves and diff_deb_package.cves:
-                    click.echo(
-                        "CVEs referenced: {}".format(
-                            ",".join([cve_referenced.cve for cve_referenced in diff_deb_package.cves])
-                        )
-                    )
-
-                for changelog_entry in diff_deb_package.changes:
-                    echo_changes(highlight_cves, changelog_entry)
-
-                changelog.diff.deb.append(diff_deb_package)
+            finally:
+                generation.save_run(source_packages)
 
-    if output_json:
-        with open(output_json, "w") as ouput_json_file:
-            if output_json_pretty:
-                ouput_json_file.write(changelog.model_dump_json(indent=4))
-            else:
-                ouput_json_file.write(changelog.model_dump_json())
-
-
-def echo_changes(highlight_cves, version_changelog_change):
-    changeblock_summary = "{} ({}) {}; urgency={}".format(
-        version_changelog_change.package,
-        version_changelog_change.version,
-        version_changelog_change.distributions,
-        version_changelog_change.urgency,
-    )
-    click.echo()
-    click.echo("{}".format(changeblock_summary))
-    click.echo("{} ({})".format(version_changelog_change.author, version_changelog_change.date))
-    click.echo()
-    if highlight_cves and version_changelog_change.cves:
-        click.echo("CVEs referenced in changelog:")
-        for cve_referenced in version_changelog_change.cves:
-            cve_priority_color = None
-            cve_priority_bold = False
-            if cve_referenced.cve_priority == "high" or cve_referenced.cve_priority == "critical":
-                cve_priority_color = "red"
-                cve_priority_bold = True
-            elif cve_referenced.cve_priority == "medium":
-                cve_priority_color = "yellow"
-                cve_priority_bold = True
-            click.echo(
-                "\t- {} ({} priority){}".format(
-                    cve_referenced.cve,
-                    click.style(
-                        cve_referenced.cve_priority,
-                        fg=cve_priority_color,
-                        bold=cve_priority_bold,
-                    ),
-                    ": {}".format(cve_referenced.cve_description),
-                )
-            )
-        click.echo()
+    generation.finish_run(disk_cache, source_packages, changelog_diffs, evict=not (record_dir or replay_dir))
 
-    click.echo("Changes:")
-    for log_entry in version_changelog_change.log:
-        click.echo(log_entry)
+    if failed_jobs:
+        raise click.ClickException("{} of {} jobs failed".format(failed_jobs, len(batch.jobs)))
 
 
 @cli.command()
 @click.pass_context
 def schema(ctx):
+    from ubuntu_cloud_image_changelog.models import ChangelogModel
+
     click.echo(json.dumps(ChangelogModel.model_json_schema(), indent=4))
 
 
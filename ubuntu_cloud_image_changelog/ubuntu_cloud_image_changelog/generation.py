@@ -0,0 +1,518 @@
+"""
+Generating changelogs from manifests, the work behind the generate and generate-batch
+commands. cli only imports this module when a changelog is generated so that --help
+and the other commands do not load launchpadlib, python-debian and pydantic.
+"""
+
+import concurrent.futures
+import functools
+import math
+import os
+from typing import Iterable, List, Optional, Tuple, Union
+
+import click
+from pydantic import ValidationError
+
+from ubuntu_cloud_image_changelog import (
+    cache,
+    lib,
+    recording,
+    tracing,
+    transport,
+)
+from ubuntu_cloud_image_changelog.models import (
+    Added,
+    ChangelogModel,
+    DebSummary,
+    Diff,
+    FromVersion,
+    GenerateJob,
+    Removed,
+    SnapPackage,
+    SnapSummary,
+    Summary,
+    ToVersion,
+)
+
+
+def run_generate_job(executor, session, disk_cache, source_packages, changelog_diffs, cve_tracker, job: GenerateJob):
+    resolver = lib.ChangelogResolver(
+        session,
+        from_series=job.from_series,
+        to_series=job.to_series,
+        image_architecture=job.image_architecture,
+        cache_directory=disk_cache.path("changelogs"),
+        ppas=job.ppas,
+        highlight_cves=job.highlight_cves,
+        source_packages=source_packages,
+        missing=source_packages.missing,
+        changelog_diffs=changelog_diffs,
+        cve_tracker=cve_tracker,
+        previous_changelogs=load_previous_changelogs(
+            job.previous_changelog_json, [job.from_series, job.to_series], job.image_architecture
+        ),
+    )
+    with lib.open_manifest(job.from_manifest) as from_manifest_lines, lib.open_manifest(
+        job.to_manifest
+    ) as to_manifest_lines, open(job.output or os.devnull, "w") as output:
+        changelog = generate_changelog(
+            executor,
+            resolver,
+            from_manifest_filename=job.from_manifest,
+            from_manifest_lines=from_manifest_lines,
+            to_manifest_filename=job.to_manifest,
+            to_manifest_lines=to_manifest_lines,
+            from_serial=job.from_serial,
+            to_serial=job.to_serial,
+            notes=job.notes,
+            output=output,
+        )
+    if job.output_json:
+        write_changelog_json(changelog, job.output_json, job.output_json_pretty)
+
+
+def get_cve_tracker(cve_tracker_dir, disk_cache, highlight_cves, replay_dir=None):
+    # Only index a local ubuntu-cve-tracker if CVEs are going to be looked up in it
+    if cve_tracker_dir and highlight_cves:
+        return lib.LocalCveTracker(cve_tracker_dir)
+    if replay_dir:
+        return lib.CveTracker(
+            recording.offline_fetcher(replay_dir), cache_directory=disk_cache.path("cves"), expire=False
+        )
+    return lib.CveTracker(transport.HTTPFetcher(), cache_directory=disk_cache.path("cves"))
+
+
+def load_previous_changelogs(previous_changelog_jsons, series, image_architecture):
+    if not previous_changelog_jsons:
+        return None
+    try:
+        return lib.PreviousChangelogs.load(previous_changelog_jsons, series, image_architecture)
+    except ValidationError as ex:
+        raise click.ClickException("Invalid previous changelog: {}".format(ex))
+
+
+def open_disk_cache(cache_dir, cache_max_size, cache_max_age):
+    return cache.DiskCache(cache_dir, max_size=cache_max_size * 1024 * 1024, max_age=cache_max_age * 24 * 60 * 60)
+
+
+def open_run(
+    lp_credentials_store: Optional[str],
+    cache_dir: str,
+    cache_max_size: int,
+    cache_max_age: int,
+    record_dir: Optional[str],
+    replay_dir: Optional[str],
+    arch_series: List[Tuple[str, str]],
+):
+    """
+    returns the disk cache, Launchpad session, source package resolver and changelog
+    diffs of a run that looks up the (series, architecture) pairs in arch_series.
+    When recording or replaying, the recording directory is used as the disk cache.
+    Changelog diffs are not stored in a recording, so a replay always computes them.
+    """
+    if record_dir and replay_dir:
+        raise click.UsageError("Only one of --record and --replay can be used")
+    disk_cache = open_disk_cache(record_dir or replay_dir or cache_dir, cache_max_size, cache_max_age)
+    if replay_dir:
+        session = recording.RecordedSession(disk_cache)
+    else:
+        # launchpadlib is only loaded when Launchpad is used
+        from ubuntu_cloud_image_changelog import launchpadagent
+
+        session = launchpadagent.LaunchpadSession(
+            launchpadlib_dir=disk_cache.path("launchpadlib"),
+            lp_credentials_store=lp_credentials_store,
+        )
+    # Log in and look up all series on this thread before any worker threads start so that
+    # an interactive authorization, if needed, only happens once.
+    for series, image_architecture in arch_series:
+        session.get_arch_series(series, image_architecture)
+    if record_dir:
+        recording.record_series(session, disk_cache, *{series for series, _ in arch_series})
+    source_packages = lib.SourcePackageResolver(
+        session,
+        store=disk_cache.store("source-packages"),
+        # nothing in a recording expires
+        missing=cache.NegativeCache(
+            disk_cache.store("missing"), ttl=math.inf if replay_dir else lib.MISSING_LOOKUP_TTL
+        ),
+    )
+    if record_dir or replay_dir:
+        changelog_diffs = lib.ChangelogDiffs()
+    else:
+        changelog_diffs = lib.ChangelogDiffs(cache.JsonEntryStore(disk_cache.path("changelog-diffs")))
+    return disk_cache, session, source_packages, changelog_diffs
+
+
+def save_run(source_packages):
+    """Persist what was learnt during the run, also when the run or a job fails part way"""
+    source_packages.save()
+    source_packages.missing.save()
+
+
+def finish_run(disk_cache, source_packages, changelog_diffs, evict: bool = True):
+    """Report cache usage and evict old cache entries unless evict is False, as for a recording"""
+    click.echo(
+        "Source package lookups: {} cached, {} queried".format(source_packages.hits, source_packages.misses),
+        err=True,
+    )
+    click.echo(
+        "Known missing lookups: {} skipped, {} new".format(
+            source_packages.missing.hits, source_packages.missing.misses
+        ),
+        err=True,
+    )
+    click.echo(
+        "Changelogs: {} parsed, {} reused".format(lib.parsed_changelogs.misses, lib.parsed_changelogs.hits),
+        err=True,
+    )
+    click.echo(
+        "Changelog diffs: {} computed, {} reused".format(changelog_diffs.misses, changelog_diffs.hits),
+        err=True,
+    )
+    click.echo("Retries: {} of {} calls".format(lib.retry_policy.retries, lib.retry_policy.calls), err=True)
+    if evict:
+        disk_cache.evict()
+
+
+@tracing.traced("output_json")
+def write_changelog_json(changelog, output_json, output_json_pretty):
+    with open(output_json, "w") as ouput_json_file:
+        if output_json_pretty:
+            ouput_json_file.write(changelog.model_dump_json(indent=4))
+        else:
+            ouput_json_file.write(changelog.model_dump_json())
+
+
+def generate_changelog(
+    executor: concurrent.futures.Executor,
+    resolver: lib.ChangelogResolver,
+    from_manifest_filename: str,
+    from_manifest_lines: Iterable[Union[str, bytes]],
+    to_manifest_filename: str,
+    to_manifest_lines: Iterable[Union[str, bytes]],
+    from_serial: Optional[str] = None,
+    to_serial: Optional[str] = None,
+    notes: Optional[str] = None,
+    output=None,
+) -> ChangelogModel:
+    """
+    Generate the changelog between two manifests, writing the text changelog to output
+    (stdout by default). The manifest lines can be any iterable, such as a manifest opened
+    with lib.open_manifest, and are read once.
+
+    Deb packages are resolved in phases: every binary package to resolve is collected and
+    resolved, then every changelog needed is downloaded, both concurrently on executor, and
+    only then is the changelog rendered.
+    """
+    echo = functools.partial(click.echo, file=output)
+
+    # Store all changelog items in a ChangelogModel object so we can output in different formats and not just txt.
+    changelog = ChangelogModel(
+        notes=notes,
+        from_series=resolver.from_series,
+        to_series=resolver.to_series,
+        image_architecture=resolver.image_architecture,
+        from_serial=from_serial,
+        to_serial=to_serial,
+        from_manifest_filename=from_manifest_filename,
+        to_manifest_filename=to_manifest_filename,
+        summary=Summary(
+            snap=SnapSummary(added=[], removed=[], diff=[]),
+            deb=DebSummary(added=[], removed=[], diff=[]),
+        ),
+        diff=Diff(deb=[], snap=[]),
+        added=Added(deb=[], snap=[]),
+        removed=Removed(deb=[], snap=[]),
+    )
+
+    manifests_diff = lib.diff_manifests(from_manifest_lines, to_manifest_lines)
+    deb_diff = manifests_diff.deb
+    snap_diff = manifests_diff.snap
+    diff_deb_packages = []
+
+    # Are there any snap package diffs?
+    if snap_diff.has_packages():
+        for package, version in snap_diff.removed.items():
+            removed_snap_package = SnapPackage(
+                name=package,
+                from_version=FromVersion(version=version),
+                to_version=ToVersion(version=None),
+            )
+            changelog.removed.snap.append(removed_snap_package)
+
+        changelog.summary.snap = SnapSummary(
+            added=list(snap_diff.added),
+            removed=list(snap_diff.removed),
+            diff=list(snap_diff.changed),
+        )
+
+        echo("Snap packages added: {}".format(list(snap_diff.added)))
+        echo("Snap packages removed: {}".format(list(snap_diff.removed)))
+        echo("Snap packages changed: {}".format(list(snap_diff.changed)))
+
+    # Are there any deb package diffs?
+    if deb_diff.has_packages():
+        changelog.summary.deb = DebSummary(
+            added=list(deb_diff.added),
+            removed=list(deb_diff.removed),
+            diff=list(deb_diff.changed),
+        )
+        echo("Deb packages added: {}".format(list(deb_diff.added)))
+        echo("Deb packages removed: {}".format(list(deb_diff.removed)))
+        echo("Deb packages changed: {}".format(list(deb_diff.changed)))
+
+        # Changed packages whose changes can be composed from previous changelogs are not resolved again
+        composed_deb_packages = {}
+        for package, (from_version, to_version) in deb_diff.changed.items():
+            composed_deb_package = resolver.compose_diff(package, from_version, to_version)
+            if composed_deb_package:
+                composed_deb_packages[package] = composed_deb_package
+        if resolver.previous_changelogs:
+            click.echo(
+                "Changed deb packages composed from previous changelogs: {} of {}".format(
+                    len(composed_deb_packages), len(deb_diff.changed)
+                ),
+                err=True,
+            )
+        resolved_deb_package_diffs = {
+            package: from_to for package, from_to in deb_diff.changed.items() if package not in composed_deb_packages
+        }
+
+        # Phase 1: collect every binary package that needs resolving to a source package
+        binary_packages = resolver.binary_packages_to_resolve(
+            deb_diff.removed, deb_diff.added, resolved_deb_package_diffs
+        )
+        click.echo("Binary packages to resolve: {}".format(len(binary_packages)), err=True)
+        # Phase 2: resolve them all concurrently
+        with tracing.span("resolve_binary_packages", count=len(binary_packages)):
+            source_package_details = resolver.resolve_binary_packages(executor, binary_packages)
+        # Phase 3: download every changelog needed concurrently, each distinct source package once
+        source_packages = resolver.source_packages_to_fetch(
+            source_package_details, deb_diff.removed, deb_diff.added, resolved_deb_package_diffs
+        )
+        click.echo("Changelogs to fetch: {}".format(len(source_packages)), err=True)
+        with tracing.span("fetch_changelogs", count=len(source_packages)):
+            resolver.fetch_changelogs(executor, source_packages)
+
+        # Phase 4: render from the source packages resolved in phase 2 and the changelogs fetched
+        # in phase 3, without any further Launchpad requests; changelogs are still parsed
+        # concurrently. executor.map yields results in submission order so the output order
+        # matches the manifest order.
+        changelog.removed.deb.extend(
+            map(
+                functools.partial(resolver.resolve_removed, source_package_details=source_package_details),
+                deb_diff.removed.keys(),
+                deb_diff.removed.values(),
+            )
+        )
+        resolved_deb_packages = executor.map(
+            functools.partial(resolver.resolve_diff, source_package_details=source_package_details),
+            resolved_deb_package_diffs.keys(),
+            [from_version for from_version, _ in resolved_deb_package_diffs.values()],
+            [to_version for _, to_version in resolved_deb_package_diffs.values()],
+        )
+        diff_deb_packages = (
+            composed_deb_packages[package] if package in composed_deb_packages else next(resolved_deb_packages)
+            for package in deb_diff.changed
+        )
+
+    if snap_diff.changed or snap_diff.added:
+        echo(
+            "\n** Package version diffs for for changed snap packages "
+            "below. Full changelog for snap packages are not listed **\n"
+        )
+
+        # for each of the snap package diffs list the diff in versions
+        for package, version in snap_diff.added.items():
+            echo(
+                "==========================================================="
+                "==========================================================="
+            )
+            echo(
+                "{} version '{}' was added.".format(
+                    package,
+                    version,
+                )
+            )
+
+            added_snap_package_to_version = ToVersion(version=version)
+            added_snap_package_from_version = FromVersion(version=None)
+            added_snap_package = SnapPackage(
+                name=package,
+                from_version=added_snap_package_from_version,
+                to_version=added_snap_package_to_version,
+            )
+
+            changelog.added.snap.append(added_snap_package)
+            echo()
+
+        # for each of the snap package diffs list the diff in versions
+        for package, (from_version, to_version) in snap_diff.changed.items():
+            echo(
+                "==========================================================="
+                "==========================================================="
+            )
+            echo("{} changed from version '{}' to version '{}'".format(package, from_version, to_version))
+
+            diff_snap_package_to_version = ToVersion(version=to_version)
+            diff_snap_package_from_version = FromVersion(version=from_version)
+            diff_snap_package = SnapPackage(
+                name=package,
+                from_version=diff_snap_package_from_version,
+                to_version=diff_snap_package_to_version,
+            )
+
+            changelog.diff.snap.append(diff_snap_package)
+            echo()
+
+    if deb_diff.changed or deb_diff.added:
+        echo("\n** Changelogs for added and changed deb packages " "below: **\n")
+
+        # Parse the changelogs for all added deb packages concurrently
+        added_deb_packages = executor.map(
+            functools.partial(
+                resolver.resolve_added,
+                removed_deb_packages=changelog.removed.deb,
+                source_package_details=source_package_details,
+            ),
+            deb_diff.added.keys(),
+            deb_diff.added.values(),
+        )
+
+        for added_deb_package in added_deb_packages:
+            with tracing.span("render", package=added_deb_package.name):
+                echo_added_deb_package(resolver.highlight_cves, added_deb_package, output=output)
+            changelog.added.deb.append(added_deb_package)
+
+        for diff_deb_package in diff_deb_packages:
+            with tracing.span("render", package=diff_deb_package.name):
+                echo_diff_deb_package(resolver.highlight_cves, diff_deb_package, output=output)
+            changelog.diff.deb.append(diff_deb_package)
+
+    return changelog
+
+
+def echo_added_deb_package(highlight_cves, added_deb_package, output=None):
+    echo = functools.partial(click.echo, file=output)
+    echo(
+        "==========================================================="
+        "==========================================================="
+    )
+    if added_deb_package.from_version.source_package_name:
+        echo(added_deb_package.notes)
+    else:
+        echo(
+            "{} version '{}' (source package {} version '{}') was added. "
+            "Below are the three most recent changelog entries".format(
+                added_deb_package.name,
+                added_deb_package.to_version.version,
+                added_deb_package.to_version.source_package_name,
+                added_deb_package.to_version.source_package_version,
+            )
+        )
+    echo()
+
+    echo("Source: {}".format(added_deb_package.to_version.source_package_name))
+    echo("Version: {}".format(added_deb_package.to_version.source_package_version))
+    echo("Distribution: {}".format(added_deb_package.changes[0].distributions))
+    echo("Urgency: {}".format(added_deb_package.changes[0].urgency))
+    echo("Maintainer: {}".format(added_deb_package.changes[0].author))
+    echo("Date: {}".format(added_deb_package.changes[0].date))
+    echo(
+        "Launchpad-Bugs-Fixed: {}".format(
+            ", ".join([str(launchpad_bug_fixed) for launchpad_bug_fixed in added_deb_package.launchpad_bugs_fixed])
+        )
+    )
+    if highlight_cves and added_deb_package.cves:
+        echo("CVEs referenced: {}".format(", ".join([cve_referenced.cve for cve_referenced in added_deb_package.cves])))
+
+    for changelog_entry in added_deb_package.changes:
+        echo_changes(highlight_cves, changelog_entry, output=output)
+
+
+def echo_diff_deb_package(highlight_cves, diff_deb_package, output=None):
+    echo = functools.partial(click.echo, file=output)
+    echo(
+        "==========================================================="
+        "==========================================================="
+    )
+    echo(
+        "{} changed from version '{}' to version '{}'. "
+        "(source package changed from {} version '{}' to {} version '{}')".format(
+            diff_deb_package.name,
+            diff_deb_package.from_version.version,
+            diff_deb_package.to_version.version,
+            diff_deb_package.from_version.source_package_name,
+            diff_deb_package.from_version.source_package_version,
+            diff_deb_package.to_version.source_package_name,
+            diff_deb_package.to_version.source_package_version,
+        )
+    )
+    if diff_deb_package.is_version_downgrade:
+        echo(
+            "This is a version downgrade. "
+            "The following details for this package indicates changes that have been rolled back."
+        )
+
+    echo()
+
+    changes_present = len(diff_deb_package.changes) > 0
+    no_changes_string = "missing"
+    echo("Source: {}".format(diff_deb_package.to_version.source_package_name))
+    echo("Version: {}".format(diff_deb_package.to_version.source_package_version))
+    echo("Distribution: {}".format(diff_deb_package.changes[0].distributions if changes_present else no_changes_string))
+    echo("Urgency: {}".format(diff_deb_package.changes[0].urgency if changes_present else no_changes_string))
+    echo("Maintainer: {}".format(diff_deb_package.changes[0].author if changes_present else no_changes_string))
+    echo("Date: {}".format(diff_deb_package.changes[0].date if changes_present else no_changes_string))
+    echo(
+        "Launchpad-Bugs-Fixed: {}".format(
+            ",".join([str(launchpad_bug_fixed) for launchpad_bug_fixed in diff_deb_package.launchpad_bugs_fixed])
+        )
+    )
+    if highlight_cves and diff_deb_package.cves:
+        echo("CVEs referenced: {}".format(",".join([cve_referenced.cve for cve_referenced in diff_deb_package.cves])))
+
+    for changelog_entry in diff_deb_package.changes:
+        echo_changes(highlight_cves, changelog_entry, output=output)
+
+
+def echo_changes(highlight_cves, version_changelog_change, output=None):
+    echo = functools.partial(click.echo, file=output)
+    changeblock_summary = "{} ({}) {}; urgency={}".format(
+        version_changelog_change.package,
+        version_changelog_change.version,
+        version_changelog_change.distributions,
+        version_changelog_change.urgency,
+    )
+    echo()
+    echo("{}".format(changeblock_summary))
+    echo("{} ({})".format(version_changelog_change.author, version_changelog_change.date))
+    echo()
+    if highlight_cves and version_changelog_change.cves:
+        echo("CVEs referenced in changelog:")
+        for cve_referenced in version_changelog_change.cves:
+            cve_priority_color = None
+            cve_priority_bold = False
+            if cve_referenced.cve_priority == "high" or cve_referenced.cve_priority == "critical":
+                cve_priority_color = "red"
+                cve_priority_bold = True
+            elif cve_referenced.cve_priority == "medium":
+                cve_priority_color = "yellow"
+                cve_priority_bold = True
+            echo(
+                "\t- {} ({} priority){}".format(
+                    cve_referenced.cve,
+                    click.style(
+                        cve_referenced.cve_priority,
+                        fg=cve_priority_color,
+                        bold=cve_priority_bold,
+                    ),
+                    ": {}".format(cve_referenced.cve_description),
+                )
+            )
+        echo()
+
+    echo("Changes:")
+    for log_entry in version_changelog_change.log:
+        echo(log_entry)
@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 import time
 
 from launchpadlib.credentials import (
@@ -75,3 +76,29 @@ def get_launchpad(launchpadlib_dir=None, lp_credentials_store=None):
         launchpadlib_dir=launchpadlib_dir,
         version=lp_version,
     )
+
+
+class LaunchpadSession(threading.local):
+    """Per-thread Launchpad handles.
+
+    launchpadlib's httplib2 transport is not thread safe, so every thread that
+    touches a LaunchpadSession logs in on first use and keeps its own copies of
+    the distribution, series and arch series objects.
+    """
+
+    def __init__(self, launchpadlib_dir=None, lp_credentials_store=None):
+        self.launchpad = get_launchpad(launchpadlib_dir=launchpadlib_dir, lp_credentials_store=lp_credentials_store)
+        self.ubuntu = self.launchpad.distributions["ubuntu"]
+        self._series = {}
+        self._arch_series = {}
+
+    def get_series(self, name_or_version):
+        if name_or_version not in self._series:
+            self._series[name_or_version] = self.ubuntu.getSeries(name_or_version=name_or_version)
+        return self._series[name_or_version]
+
+    def get_arch_series(self, name_or_version, archtag):
+        key = (name_or_version, archtag)
+        if key not in self._arch_series:
+            self._arch_series[key] = self.get_series(name_or_version).getDistroArchSeries(archtag=archtag)
+        return self._arch_series[key]
@@ -1,33 +1,193 @@
 """Library module."""
 
+import collections
+import concurrent.futures
+import contextlib
+import email.utils
+import gzip
+import io
+import json
 import logging
+import lzma
 import os
+import random
 import re
+import sys
+import tarfile
+import threading
 import time
 import urllib.parse
+import zlib
 from functools import wraps
-from typing import List, Optional, Set
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import click
 from debian.changelog import ChangeBlock, Changelog
 from debian.debian_support import Version
-from lazr.restfulclient.errors import NotFound
+from lazr.restfulclient.errors import HTTPError, NotFound
 
-from ubuntu_cloud_image_changelog.models import Change
+from ubuntu_cloud_image_changelog import cache, tracing, transport
+from ubuntu_cloud_image_changelog.models import (
+    Change,
+    ChangelogModel,
+    DebPackage,
+    FromVersion,
+    ToVersion,
+)
 
+SNAP_PACKAGE_PREFIX = "snap:"
+CVE_PATTERN = re.compile(r"CVE-\d+-\d+")
+# Fields of an ubuntu-cve-tracker file start on a line that does not start with whitespace
+CVE_FIELD_SEPARATOR = re.compile(r"\n(?=\S)")
+# How long to cache CVE details for, by the ubuntu-cve-tracker location they were found in
+CVE_DETAILS_TTLS = {
+    "active": 24 * 60 * 60,
+    "retired": 30 * 24 * 60 * 60,
+    "ignored": 30 * 24 * 60 * 60,
+}
+# CVEs that are not in the tracker yet may be added at any time
+MISSING_CVE_DETAILS_TTL = 24 * 60 * 60
+# Estimated memory used by parsed changelogs kept in memory, by default at most
+PARSED_CHANGELOGS_MAX_SIZE = 512 * 1024 * 1024
+# The header line of a changelog block, as matched by debian.changelog
+CHANGELOG_HEADER_PATTERN = re.compile(
+    rb"^(\w[-+0-9a-z.]*) \(([^\(\) \t]+)\)((\s+[-+0-9a-z.]+)+)\;", re.IGNORECASE | re.MULTILINE
+)
+# A parsed changelog takes up roughly this many times the size of the changelog file
+PARSED_CHANGELOG_SIZE_FACTOR = 5
+# Archive name used in negative cache keys for the Ubuntu primary archive. PPAs are "ppa:<owner>/<name>"
+PRIMARY_ARCHIVE_NAME = "primary"
+# How long to remember that a binary package or changelog was not found. It may still be published.
+MISSING_LOOKUP_TTL = 24 * 60 * 60
+
+
+class RetryPolicy:
+    """
+    Decide whether and when a failed call is retried.
+
+    Errors that will not go away by themselves, such as ClickException, 404 and other
+    4xx responses, are permanent and never retried. Server errors, 408 and 429
+    responses, timeouts, dropped connections and any other errors are retried after
+    an exponential backoff with full jitter, or after the delay in a Retry-After
+    header if the server sent one.
+
+    Retries are limited by a budget shared by every call made with the policy: at most
+    budget_minimum retries plus budget_ratio retries per call. When Launchpad is
+    down this fails a run quickly instead of retrying every lookup in turn.
+    """
+
+    def __init__(
+        self,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        max_retry_after: float = 300.0,
+        budget_ratio: float = 0.2,
+        budget_minimum: int = 10,
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget_ratio = budget_ratio
+        self.budget_minimum = budget_minimum
+        self.calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _http_error(ex):
+        """returns the status and headers of an HTTP error response, or None and {}"""
+        if isinstance(ex, transport.HTTPError):
+            return ex.status, ex.headers
+        if isinstance(ex, HTTPError) and ex.response is not None:
+            return ex.response.status, ex.response
+        return None, {}
+
+    def is_retryable(self, ex: Exception) -> bool:
+        if isinstance(ex, (click.ClickException, NotFound, transport.NotFound)):
+            return False
+        status, _ = self._http_error(ex)
+        if status is not None and 400 <= status < 500 and status not in (408, 429):
+            return False
+        return True
+
+    def retry_after(self, ex: Exception) -> Optional[float]:
+        """returns the number of seconds the server asked to wait before retrying, if any"""
+        _, headers = self._http_error(ex)
+        retry_after = next((value for name, value in headers.items() if name.lower() == "retry-after"), None)
+        if retry_after is None:
+            return None
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0.0), self.max_retry_after)
+
+    def delay(self, attempt: int, ex: Exception) -> float:
+        """returns how long to wait before retrying after attempt, counting from 0, failed with ex"""
+        retry_after = self.retry_after(ex)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def start_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def spend_retry(self) -> bool:
+        """returns True if the retry budget allows one more retry, which is then spent"""
+        with self._lock:
+            if self.retries >= self.budget_minimum + self.budget_ratio * self.calls:
+                return False
+            self.retries += 1
+            return True
+
+
+# Shared by every function decorated with retry, so the retry budget is per process
+retry_policy = RetryPolicy()
+
+
+def retry(_func=None, *, num_attempts: int = 5, policy: Optional[RetryPolicy] = None):
+    """
+    Retry the decorated function up to num_attempts times in total, as decided by
+    policy, by default the module retry_policy. The last error is raised when an
+    error is permanent, the attempts are used up or the retry budget is spent.
+    """
 
-def retry(_func=None, *, num_attempts: int = 5):
     def retry_inner(func):
+        func_name = getattr(func, "__name__", type(func).__name__)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = ValueError("num_attempts < 0")
+            active_policy = policy or retry_policy
+            active_policy.start_call()
             for attempt in range(num_attempts):
                 try:
                     return func(*args, **kwargs)
-                except Exception as e:
-                    last_exception = e
-                time.sleep(attempt)
-            raise last_exception
+                except Exception as ex:
+                    if attempt + 1 == num_attempts or not active_policy.is_retryable(ex):
+                        raise
+                    if not active_policy.spend_retry():
+                        logging.warning("Retry budget spent, not retrying {}: {}".format(func_name, ex))
+                        raise
+                    delay = active_policy.delay(attempt, ex)
+                    logging.debug("Retrying {} in {:.1f}s after: {}".format(func_name, delay, ex))
+                time.sleep(delay)
+            raise ValueError("num_attempts < 1")
 
         return wrapper
 
@@ -37,8 +197,102 @@ def retry(_func=None, *, num_attempts: int = 5):
         return retry_inner(_func)
 
 
+def _ppa_archive_name(ppa):
+    return "ppa:{}".format(ppa)
+
+
+def _is_known_missing(missing: Optional[cache.NegativeCache], key: Tuple[str, ...], archive_name: str) -> bool:
+    return missing is not None and missing.is_missing(*key, archive_name)
+
+
+def _add_missing(missing: Optional[cache.NegativeCache], key: Tuple[str, ...], archive_name: str):
+    if missing is not None:
+        missing.add(*key, archive_name)
+
+
+class PpaArchives:
+    """
+    The archives of the PPAs that packages not in the Ubuntu archive are searched for in.
+
+    An archive is looked up with getPPAByName once per thread, rather than for every
+    package, since launchpadlib objects can not be shared between threads. The PPAs
+    given to search are searched concurrently on a small pool of threads of their
+    own, each with its own handles from the LaunchpadSession.
+    """
+
+    def __init__(self, session, max_workers: int = 4):
+        self.session = session
+        self._local = threading.local()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, ppa: str):
+        """returns this thread's handle of the archive of ppa, given as "<owner>/<name>", looking it up on first use"""
+        archives = self._local.__dict__.setdefault("archives", {})
+        if ppa not in archives:
+            ppa_owner, ppa_name = ppa.split("/")
+            archives[ppa] = self.session.launchpad.people[ppa_owner].getPPAByName(name=ppa_name)
+        return archives[ppa]
+
+    def _search(self, search_archive, ppa):
+        return search_archive(self.session.launchpad, self.get(ppa), ppa)
+
+    def search(self, ppas: List[str], search_archive):
+        """
+        Call search_archive(launchpad, archive, ppa) for all ppas concurrently and return
+        the first result, in the order of ppas, that is not None. Searches of the PPAs
+        after that one are cancelled if they have not started yet.
+        """
+        if len(ppas) == 1:
+            return self._search(search_archive, ppas[0])
+        futures = [self._executor.submit(self._search, search_archive, ppa) for ppa in ppas]
+        try:
+            for future in futures:
+                result = future.result()
+                if result is not None:
+                    return result
+            return None
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _search_ppas(launchpad, ppas: List[str], search_archive, ppa_archives: Optional[PpaArchives] = None):
+    """
+    returns the first result of search_archive(launchpad, archive, ppa), in the order of
+    ppas, that is not None. If ppa_archives is set the PPAs are searched concurrently,
+    otherwise one after the other with launchpad.
+    """
+    if not ppas:
+        return None
+    if ppa_archives is not None:
+        return ppa_archives.search(ppas, search_archive)
+    for ppa in ppas:
+        ppa_owner, ppa_name = ppa.split("/")
+        result = search_archive(launchpad, launchpad.people[ppa_owner].getPPAByName(name=ppa_name), ppa)
+        if result is not None:
+            return result
+    return None
+
+
 @retry
-def get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package_name, binary_package_version, ppas):
+@tracing.traced("binary_package_name", "binary_package_version")
+def get_source_package_details(
+    ubuntu,
+    launchpad,
+    lp_arch_series,
+    binary_package_name,
+    binary_package_version,
+    ppas,
+    missing=None,
+    ppa_archives=None,
+):
+    """
+    Returns the source package name and version the binary package version was built from.
+    If missing, a cache.NegativeCache, is set, archives the binary package version is known
+    to be missing from are not searched and new misses are added to it. If ppa_archives,
+    a PpaArchives, is set the PPAs are searched concurrently and the first in the order
+    of ppas with the binary package version is used.
+    """
     # find the published binary for this series, binary_package_name
     # and binary_package_version
     source_package_name = None
@@ -50,14 +304,21 @@ def get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package
     binary_package_name, _, binary_arch_name = binary_package_name.partition(":")
     if binary_arch_name and lp_arch_series.architecture_tag != binary_arch_name:
         lp_arch_series = lp_arch_series.distro_series.getDistroArchSeries(archtag=binary_arch_name)
+    missing_key: Tuple[str, ...] = ()
+    if missing is not None:
+        missing_key = ("binary", str(lp_arch_series.self_link), binary_package_name, binary_package_version)
 
-    binaries = archive.getPublishedBinaries(
-        exact_match=True,
-        binary_name=binary_package_name,
-        distro_arch_series=lp_arch_series,
-        order_by_date=True,
-        version=binary_package_version,
-    )
+    binaries = []
+    if not _is_known_missing(missing, missing_key, PRIMARY_ARCHIVE_NAME):
+        binaries = archive.getPublishedBinaries(
+            exact_match=True,
+            binary_name=binary_package_name,
+            distro_arch_series=lp_arch_series,
+            order_by_date=True,
+            version=binary_package_version,
+        )
+        if not len(binaries):
+            _add_missing(missing, missing_key, PRIMARY_ARCHIVE_NAME)
     if len(binaries):
         # now get the source package name so we can get the changelog
         source_package_name = binaries[0].source_package_name
@@ -65,9 +326,7 @@ def get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package
     else:
         # search through the PPAs to see if this binary version was published
         # there.
-        for ppa in ppas:
-            ppa_owner, ppa_name = ppa.split("/")
-            archive = launchpad.people[ppa_owner].getPPAByName(name=ppa_name)
+        def search_ppa(launchpad, archive, ppa):
             # using pocket "Release" when using a PPA ...'
             pocket = "Release"
             binaries = archive.getPublishedBinaries(
@@ -78,10 +337,20 @@ def get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package
                 order_by_date=True,
                 version=binary_package_version,
             )
-            if len(binaries):
-                # now get the source package name so we can get the changelog
-                source_package_name = binaries[0].source_package_name
-                source_package_version = binaries[0].source_package_version
+            if not len(binaries):
+                _add_missing(missing, missing_key, _ppa_archive_name(ppa))
+                return None
+            # now get the source package name so we can get the changelog
+            return binaries[0].source_package_name, binaries[0].source_package_version
+
+        ppa_source_package_details = _search_ppas(
+            launchpad,
+            [ppa for ppa in ppas if not _is_known_missing(missing, missing_key, _ppa_archive_name(ppa))],
+            search_ppa,
+            ppa_archives,
+        )
+        if ppa_source_package_details:
+            source_package_name, source_package_version = ppa_source_package_details
     if not source_package_name or not source_package_version:
         raise click.ClickException(
             "Unable to find source package for {} {}".format(binary_package_name, binary_package_version)
@@ -89,6 +358,43 @@ def get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package
     return source_package_name, source_package_version
 
 
+@retry
+@tracing.traced("source_package_name", "source_package_version")
+def get_source_package_binaries(
+    ubuntu, launchpad, lp_series, source_package_name, source_package_version, ppas, ppa_archives=None
+):
+    """
+    Returns (architecture tag, binary package name, binary package version) for
+    every binary package built from source_package_name source_package_version.
+    An empty list is returned if the source package could not be found.
+    """
+
+    def search_archive(launchpad, archive, ppa=None):
+        sources = archive.getPublishedSources(
+            exact_match=True,
+            source_name=source_package_name,
+            distro_series=lp_series,
+            order_by_date=True,
+            version=source_package_version,
+        )
+        if not len(sources):
+            return None
+        return [
+            (
+                # the architecture tag is the last part of the distro arch series link
+                binary.distro_arch_series_link.rstrip("/").rpartition("/")[2],
+                binary.binary_package_name,
+                binary.binary_package_version,
+            )
+            for binary in sources[0].getPublishedBinaries(active_binaries_only=False)
+        ]
+
+    source_package_binaries = search_archive(launchpad, ubuntu.main_archive)
+    if source_package_binaries is None:
+        source_package_binaries = _search_ppas(launchpad, ppas, search_archive, ppa_archives)
+    return source_package_binaries or []
+
+
 def arch_independent_package_name(package_name):
     # packages ending with ':amd64' or ':arm64' are special
     if package_name.endswith(":amd64") or package_name.endswith(":arm64"):
@@ -96,51 +402,186 @@ def arch_independent_package_name(package_name):
     return package_name
 
 
-def _parse_cve_details(changelog_block, launchpad):
-    changelog_block_cves = []
+class ManifestDiff(NamedTuple):
+    """The differences between the deb or snap packages of two manifests, in manifest order"""
+
+    # package name -> version in the to manifest
+    added: Dict[str, str]
+    # package name -> version in the from manifest
+    removed: Dict[str, str]
+    # package name -> (version in the from manifest, version in the to manifest)
+    changed: Dict[str, Tuple[str, str]]
+    # number of packages with the same version in both manifests
+    unchanged: int
+
+    def has_packages(self) -> bool:
+        """returns whether either manifest has any packages of this kind"""
+        return bool(self.added or self.removed or self.changed or self.unchanged)
+
+
+class ManifestsDiff(NamedTuple):
+    deb: ManifestDiff
+    snap: ManifestDiff
+
+
+@contextlib.contextmanager
+def open_manifest(manifest_filename: str) -> Iterator[IO[str]]:
+    """
+    Open a manifest to be read line by line. "-" is stdin and manifests ending in
+    .gz or .xz are decompressed as they are read, so memory use does not depend on
+    the size of the manifest.
+    """
+    if manifest_filename == "-":
+        manifest_file = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+        try:
+            yield manifest_file
+        finally:
+            manifest_file.detach()  # leave stdin open
+        return
+    if manifest_filename.endswith(".gz"):
+        opener = gzip.open
+    elif manifest_filename.endswith(".xz"):
+        opener = lzma.open
+    else:
+        opener = open
+    with opener(manifest_filename, "rt", encoding="utf-8") as manifest_file:
+        yield manifest_file
+
+
+def _iter_manifest(manifest_lines: Iterable[Union[str, bytes]]) -> Iterator[Tuple[bool, str, str]]:
+    for manifest_line in manifest_lines:
+        if isinstance(manifest_line, bytes):
+            manifest_line = manifest_line.decode("utf-8")
+        package, _, versions = manifest_line.strip().partition("\t")
+        if not package:
+            continue
+        if package.startswith(SNAP_PACKAGE_PREFIX):
+            yield True, package.replace(SNAP_PACKAGE_PREFIX, ""), versions.split("\t")[1]
+        else:
+            # packages ending with ':amd64' or ':arm64' are special
+            yield False, arch_independent_package_name(package), versions.partition("\t")[0]
+
+
+def parse_manifest(manifest_lines: Iterable[Union[str, bytes]]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Parse the lines of an image manifest, "<package>\t<version>" for debs and
+    "snap:<name>\t<channel>\t<revision>" for snaps. manifest_lines can be a
+    manifest opened with open_manifest or any other iterable of lines.
+
+    Returns the deb packages, name -> version, and the snap packages, name -> revision,
+    both in manifest order. Deb package names have any architecture suffix removed.
+    """
+    packages: Tuple[Dict[str, str], Dict[str, str]] = ({}, {})
+    for is_snap, package, version in _iter_manifest(manifest_lines):
+        packages[is_snap][package] = version
+    return packages
+
+
+def diff_manifests(
+    from_manifest_lines: Iterable[Union[str, bytes]], to_manifest_lines: Iterable[Union[str, bytes]]
+) -> ManifestsDiff:
+    """
+    Compare two image manifests, given as for parse_manifest.
+
+    The from manifest is parsed first and each line of the to manifest is compared
+    as it is read, so the to manifest is never held in memory and even manifests of
+    tens of thousands of packages take milliseconds. Nothing is looked up on Launchpad.
+    """
+    from_packages = parse_manifest(from_manifest_lines)
+    to_package_names: Tuple[Set[str], Set[str]] = (set(), set())
+    added: Tuple[Dict[str, str], Dict[str, str]] = ({}, {})
+    changed: Tuple[Dict[str, Tuple[str, str]], Dict[str, Tuple[str, str]]] = ({}, {})
+    for is_snap, package, to_version in _iter_manifest(to_manifest_lines):
+        to_package_names[is_snap].add(package)
+        from_version = from_packages[is_snap].get(package)
+        # If a package is listed more than once the last line wins
+        if from_version is None:
+            added[is_snap][package] = to_version
+        elif from_version != to_version:
+            changed[is_snap][package] = (from_version, to_version)
+        else:
+            changed[is_snap].pop(package, None)
+
+    deb_diff, snap_diff = [
+        ManifestDiff(
+            added=added[is_snap],
+            removed={
+                package: version
+                for package, version in from_packages[is_snap].items()
+                if package not in to_package_names[is_snap]
+            },
+            changed=changed[is_snap],
+            unchanged=len(to_package_names[is_snap]) - len(added[is_snap]) - len(changed[is_snap]),
+        )
+        for is_snap in (False, True)
+    ]
+    return ManifestsDiff(deb=deb_diff, snap=snap_diff)
+
+
+def _find_cves(changelog_block):
+    """returns the CVE ids referenced in changelog_block in order of appearance"""
+    cves = []
     for change in changelog_block:
         if "CVE" in change:
-            cve_pos = [(m.start(), m.end()) for m in re.finditer(r"CVE-\d+-\d+", change)]
-            for start, end in cve_pos:
-                cve = change[start:end].strip()
-                if cve not in [changelog_block_cve["cve"] for changelog_block_cve in changelog_block_cves]:
-                    cve_details = {}
-                    cve_details["cve"] = cve
-                    cve_details["url"] = _get_cve_url(cve)
-                    cve_details_lines = _get_cve_details(cve, launchpad)
-                    cve_ubuntu_description = ""
-                    cve_priority = "n/a"
-                    cve_description = ""
-                    cve_public_date = ""
-                    for cve_details_line in cve_details_lines:
-                        # only get the CVE description if the user has requested it
-                        if not cve_ubuntu_description and cve_details_line.startswith("Ubuntu-Description:"):
-                            # get the string in the line after the Ubuntu-Description: line
-                            # while the next line is not 'Notes' keep appending to cve_description
-                            while True:
-                                next_line = next(cve_details_lines)
-                                if next_line.startswith("Notes"):
-                                    break
-                                cve_ubuntu_description += next_line
-                        if not cve_description and cve_details_line.startswith("Description:"):
-                            # get the string in the line after the Description: line
-                            # while the next line is not 'Notes' keep appending to cve_description
-                            while True:
-                                next_line = next(cve_details_lines)
-                                if next_line.startswith("Ubuntu-Description:"):
-                                    break
-                                cve_description += next_line
-                        if "Priority:" in cve_details_line:
-                            cve_priority = cve_details_line.split("Priority:")[1].strip()
-                        if "PublicDate:" in cve_details_line:
-                            cve_public_date = cve_details_line.split("PublicDate:")[1].strip()
-
-                    cve_details["cve_description"] = (
-                        cve_ubuntu_description.lstrip() if cve_ubuntu_description else cve_description.lstrip()
-                    )
-                    cve_details["cve_priority"] = cve_priority
-                    cve_details["cve_public_date"] = cve_public_date
-                    changelog_block_cves.append(cve_details)
+            cves.extend(m.group(0) for m in CVE_PATTERN.finditer(change))
+    return cves
+
+
+class CveRecord(NamedTuple):
+    """The parts of an ubuntu-cve-tracker file used in changelogs"""
+
+    priority: str = "n/a"
+    public_date: str = ""
+    description: str = ""
+    # source package name -> release -> status, e.g. {"openssl": {"noble": "released (3.0.13-0ubuntu3.1)"}}
+    packages: Dict[str, Dict[str, str]] = {}
+
+
+def parse_cve_record(cve_details: str) -> CveRecord:
+    """
+    Parse an ubuntu-cve-tracker file in a single pass.
+
+    The files are RFC822-like: "Field: value" lines, each optionally followed by
+    continuation lines starting with whitespace. Per-package status fields are named
+    "<release>_<source package>". Only the first line of the Priority field is used,
+    the rest is the reasoning behind it.
+    """
+    fields: Dict[str, str] = {}
+    packages: Dict[str, Dict[str, str]] = {}
+    for field_and_value in CVE_FIELD_SEPARATOR.split(cve_details):
+        field, separator, value = field_and_value.partition(":")
+        if not separator:
+            continue
+        if "_" in field and field[0].islower():
+            release, _, package = field.partition("_")
+            packages.setdefault(package, {})[release] = value.strip()
+        else:
+            fields[field] = value
+
+    description = fields.get("Ubuntu-Description", "").replace("\n", "").lstrip()
+    if not description:
+        description = fields.get("Description", "").replace("\n", "").lstrip()
+    return CveRecord(
+        priority=fields["Priority"].partition("\n")[0].strip() if "Priority" in fields else "n/a",
+        public_date=fields.get("PublicDate", "").strip(),
+        description=description,
+        packages=packages,
+    )
+
+
+def _parse_cve_details(changelog_block, cve_tracker):
+    changelog_block_cves = []
+    for cve in dict.fromkeys(_find_cves(changelog_block)):
+        cve_record = cve_tracker.get_cve_record(cve)
+        changelog_block_cves.append(
+            {
+                "cve": cve,
+                "url": _get_cve_url(cve),
+                "cve_description": cve_record.description,
+                "cve_priority": cve_record.priority,
+                "cve_public_date": cve_record.public_date,
+            }
+        )
     return changelog_block_cves
 
 
@@ -151,28 +592,287 @@ def _get_cve_url(cve_number):
 
 
 @retry
-def _get_cve_details(cve, launchpad):
-    # download the cve details and parse so we can get the CVE description and the CVE priority
-    cve_details_lines = []
+@tracing.traced("cve")
+def _get_cve_details(cve, fetcher):
+    """
+    Download the cve details so we can get the CVE description and the CVE priority.
+    fetcher is a transport.HTTPFetcher or anything else with the same get() method.
+    Returns the ubuntu-cve-tracker location the details were found in and the details,
+    or None and an empty string if the CVE is not in the tracker.
+    """
     possible_cve_detail_locations = ["active", "retired", "ignored"]
     for possible_cve_detail_location in possible_cve_detail_locations:
         try:
             cve_details_url = "https://git.launchpad.net/ubuntu-cve-tracker/plain/{}/{}".format(
                 possible_cve_detail_location, cve
             )
-            cve_details_resp = launchpad._browser.get(cve_details_url).decode("utf-8")
-            cve_details_lines = iter(cve_details_resp.splitlines())
-            return cve_details_lines
-        except NotFound:
+            cve_details_resp = fetcher.get(cve_details_url).decode("utf-8")
+            return possible_cve_detail_location, cve_details_resp
+        except (NotFound, transport.NotFound):
             pass  # Keep trying until we find the cve details
-    return cve_details_lines
+    return None, ""
+
+
+class CveTracker:
+    """
+    Look up CVE details in ubuntu-cve-tracker.
+
+    Each CVE is fetched and parsed once and its record kept in memory for the
+    lifetime of the tracker. If cache_directory is set the tracker files are also
+    cached on disk between runs. Retired and ignored CVEs rarely
+    change so they are cached for much longer than active ones. Lookups run on the
+    tracker's own small pool of threads so that all the CVEs referenced in a
+    changelog can be prefetched concurrently. If expire is False cached files are
+    used however old they are, e.g. when replaying a recording.
+    """
+
+    def __init__(self, fetcher, cache_directory: Optional[str] = None, max_workers: int = 8, expire: bool = True):
+        self.fetcher = fetcher
+        self.cache_directory = cache_directory
+        self.expire = expire
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._cve_records: Dict[str, concurrent.futures.Future] = {}
+
+    def prefetch(self, cves: Iterable[str]):
+        """Start looking up cves in the background"""
+        with self._lock:
+            for cve in cves:
+                if cve not in self._cve_records:
+                    self._cve_records[cve] = self._executor.submit(self._load_record, cve)
+
+    def get_cve_record(self, cve: str) -> CveRecord:
+        """returns the parsed ubuntu-cve-tracker file for cve, or an empty CveRecord if there is none"""
+        self.prefetch([cve])
+        return self._cve_records[cve].result()
+
+    def _load_record(self, cve):
+        return parse_cve_record(self._load(cve))
+
+    def _load(self, cve):
+        if self.cache_directory:
+            cache_filename = os.path.join(self.cache_directory, cve)
+            try:
+                with open(cache_filename, "rb") as cache_file:
+                    cached_cve_details = json.load(cache_file)
+                ttl = CVE_DETAILS_TTLS.get(cached_cve_details["location"], MISSING_CVE_DETAILS_TTL)
+                if not self.expire or time.time() - cached_cve_details["fetched"] < ttl:
+                    cache.touch(cache_filename)
+                    return cached_cve_details["details"]
+            except (OSError, ValueError, KeyError):
+                pass  # not cached yet or unreadable, fetch it again
+
+        location, cve_details = _get_cve_details(cve, self.fetcher)
+        if self.cache_directory:
+            cache.write_cache_file(
+                cache_filename,
+                json.dumps({"location": location, "fetched": time.time(), "details": cve_details}).encode("utf-8"),
+            )
+        return cve_details
+
+
+class LocalCveTracker:
+    """
+    Look up CVE details in a local ubuntu-cve-tracker checkout or a tarball of one.
+
+    An index of CVE id to file is built once when the tracker is created, after
+    which every lookup is a dictionary lookup. Tarballs are read in a single pass
+    and the CVE files they contain are kept in memory, compressed. Each CVE file is
+    parsed at most once.
+    """
+
+    def __init__(self, cve_tracker_path: str):
+        self.cve_tracker_path = cve_tracker_path
+        self._cve_files: Dict[str, str] = {}
+        self._compressed_cve_details: Dict[str, bytes] = {}
+        self._cve_records: Dict[str, CveRecord] = {}
+        if os.path.isdir(cve_tracker_path):
+            self._index_directory()
+        else:
+            self._index_tarball()
+        logging.debug(
+            "Indexed %d CVEs in %s", len(self._cve_files) + len(self._compressed_cve_details), cve_tracker_path
+        )
+
+    def _index_directory(self):
+        # Locations are indexed in order of precedence, the first location a CVE is found in wins
+        for location in CVE_DETAILS_TTLS:
+            try:
+                entries = os.scandir(os.path.join(self.cve_tracker_path, location))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith("CVE-") and entry.name not in self._cve_files:
+                        self._cve_files[entry.name] = entry.path
+
+    def _index_tarball(self):
+        locations = list(CVE_DETAILS_TTLS)
+        cve_locations: Dict[str, int] = {}
+        with tarfile.open(self.cve_tracker_path) as cve_tracker_tarball:
+            for member in cve_tracker_tarball:
+                parts = member.name.split("/")
+                if len(parts) < 2 or parts[-2] not in locations or not parts[-1].startswith("CVE-"):
+                    continue
+                if not member.isfile():
+                    continue
+                cve, location = parts[-1], locations.index(parts[-2])
+                if cve_locations.get(cve, len(locations)) <= location:
+                    continue
+                cve_locations[cve] = location
+                self._compressed_cve_details[cve] = zlib.compress(cve_tracker_tarball.extractfile(member).read(), 1)
+
+    def prefetch(self, cves: Iterable[str]):
+        pass  # every lookup is local
+
+    def get_cve_details(self, cve: str) -> str:
+        """returns the ubuntu-cve-tracker file for cve, or an empty string if there is none"""
+        if cve in self._cve_files:
+            with open(self._cve_files[cve], "rb") as cve_file:
+                return cve_file.read().decode("utf-8")
+        if cve in self._compressed_cve_details:
+            return zlib.decompress(self._compressed_cve_details[cve]).decode("utf-8")
+        return ""
+
+    def get_cve_record(self, cve: str) -> CveRecord:
+        """returns the parsed ubuntu-cve-tracker file for cve, or an empty CveRecord if there is none"""
+        if cve not in self._cve_records:
+            self._cve_records[cve] = parse_cve_record(self.get_cve_details(cve))
+        return self._cve_records[cve]
 
 
+class ChangelogContent(NamedTuple):
+    """A changelog read from the changelog store, passed around in place of a changelog filename"""
+
+    name: str
+    content: bytes
+
+    def __str__(self):
+        return self.name
+
+
+def _changelog_size(changelog) -> int:
+    if isinstance(changelog, ChangelogContent):
+        return len(changelog.content)
+    return os.stat(changelog).st_size
+
+
+def _read_changelog(changelog) -> bytes:
+    if isinstance(changelog, ChangelogContent):
+        return changelog.content
+    with open(changelog, "rb") as changelog_file:
+        return changelog_file.read()
+
+
+class ChangelogFile:
+    """
+    A changelog that is parsed one block at a time, only as far as needed.
+
+    Loading the changelog only scans its undecoded content for the header line of
+    each block, which is all that is needed for the versions it contains. Blocks
+    are decoded and parsed when first asked for and kept, so the newest blocks of a
+    long changelog such as linux's are parsed once and the rest, usually already in
+    the older changelog, never are.
+    """
+
+    def __init__(self, content: bytes):
+        headers = list(CHANGELOG_HEADER_PATTERN.finditer(content))
+        #: full_version strings of the blocks in the order they appear in the changelog, newest first
+        self.versions = [header.group(2).decode("utf-8") for header in headers]
+        self.version_set = set(self.versions)
+        self._content = content
+        self._starts = [header.start() for header in headers] + [len(content)]
+        self._blocks: List[Optional[ChangeBlock]] = [None] * len(headers)
+        self._parsed = [False] * len(headers)
+        self._lock = threading.Lock()
+
+    def block(self, index: int) -> Optional[ChangeBlock]:
+        """returns the parsed block at index, or None if it could not be parsed"""
+        with self._lock:
+            if not self._parsed[index]:
+                start, end = self._starts[index], self._starts[index + 1]
+                blocks = list(Changelog(self._content[start:end].decode("utf-8")))
+                self._blocks[index] = blocks[0] if blocks else None
+                self._parsed[index] = True
+            return self._blocks[index]
+
+
+class ParsedChangelogs:
+    """
+    Lazily parsed changelogs, shared between all the binary packages built from the
+    same source package.
+
+    Each changelog file is loaded once, even when several threads ask for it at the
+    same time. Changelogs are kept until their estimated memory use, as if fully
+    parsed, exceeds max_size, at which point the least recently used ones are
+    dropped. Parsed changelog blocks must not be modified.
+    """
+
+    def __init__(self, max_size: int = PARSED_CHANGELOGS_MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._changelogs: "collections.OrderedDict[Tuple[str, int, int], concurrent.futures.Future]" = (
+            collections.OrderedDict()
+        )
+        self._sizes: Dict[Tuple[str, int, int], int] = {}
+
+    def get(self, changelog) -> ChangelogFile:
+        """returns the lazily parsed changelog, a changelog filename or ChangelogContent"""
+        if isinstance(changelog, ChangelogContent):
+            # Stored changelogs of a source package version never change
+            size = len(changelog.content)
+            key = (changelog.name, 0, size)
+        else:
+            stat = os.stat(changelog)
+            size = stat.st_size
+            # Changelog files are replaced rather than modified, which gives them a new inode
+            key = (changelog, stat.st_ino, size)
+        is_loader = False
+        with self._lock:
+            future = self._changelogs.get(key)
+            if future:
+                self._changelogs.move_to_end(key)
+                self.hits += 1
+            else:
+                future = self._changelogs[key] = concurrent.futures.Future()
+                self.misses += 1
+                is_loader = True
+        if not is_loader:
+            return future.result()
+
+        try:
+            changelog_file = ChangelogFile(_read_changelog(changelog))
+        except BaseException as ex:
+            with self._lock:
+                if self._changelogs.get(key) is future:
+                    del self._changelogs[key]
+            future.set_exception(ex)
+            raise
+        future.set_result(changelog_file)
+
+        with self._lock:
+            if self._changelogs.get(key) is future:
+                self._sizes[key] = size * PARSED_CHANGELOG_SIZE_FACTOR
+                self.size += self._sizes[key]
+            while self.size > self.max_size and len(self._changelogs) > 1:
+                evicted_key, _ = self._changelogs.popitem(last=False)
+                self.size -= self._sizes.pop(evicted_key, 0)
+        return changelog_file
+
+
+# Shared by all the changelogs parsed in this process
+parsed_changelogs = ParsedChangelogs()
+
+
+@tracing.traced("to_changelog_filename", "to_version")
 def parse_changelog(
-    launchpad: object,
-    to_changelog_filename: str,
+    cve_tracker: object,
+    to_changelog_filename: Union[str, ChangelogContent],
     to_version: str,
-    from_changelog_filename: Optional[str] = None,
+    from_changelog_filename: Optional[Union[str, ChangelogContent]] = None,
     count: Optional[int] = 1,
     highlight_cves: bool = False,
 ):
@@ -183,6 +883,7 @@ def parse_changelog(
     The range of changelog entries returned will include all entries
     after version_low up to, and including, version_high.
     In case of any parsing issues a non-empty error message is returned to indicate the issue.
+    Changelogs are given as filenames or as ChangelogContent returned by get_changelog.
     """
     changelogs: List[Change] = []
     if not to_version or not to_changelog_filename:
@@ -193,6 +894,7 @@ def parse_changelog(
             from_changelog_filename, to_changelog_filename
         )
         changelog_diff = get_changelog_diff(from_changelog_filename, to_changelog_filename, count)
+        changelog_blocks: List[ChangeBlock] = []
         # The changelog blocks are in reverse order; we'll see high|to before low|from.
         for changelog_block in changelog_diff:
             if not changelog_block.changes():
@@ -207,11 +909,19 @@ def parse_changelog(
                         changelog_block.version.full_version, to_version
                     )
                 )
+            changelog_blocks.append(changelog_block)
+            if count and len(changelog_blocks) == count:
+                break  # we have enough blocks now
+
+        if highlight_cves:
+            # Look up all the CVEs referenced in the changelog entries at once
+            cve_tracker.prefetch(cve for block in changelog_blocks for cve in _find_cves(block.changes()))
 
+        for changelog_block in changelog_blocks:
             # Attempt to parse theCVEs referenced in the changelog entries
             cves = []
             if highlight_cves:
-                cves = _parse_cve_details(changelog_block.changes(), launchpad)
+                cves = _parse_cve_details(changelog_block.changes(), cve_tracker)
 
             changelog_change = Change(
                 package=changelog_block.package,
@@ -225,8 +935,6 @@ def parse_changelog(
                 cves=cves,
             )
             changelogs.append(changelog_change)
-            if count and len(changelogs) == count:
-                break  # we have enough blocks now
 
         # log a warning if we have no changelog
         if not changelogs:
@@ -245,39 +953,44 @@ def parse_changelog(
 def check_version_downgrade(from_changelog_filename, to_changelog_filename):
     is_version_downgrade = False
     if from_changelog_filename:
-        with open(from_changelog_filename) as from_changelog, open(to_changelog_filename) as to_changelog:
-            # Use changelog length to determine if there's been a version downgrade,
-            # as using version comparison is not reliable, especially with some fips version schemes
-            if os.fstat(from_changelog.fileno()).st_size > os.fstat(to_changelog.fileno()).st_size:
-                is_version_downgrade = True
-                from_changelog_filename, to_changelog_filename = to_changelog_filename, from_changelog_filename
+        # Use changelog length to determine if there's been a version downgrade,
+        # as using version comparison is not reliable, especially with some fips version schemes
+        if _changelog_size(from_changelog_filename) > _changelog_size(to_changelog_filename):
+            is_version_downgrade = True
+            from_changelog_filename, to_changelog_filename = to_changelog_filename, from_changelog_filename
     return from_changelog_filename, to_changelog_filename, is_version_downgrade
 
 
 def get_changelog_diff(
-    from_changelog_filename: Optional[str], to_changelog_filename: str, count: Optional[int]
+    from_changelog_filename: Optional[Union[str, ChangelogContent]],
+    to_changelog_filename: Union[str, ChangelogContent],
+    count: Optional[int],
 ) -> List[ChangeBlock]:
     """
     This function finds the version numbers present in to_changelog file
     but not in from_changelog file and returns a list of changelog blocks
-    of those versions.
+    of those versions. to_changelog is read newest first and only parsed
+    up to the first version that is also in from_changelog.
     """
     try:
         from_changelog_versions: Set[str] = set()
         changelog_diff: List[ChangeBlock] = []
         if from_changelog_filename:
-            from_changelog_versions = set(get_versions_from_changelog(from_changelog_filename))
+            from_changelog_versions = get_versions_from_changelog(from_changelog_filename)
 
-        with open(to_changelog_filename, "r") as to_changelog_file_ptr:
-            parsed_to_changelog = Changelog(to_changelog_file_ptr.read())
-            for changelog_block in parsed_to_changelog:
-                if changelog_block._no_trailer == True:
-                    logging.warning(f"Changelog block with no trailer found; omitting from diff: {changelog_block}")
-                    continue
-                if changelog_block.version.full_version not in from_changelog_versions:
-                    changelog_diff += [changelog_block]
-                if count and len(changelog_diff) == count:
-                    break
+        to_changelog = parsed_changelogs.get(to_changelog_filename)
+        for index, version in enumerate(to_changelog.versions):
+            if version in from_changelog_versions:
+                break  # this and all older blocks are in from_changelog too
+            changelog_block = to_changelog.block(index)
+            if changelog_block is None:
+                continue
+            if changelog_block._no_trailer == True:
+                logging.warning(f"Changelog block with no trailer found; omitting from diff: {changelog_block}")
+                continue
+            changelog_diff += [changelog_block]
+            if count and len(changelog_diff) == count:
+                break
         return changelog_diff
 
     except Exception as ex:
@@ -285,15 +998,15 @@ def get_changelog_diff(
         raise ex
 
 
-def get_versions_from_changelog(changelog_filename: str) -> Set[str]:
+def get_versions_from_changelog(changelog_filename: Union[str, ChangelogContent]) -> Set[str]:
     """
     Returns a set of all full_version strings in passed changelog
     """
-    with open(changelog_filename, "r") as from_changelog_file_ptr:
-        return {version.full_version for version in Changelog(from_changelog_file_ptr.read()).versions}
+    return parsed_changelogs.get(changelog_filename).version_set
 
 
 @retry
+@tracing.traced("source_package_name", "source_package_version")
 def get_changelog(
     launchpad,
     ubuntu,
@@ -302,95 +1015,842 @@ def get_changelog(
     source_package_name,
     source_package_version,
     ppas,
+    missing=None,
+    ppa_archives=None,
 ):
     """
-    Download changelog for source / version and returns path to that
+    Download changelog for source / version and returns its content
     :param launchpad: launchpad
     :param ubuntu: ubuntu
     :param lp_series: lp_series
+    :param str cache_directory: Directory of the changelog store. Stored changelogs are reused across runs
     :param str source_package_name: Binary package name
     :param str source_package_version: Package version
     :param list ppas: List of possible ppas package installed from
+    :param cache.NegativeCache missing: Archives known not to have the changelog are not searched
+    :param PpaArchives ppa_archives: If set the PPAs are searched concurrently
     :raises Exception: If changelog file could not be downloaded
-    :return: changelog file for source package & version
-    :param str image_architecture: Architecture of the image which the manifest belongs to
-    :rtype: str
+    :return: changelog content for source package & version
+    :rtype: ChangelogContent
     """
 
-    cache_filename = "%s/changelog.%s_%s" % (
-        cache_directory,
-        source_package_name,
-        source_package_version,
-    )
+    changelog_store = cache.ChangelogStore(cache_directory)
+    changelog_name = "changelog.%s_%s" % (source_package_name, source_package_version)
 
-    if os.path.isfile(cache_filename):
+    changelog_content = changelog_store.get(source_package_name, source_package_version)
+    if changelog_content is not None:
         logging.debug(
             "Using cached changelog for %s:%s",
             source_package_name,
             source_package_version,
         )
-        return cache_filename
+        return ChangelogContent(changelog_name, changelog_content)
 
     package_version_in_archive_changelog = False
     package_version_in_ppa_changelog = False
     archive = ubuntu.main_archive
+    missing_key: Tuple[str, ...] = ()
+    if missing is not None:
+        missing_key = ("changelog", str(lp_series.self_link), source_package_name, source_package_version)
 
     # Get the published sources for this exact version
-    sources = archive.getPublishedSources(
-        exact_match=True,
-        source_name=source_package_name,
-        distro_series=lp_series,
-        order_by_date=True,
-        version=source_package_version,
-    )
-    with open(cache_filename, "wb") as cache_file:
-        if len(sources):
-            archive_changelog_url = sources[0].changelogUrl()
+    sources = []
+    is_missing_from_archive = _is_known_missing(missing, missing_key, PRIMARY_ARCHIVE_NAME)
+    if not is_missing_from_archive:
+        sources = archive.getPublishedSources(
+            exact_match=True,
+            source_name=source_package_name,
+            distro_series=lp_series,
+            order_by_date=True,
+            version=source_package_version,
+        )
+    changelog_content = None
+    if len(sources):
+        archive_changelog_url = sources[0].changelogUrl()
+
+        _patched_archive_changelog_url = launchpad._root_uri.append(
+            urllib.parse.urlparse(archive_changelog_url).path.lstrip("/")
+        )
+
+        archive_changelog = launchpad._browser.get(_patched_archive_changelog_url)
+
+        # The changelog can be several megabytes, look for the version without decoding it
+        if source_package_version.encode("utf-8") in archive_changelog:
+            changelog_content = archive_changelog
+            package_version_in_archive_changelog = True
+
+    if not package_version_in_archive_changelog:
+        if not is_missing_from_archive:
+            _add_missing(missing, missing_key, PRIMARY_ARCHIVE_NAME)
+
+        # Attempt to get the changelog from any of the passed in PPAs instead
+        def search_ppa(launchpad, archive, ppa):
+            # using pocket "Release" when using a PPA ...'
+            pocket = "Release"
+            sources = archive.getPublishedSources(
+                exact_match=True,
+                pocket=pocket,
+                source_name=source_package_name,
+                distro_series=lp_series,
+                order_by_date=True,
+                version=source_package_version,
+            )
+            if len(sources):
+                ppa_changelog_url = sources[0].changelogUrl()
+
+                _patched_ppa_changelog_url = launchpad._root_uri.append(
+                    urllib.parse.urlparse(ppa_changelog_url).path.lstrip("/")
+                )
+
+                ppa_changelog = launchpad._browser.get(_patched_ppa_changelog_url)
+
+                if source_package_version.encode("utf-8") in ppa_changelog:
+                    return ppa_changelog
+            _add_missing(missing, missing_key, _ppa_archive_name(ppa))
+            return None
+
+        changelog_content = _search_ppas(
+            launchpad,
+            [ppa for ppa in ppas if not _is_known_missing(missing, missing_key, _ppa_archive_name(ppa))],
+            search_ppa,
+            ppa_archives,
+        )
+        package_version_in_ppa_changelog = changelog_content is not None
+
+    if not package_version_in_archive_changelog and not package_version_in_ppa_changelog:
+        # No changelog can be found for this package and package version, return a placeholder.
+        # Published changelogs never change but a missing one might still be published, so the
+        # placeholder is not stored.
+        changelog_content = "Unable to find changelog for srouce package {} " "version {}.".format(
+            source_package_name, source_package_version
+        ).encode("utf-8")
+        return ChangelogContent("{}.missing".format(changelog_name), changelog_content)
+
+    changelog_store.put(source_package_name, source_package_version, changelog_content)
+    return ChangelogContent(changelog_name, changelog_content)
+
+
+class SourcePackageResolver:
+    """
+    Resolve binary packages to their source packages, sharing lookups.
+
+    Every binary package version is only looked up once per run, even when it is
+    resolved from several threads at the same time. Once a source package is known,
+    all of the binary packages built from it are fetched in one query so that other
+    expected binary packages from the same source need no query of their own.
+
+    A published binary package version is always built from the same source package
+    version, so resolved binary packages are kept in an optional cache.JsonStore and
+    never looked up again in later runs. Binary packages that could not be found are
+    remembered in an optional cache.NegativeCache for a while instead.
+
+    The resolver is not tied to one image, so it can be shared by every changelog
+    generated in a process. Binary packages are identified by architecture, name
+    and version; PPAs only widen where a binary package is searched for.
+    """
+
+    def __init__(self, session, store=None, missing: Optional[cache.NegativeCache] = None):
+        self.session = session
+        self.store = store
+        self.missing = missing
+        self.ppa_archives = PpaArchives(session)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (architecture tag, binary package name, binary package version) -> Future of
+        # (source package name, source package version)
+        self._published_binaries: Dict[Tuple[str, str, str], concurrent.futures.Future] = {}
+        self._stored_binaries: Set[Tuple[str, str, str]] = set()
+        if self.store:
+            for stored_key, source_package_details in self.store.load().items():
+                key = tuple(stored_key.split(" "))
+                self._set_published_binary(key, tuple(source_package_details))
+                self._stored_binaries.add(key)
+        # (architecture tag, binary package version) -> binary package names expected to be resolved
+        self._expected: Dict[Tuple[str, str], Set[str]] = collections.defaultdict(set)
+        self._expanded_sources: Set[Tuple[str, str, str]] = set()
+
+    @staticmethod
+    def _split_architecture(image_architecture, binary_package_name):
+        # Packages names might include an arch. If so, that arch trumps the image arch.
+        binary_package_name, _, binary_arch_name = binary_package_name.partition(":")
+        return binary_arch_name or image_architecture, binary_package_name
+
+    def expect(self, image_architecture: str, binary_packages: Iterable[Tuple[str, str]]):
+        """
+        Register the (binary package name, binary package version) pairs that are
+        going to be resolved. Binary packages built from one source package usually
+        share a version, so expected binary packages with the same version as one
+        just resolved are looked up together with it.
+        """
+        with self._lock:
+            for binary_package_name, binary_package_version in binary_packages:
+                archtag, binary_package_name = self._split_architecture(image_architecture, binary_package_name)
+                self._expected[(archtag, binary_package_version)].add(binary_package_name)
+
+    def get_source_package_details(
+        self,
+        series: str,
+        image_architecture: str,
+        binary_package_name: str,
+        binary_package_version: str,
+        ppas: List[str],
+    ):
+        archtag, name = self._split_architecture(image_architecture, binary_package_name)
+        key = (archtag, name, binary_package_version)
+        with self._lock:
+            published_binary = self._published_binaries.get(key)
+            is_lookup_owner = published_binary is None
+            if is_lookup_owner:
+                self.misses += 1
+                published_binary = self._published_binaries[key] = concurrent.futures.Future()
+            else:
+                self.hits += 1
+        if not is_lookup_owner:
+            return published_binary.result()
 
-            _patched_archive_changelog_url = launchpad._root_uri.append(
-                urllib.parse.urlparse(archive_changelog_url).path.lstrip("/")
+        try:
+            source_package_details = get_source_package_details(
+                self.session.ubuntu,
+                self.session.launchpad,
+                self.session.get_arch_series(series, archtag),
+                binary_package_name,
+                binary_package_version,
+                ppas,
+                missing=self.missing,
+                ppa_archives=self.ppa_archives,
             )
+        except BaseException as ex:
+            # Failures are not memoised: the lookup depends on the PPAs, which differ
+            # between the jobs sharing a resolver, and misses are already remembered
+            # per archive by the NegativeCache. Callers already waiting get the error.
+            with self._lock:
+                del self._published_binaries[key]
+            published_binary.set_exception(ex)
+            raise
+        published_binary.set_result(source_package_details)
+        self._expand_source(series, archtag, binary_package_version, source_package_details, ppas)
+        return source_package_details
+
+    def _expand_source(self, series, archtag, binary_package_version, source_package_details, ppas):
+        source_package_name, source_package_version = source_package_details
+        with self._lock:
+            unresolved_siblings = [
+                name
+                for name in self._expected.get((archtag, binary_package_version), ())
+                if (archtag, name, binary_package_version) not in self._published_binaries
+            ]
+            source_key = (series, source_package_name, source_package_version)
+            if not unresolved_siblings or source_key in self._expanded_sources:
+                return
+            self._expanded_sources.add(source_key)
 
-            archive_changelog = launchpad._browser.get(_patched_archive_changelog_url)
-
-            if source_package_version in archive_changelog.decode("utf-8"):
-                cache_file.write(archive_changelog)
-                package_version_in_archive_changelog = True
-
-        if not package_version_in_archive_changelog:
-            # Attempt to get the changelog from any of the passed in PPAs instead
-            for ppa in ppas:
-                ppa_owner, ppa_name = ppa.split("/")
-                archive = launchpad.people[ppa_owner].getPPAByName(name=ppa_name)
-                # using pocket "Release" when using a PPA ...'
-                pocket = "Release"
-                sources = archive.getPublishedSources(
-                    exact_match=True,
-                    pocket=pocket,
-                    source_name=source_package_name,
-                    distro_series=lp_series,
-                    order_by_date=True,
-                    version=source_package_version,
+        try:
+            source_package_binaries = get_source_package_binaries(
+                self.session.ubuntu,
+                self.session.launchpad,
+                self.session.get_series(series),
+                source_package_name,
+                source_package_version,
+                ppas,
+                ppa_archives=self.ppa_archives,
+            )
+        except Exception as ex:
+            # Only an optimisation; the siblings are looked up individually instead
+            logging.warning(
+                "Unable to list binary packages built from {} {}: {}".format(
+                    source_package_name, source_package_version, ex
                 )
-                if len(sources):
-                    ppa_changelog_url = sources[0].changelogUrl()
+            )
+            return
+
+        with self._lock:
+            for source_package_binary in source_package_binaries:
+                if source_package_binary not in self._published_binaries:
+                    self._set_published_binary(source_package_binary, source_package_details)
+
+    def _set_published_binary(self, key, source_package_details):
+        published_binary = concurrent.futures.Future()
+        published_binary.set_result(source_package_details)
+        self._published_binaries[key] = published_binary
+
+    def save(self):
+        """Add the binary packages resolved during this run to the store"""
+        if not self.store:
+            return
+        with self._lock:
+            resolved = {
+                key: published_binary.result()
+                for key, published_binary in self._published_binaries.items()
+                if key not in self._stored_binaries
+                and published_binary.done()
+                and not published_binary.cancelled()
+                and not published_binary.exception()
+            }
+        self.store.update(
+            {" ".join(key): list(source_package_details) for key, source_package_details in resolved.items()}
+        )
+        self._stored_binaries.update(resolved)
+
+
+class PreviousChangelogs:
+    """
+    Changed deb packages from previously generated changelogs.
 
-                    _patched_ppa_changelog_url = launchpad._root_uri.append(
-                        urllib.parse.urlparse(ppa_changelog_url).path.lstrip("/")
+    A changelog between two serials can be composed from stored changelogs between
+    the serials in between, e.g. A to C from A to B and B to C. A package's changes
+    are only composed if stored changes link up exactly from its from version to its
+    to version, otherwise it is resolved as usual.
+    """
+
+    def __init__(self, changelogs: Iterable[ChangelogModel]):
+        self._diffs: Dict[Tuple[str, str], List[DebPackage]] = collections.defaultdict(list)
+        for changelog in changelogs:
+            for deb_package in changelog.diff.deb:
+                # Downgrades and packages with missing changelogs can not be composed
+                if deb_package.is_version_downgrade or not deb_package.changes:
+                    continue
+                self._diffs[(deb_package.name, deb_package.from_version.version)].append(deb_package)
+
+    @classmethod
+    def load(cls, changelog_json_filenames: Iterable[str], series: Iterable[str], image_architecture: str):
+        """
+        returns the PreviousChangelogs of the changelog JSON files generated between the
+        series in series for image_architecture. Other changelogs are ignored with a warning
+        as the same binary package version can be built differently there.
+        """
+        series = set(series)
+        changelogs = []
+        for changelog_json_filename in changelog_json_filenames:
+            with open(changelog_json_filename, "rb") as changelog_json_file:
+                changelog = ChangelogModel.model_validate_json(changelog_json_file.read())
+            # Changelogs generated before the image architecture was recorded are assumed to match
+            is_matching = {changelog.from_series, changelog.to_series} <= series and changelog.image_architecture in (
+                None,
+                image_architecture,
+            )
+            if not is_matching:
+                logging.warning(
+                    "Ignoring previous changelog {} from {} to {} for {}, it does not match {} for {}".format(
+                        changelog_json_filename,
+                        changelog.from_series,
+                        changelog.to_series,
+                        changelog.image_architecture or "an unknown architecture",
+                        " and ".join(sorted(series)),
+                        image_architecture,
                     )
+                )
+                continue
+            changelogs.append(changelog)
+        return cls(changelogs)
+
+    def _find_chain(self, package, from_version, to_version, seen):
+        for deb_package in self._diffs.get((package, from_version), []):
+            next_version = deb_package.to_version.version
+            if next_version == to_version:
+                return [deb_package]
+            if next_version in seen:
+                continue
+            seen.add(next_version)
+            chain = self._find_chain(package, next_version, to_version, seen)
+            if chain:
+                return [deb_package] + chain
+        return None
+
+    def compose_diff(
+        self, package: str, from_version: str, to_version: str, highlight_cves: bool = False
+    ) -> Optional[DebPackage]:
+        """returns the changed package composed from previous changelogs, or None if it can not be composed"""
+        chain = self._find_chain(package, from_version, to_version, {from_version})
+        if not chain:
+            return None
+        changes: List[Change] = []
+        change_versions = set()
+        # The most recent changes are listed first
+        for deb_package in reversed(chain):
+            for change in deb_package.changes:
+                # CVEs are only looked up when highlighting them, the previous changelog may not have done so
+                if highlight_cves and not change.cves and _find_cves(change.log):
+                    return None
+                if change.version not in change_versions:
+                    change_versions.add(change.version)
+                    changes.append(change)
+
+        diff_deb_package = DebPackage(
+            name=package,
+            from_version=chain[0].from_version,
+            to_version=chain[-1].to_version,
+            is_version_downgrade=False,
+        )
+        for change in changes:
+            diff_deb_package.cves.extend(change.cves)
+            diff_deb_package.launchpad_bugs_fixed.extend(change.launchpad_bugs_fixed)
+            diff_deb_package.changes.append(change)
+        return diff_deb_package
+
+
+class ChangelogDiff(NamedTuple):
+    is_version_downgrade: bool
+    changes: List[Change]
+
+
+def _is_missing_changelog(changelog: Union[str, ChangelogContent]) -> bool:
+    """returns True for the placeholder get_changelog returns when no changelog could be found"""
+    return isinstance(changelog, ChangelogContent) and changelog.name.endswith(".missing")
+
+
+class ChangelogDiffs:
+    """
+    Changelog diffs between two source package versions, each computed once.
+
+    Binary packages built from the same source package usually change together,
+    so their changelog diff is computed for the first of them and shared by the
+    others, even when they are resolved from several threads at the same time.
+    Diffs are also kept in an optional cache.JsonEntryStore and reused by later
+    runs over other images. Published changelogs never change, but CVE details
+    do, so stored diffs with highlighted CVEs expire with the active CVE details.
+
+    A diff is identified by (from source package name, from source package version,
+    to source package name, to source package version, highlight_cves). Diffs of
+    missing changelogs depend on the PPAs searched and are neither kept nor stored.
+    """
+
+    def __init__(self, store: Optional[cache.JsonEntryStore] = None, cves_ttl: int = CVE_DETAILS_TTLS["active"]):
+        self.store = store
+        self.cves_ttl = cves_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._diffs: Dict[Tuple[str, str, str, str, bool], concurrent.futures.Future] = {}
+
+    @staticmethod
+    def _store_key(key):
+        return "{} {} {} {} {}".format(*key)
+
+    def _load(self, key) -> Optional[ChangelogDiff]:
+        if not self.store:
+            return None
+        entry = self.store.get(self._store_key(key))
+        if not entry:
+            return None
+        highlight_cves = key[4]
+        if highlight_cves and time.time() - entry["created"] >= self.cves_ttl:
+            return None
+        return ChangelogDiff(
+            entry["is_version_downgrade"], [Change.model_validate(change) for change in entry["changes"]]
+        )
+
+    def _save(self, key, changelog_diff: ChangelogDiff):
+        if not self.store:
+            return
+        self.store.put(
+            self._store_key(key),
+            {
+                "created": time.time(),
+                "is_version_downgrade": changelog_diff.is_version_downgrade,
+                "changes": [change.model_dump() for change in changelog_diff.changes],
+            },
+        )
+
+    def is_known(self, key: Tuple[str, str, str, str, bool]) -> bool:
+        """returns True if the diff for key has been computed, now or in an earlier run, and is kept in memory"""
+        with self._lock:
+            if key in self._diffs:
+                return True
+        changelog_diff = self._load(key)
+        if changelog_diff is None:
+            return False
+        with self._lock:
+            if key not in self._diffs:
+                self._diffs[key] = concurrent.futures.Future()
+                self._diffs[key].set_result(changelog_diff)
+        return True
+
+    def get(
+        self,
+        key: Tuple[str, str, str, str, bool],
+        compute_diff: Callable[[], Tuple[ChangelogDiff, bool]],
+    ) -> ChangelogDiff:
+        """
+        returns the diff for key, calling compute_diff() if it is not known yet. compute_diff
+        returns the diff and whether it may be stored, which it may not if a changelog was missing.
+        """
+        self.is_known(key)
+        with self._lock:
+            changelog_diff = self._diffs.get(key)
+            is_computer = changelog_diff is None
+            if is_computer:
+                self.misses += 1
+                changelog_diff = self._diffs[key] = concurrent.futures.Future()
+            else:
+                self.hits += 1
+        if not is_computer:
+            return changelog_diff.result()
+
+        try:
+            computed_changelog_diff, is_storable = compute_diff()
+        except BaseException as ex:
+            with self._lock:
+                del self._diffs[key]
+            changelog_diff.set_exception(ex)
+            raise
+        if is_storable:
+            self._save(key, computed_changelog_diff)
+        else:
+            # A missing changelog may be found by a later job that searches other PPAs,
+            # so the diff is only shared with the callers already waiting for it
+            with self._lock:
+                del self._diffs[key]
+        changelog_diff.set_result(computed_changelog_diff)
+        return computed_changelog_diff
+
+
+class ChangelogResolver:
+    """
+    Resolve deb packages to their source packages and changelog entries.
 
-                    ppa_changelog = launchpad._browser.get(_patched_ppa_changelog_url)
+    All methods are safe to call concurrently from worker threads; each thread
+    talks to Launchpad through its own handles from the LaunchpadSession.
+    """
+
+    def __init__(
+        self,
+        session,
+        from_series: str,
+        to_series: str,
+        image_architecture: str,
+        cache_directory: str,
+        ppas: List[str],
+        highlight_cves: bool = False,
+        source_packages: Optional[SourcePackageResolver] = None,
+        cve_tracker: Optional[CveTracker] = None,
+        previous_changelogs: Optional[PreviousChangelogs] = None,
+        missing: Optional[cache.NegativeCache] = None,
+        changelog_diffs: Optional[ChangelogDiffs] = None,
+    ):
+        self.session = session
+        self.from_series = from_series
+        self.to_series = to_series
+        self.image_architecture = image_architecture
+        self.cache_directory = cache_directory
+        self.ppas = ppas
+        self.highlight_cves = highlight_cves
+        self.source_packages = source_packages or SourcePackageResolver(session)
+        self.cve_tracker = cve_tracker or CveTracker(transport.HTTPFetcher())
+        self.previous_changelogs = previous_changelogs
+        self.missing = missing
+        self.changelog_diffs = changelog_diffs or ChangelogDiffs()
+        self._lock = threading.Lock()
+        # (series, source package name, source package version) -> Future of ChangelogContent
+        self._changelogs: Dict[Tuple[str, str, str], concurrent.futures.Future] = {}
+
+    def expect(self, binary_packages: Iterable[Tuple[str, str]]):
+        self.source_packages.expect(self.image_architecture, binary_packages)
+
+    def get_source_package_details(self, series, binary_package_name, binary_package_version):
+        return self.source_packages.get_source_package_details(
+            series, self.image_architecture, binary_package_name, binary_package_version, self.ppas
+        )
+
+    def get_changelog(self, series, source_package_name, source_package_version):
+        """returns the changelog of a source package version, downloaded at most once per resolver unless it fails"""
+        key = (series, source_package_name, source_package_version)
+        with self._lock:
+            changelog = self._changelogs.get(key)
+            is_fetcher = changelog is None
+            if is_fetcher:
+                changelog = self._changelogs[key] = concurrent.futures.Future()
+        if not is_fetcher:
+            return changelog.result()
+
+        try:
+            changelog_content = get_changelog(
+                self.session.launchpad,
+                self.session.ubuntu,
+                self.session.get_series(series),
+                self.cache_directory,
+                source_package_name,
+                source_package_version,
+                self.ppas,
+                missing=self.missing,
+                ppa_archives=self.source_packages.ppa_archives,
+            )
+        except BaseException as ex:
+            # Dropped so that a later request retries, callers already waiting get the error
+            with self._lock:
+                del self._changelogs[key]
+            changelog.set_exception(ex)
+            raise
+        changelog.set_result(changelog_content)
+        return changelog_content
+
+    def _changelog_diff_key(self, from_source_package: Tuple[str, str], to_source_package: Tuple[str, str]):
+        return (*from_source_package, *to_source_package, self.highlight_cves)
+
+    def diff_changelogs(
+        self,
+        from_series: str,
+        from_source_package: Tuple[str, str],
+        to_series: str,
+        to_source_package: Tuple[str, str],
+    ) -> ChangelogDiff:
+        """
+        returns the changelog entries of to_source_package, (name, version), that are not in the
+        changelog of from_source_package. Each diff is only computed once, see ChangelogDiffs.
+        """
+
+        def compute_diff():
+            from_changelog = self.get_changelog(from_series, *from_source_package)
+            to_changelog = self.get_changelog(to_series, *to_source_package)
+            is_version_downgrade, changes = parse_changelog(
+                self.cve_tracker,
+                to_changelog_filename=to_changelog,
+                to_version=to_source_package[1],
+                from_changelog_filename=from_changelog,
+                count=None,
+                highlight_cves=self.highlight_cves,
+            )
+            is_storable = not _is_missing_changelog(from_changelog) and not _is_missing_changelog(to_changelog)
+            return ChangelogDiff(is_version_downgrade, changes), is_storable
+
+        return self.changelog_diffs.get(self._changelog_diff_key(from_source_package, to_source_package), compute_diff)
+
+    def binary_packages_to_resolve(
+        self,
+        removed: Dict[str, str],
+        added: Dict[str, str],
+        changed: Dict[str, Tuple[str, str]],
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Resolution phase 1. returns the distinct (series, binary package name, binary package
+        version) that need resolving to a source package for the removed, added and changed
+        deb packages, in manifest order.
+        """
+        binary_packages = dict.fromkeys(
+            [(self.to_series, package, version) for package, version in removed.items()]
+            + [(self.to_series, package, version) for package, version in added.items()]
+            + [(self.from_series, package, from_version) for package, (from_version, _) in changed.items()]
+            + [(self.to_series, package, to_version) for package, (_, to_version) in changed.items()]
+        )
+        return list(binary_packages)
+
+    def resolve_binary_packages(
+        self, executor: concurrent.futures.Executor, binary_packages: List[Tuple[str, str, str]]
+    ) -> Dict[Tuple[str, str, str], Tuple[str, str]]:
+        """
+        Resolution phase 2. Resolve all binary packages from binary_packages_to_resolve
+        concurrently on executor. Binary packages built from the same source package are
+        looked up together.
+
+        returns (series, binary package name, binary package version) -> (source package name,
+        source package version)
+        """
+        self.expect((package, version) for _, package, version in binary_packages)
+        source_package_details = executor.map(
+            self.get_source_package_details,
+            [series for series, _, _ in binary_packages],
+            [package for _, package, _ in binary_packages],
+            [version for _, _, version in binary_packages],
+        )
+        return dict(zip(binary_packages, source_package_details))
+
+    def source_packages_to_fetch(
+        self,
+        source_package_details: Dict[Tuple[str, str, str], Tuple[str, str]],
+        removed: Dict[str, str],
+        added: Dict[str, str],
+        changed: Dict[str, Tuple[str, str]],
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Resolution phase 3, planning. returns the distinct (series, source package name,
+        source package version) whose changelogs are needed to render the added and changed
+        deb packages, given the resolved source_package_details from resolve_binary_packages.
+        """
+        # source package name -> source package of the first removed package built from it
+        removed_sources: Dict[str, Tuple[str, str]] = {}
+        for package, version in removed.items():
+            removed_source_package = source_package_details[(self.to_series, package, version)]
+            removed_sources.setdefault(removed_source_package[0], removed_source_package)
+        source_packages: Dict[Tuple[str, str, str], None] = {}
+        for package, version in added.items():
+            to_source_package = source_package_details[(self.to_series, package, version)]
+            source_packages[(self.to_series, *to_source_package)] = None
+            # The changelog of a removed package with the same source package is diffed against, see resolve_added
+            if to_source_package[0] in removed_sources:
+                source_packages[(self.from_series, *removed_sources[to_source_package[0]])] = None
+        for package, (from_version, to_version) in changed.items():
+            from_source_package = source_package_details[(self.from_series, package, from_version)]
+            to_source_package = source_package_details[(self.to_series, package, to_version)]
+            # No changelogs are needed for a diff that is already known
+            if self.changelog_diffs.is_known(self._changelog_diff_key(from_source_package, to_source_package)):
+                continue
+            source_packages[(self.from_series, *from_source_package)] = None
+            source_packages[(self.to_series, *to_source_package)] = None
+        return list(source_packages)
+
+    def fetch_changelogs(self, executor: concurrent.futures.Executor, source_packages: List[Tuple[str, str, str]]):
+        """
+        Resolution phase 3. Download the changelogs of all source_packages from
+        source_packages_to_fetch concurrently on executor, so that rendering the
+        packages afterwards needs no further Launchpad requests.
+        """
+        for _ in executor.map(
+            self.get_changelog,
+            [series for series, _, _ in source_packages],
+            [source_package_name for _, source_package_name, _ in source_packages],
+            [source_package_version for _, _, source_package_version in source_packages],
+        ):
+            pass
+
+    def compose_diff(self, package: str, from_version: str, to_version: str) -> Optional[DebPackage]:
+        """returns the changed package composed from previous changelogs, or None if it needs resolving"""
+        if not self.previous_changelogs:
+            return None
+        return self.previous_changelogs.compose_diff(package, from_version, to_version, self.highlight_cves)
+
+    @tracing.traced("package", "version")
+    def resolve_removed(
+        self, package: str, version: str, source_package_details: Dict[Tuple[str, str, str], Tuple[str, str]]
+    ) -> DebPackage:
+        # Get the source package name and source package version for the removed package
+        source_package_name, source_package_version = source_package_details[(self.to_series, package, version)]
+        return DebPackage(
+            name=package,
+            from_version=FromVersion(
+                version=version,
+                source_package_name=source_package_name,
+                source_package_version=source_package_version,
+            ),
+            to_version=ToVersion(version=None),
+            is_version_downgrade=False,
+        )
+
+    @tracing.traced("package", "version")
+    def resolve_added(
+        self,
+        package: str,
+        version: str,
+        removed_deb_packages: List[DebPackage],
+        source_package_details: Dict[Tuple[str, str, str], Tuple[str, str]],
+    ) -> DebPackage:
+        to_source_package_name, to_source_package_version = source_package_details[(self.to_series, package, version)]
+        to_package_changelog_file = self.get_changelog(
+            self.to_series, to_source_package_name, to_source_package_version
+        )
 
-                    if source_package_version in ppa_changelog.decode("utf-8"):
-                        cache_file.write(ppa_changelog)
-                        package_version_in_ppa_changelog = True
-                        break  # no need to continue iterating the PPA list
+        # Is the source package of this added binary package the same as the source package of a removed
+        # binary package? If so then this is likley a binary package rename and we can get the changelog between
+        # the source package version removed and the source package version added.
+        notes = None
+        version_added_changelogs: List[Change] = []
+        for removed_deb_package in removed_deb_packages:
+            if removed_deb_package.from_version.source_package_name == to_source_package_name:
+                removed_source_package_name = removed_deb_package.from_version.source_package_name
+                removed_source_package_version = removed_deb_package.from_version.source_package_version
+                # Version downgrade check is ignored here as it is not relevant
+                version_added_changelogs = self.diff_changelogs(
+                    self.from_series,
+                    (removed_source_package_name, removed_source_package_version),
+                    self.to_series,
+                    (to_source_package_name, to_source_package_version),
+                ).changes
+                from_version = FromVersion(
+                    version=None,
+                    source_package_name=removed_source_package_name,
+                    source_package_version=removed_source_package_version,
+                )
+                notes = (
+                    "{} version '{}' (source package {} version '{}') was added. "
+                    "{} version '{}' has the same source package name, "
+                    "{}, as removed package {}. As such we can use the source package version of the "
+                    "removed package, '{}', as the starting point in our changelog diff. Kernel packages "
+                    "are an example of where the binary package name changes for the same source "
+                    "package. Using the removed package source package version as our starting point "
+                    "means we can still get meaningful changelog diffs even for what appears to be "
+                    "a new package.".format(
+                        package,
+                        version,
+                        to_source_package_name,
+                        to_source_package_version,
+                        package,
+                        version,
+                        to_source_package_name,
+                        removed_deb_package.name,
+                        removed_deb_package.from_version.source_package_version,
+                    )
+                )
+                break
 
-        if not package_version_in_archive_changelog and not package_version_in_ppa_changelog:
-            # can be found for this package and package version
-            cache_file.write(
-                "Unable to find changelog for srouce package {} "
-                "version {}.".format(source_package_name, source_package_version).encode("utf-8")
+        # If the source package of this added binary package is not the same as the source package of a removed
+        # binary package then get the three most recent changelog entries
+        if not version_added_changelogs:
+            # Version downgrade check is ignored here as it is not relevant
+            _, version_added_changelogs = parse_changelog(
+                self.cve_tracker,
+                to_changelog_filename=to_package_changelog_file,
+                to_version=to_source_package_version,
+                count=3,
+                highlight_cves=self.highlight_cves,
             )
+            from_version = FromVersion(version=None)
+            notes = "For a newly added package only the three most recent changelog entries are shown."
+
+        added_deb_package = DebPackage(
+            name=package,
+            from_version=from_version,
+            to_version=ToVersion(
+                version=version,
+                source_package_name=to_source_package_name,
+                source_package_version=to_source_package_version,
+            ),
+            notes=notes,
+            is_version_downgrade=False,
+        )
+        for version_added_changelog_change in version_added_changelogs:
+            added_deb_package.cves.extend(version_added_changelog_change.cves)
+            added_deb_package.launchpad_bugs_fixed.extend(version_added_changelog_change.launchpad_bugs_fixed)
+            added_deb_package.changes.append(version_added_changelog_change)
+        return added_deb_package
 
-    return cache_filename
+    @tracing.traced("package", "from_version", "to_version")
+    def resolve_diff(
+        self,
+        package: str,
+        from_version: str,
+        to_version: str,
+        source_package_details: Dict[Tuple[str, str, str], Tuple[str, str]],
+    ) -> DebPackage:
+        from_source_package_name, from_source_package_version = source_package_details[
+            (self.from_series, package, from_version)
+        ]
+        to_source_package_name, to_source_package_version = source_package_details[
+            (self.to_series, package, to_version)
+        ]
+
+        # get changelog just between the from and to version, shared by all binary packages of the source package
+        is_version_downgrade, version_diff_changelogs = self.diff_changelogs(
+            self.from_series,
+            (from_source_package_name, from_source_package_version),
+            self.to_series,
+            (to_source_package_name, to_source_package_version),
+        )
+
+        diff_deb_package = DebPackage(
+            name=package,
+            from_version=FromVersion(
+                version=from_version,
+                source_package_name=from_source_package_name,
+                source_package_version=from_source_package_version,
+            ),
+            to_version=ToVersion(
+                version=to_version,
+                source_package_name=to_source_package_name,
+                source_package_version=to_source_package_version,
+            ),
+            is_version_downgrade=is_version_downgrade,
+        )
+        for version_diff_changelog_change in version_diff_changelogs:
+            diff_deb_package.cves.extend(version_diff_changelog_change.cves)
+            diff_deb_package.launchpad_bugs_fixed.extend(version_diff_changelog_change.launchpad_bugs_fixed)
+            diff_deb_package.changes.append(version_diff_changelog_change)
+        return diff_deb_package
@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 
 class SnapSummary(BaseModel):
@@ -92,7 +92,35 @@ class ChangelogModel(BaseModel):
     notes: Optional[str] = None
     from_series: str
     to_series: str
+    image_architecture: Optional[str] = None
     from_serial: Optional[str] = None
     to_serial: Optional[str] = None
     from_manifest_filename: str
     to_manifest_filename: str
+
+
+class GenerateJob(BaseModel):
+    from_series: str
+    to_series: str
+    from_serial: Optional[str] = None
+    to_serial: Optional[str] = None
+    from_manifest: str
+    to_manifest: str
+    ppas: List[str] = []
+    image_architecture: str = "amd64"
+    highlight_cves: bool = False
+    notes: Optional[str] = None
+    output: Optional[str] = None
+    output_json: Optional[str] = None
+    output_json_pretty: bool = False
+    previous_changelog_json: List[str] = []
+
+    @model_validator(mode="after")
+    def check_output(self):
+        if not self.output and not self.output_json:
+            raise ValueError("at least one of output or output_json must be specified")
+        return self
+
+
+class GenerateBatch(BaseModel):
+    jobs: List[GenerateJob]
@@ -0,0 +1,95 @@
+"""Recordings of the Launchpad and ubuntu-cve-tracker data a run used, for --record and --replay.
+
+A recording is a cache directory (see cache.DiskCache) that a run with --record
+started from and filled with everything it looked up: the source package of every
+binary package, every changelog, every ubuntu-cve-tracker file and every lookup that
+found nothing. Derived data such as changelog diffs is not recorded so that a replay
+recomputes it. A run with --replay reads the recording and never goes to the network,
+nothing in the recording expires and anything that is not in it is an error.
+"""
+
+from typing import Optional
+
+import click
+
+from ubuntu_cloud_image_changelog import cache
+
+SERIES_STORE_NAME = "series"
+
+
+class NotRecorded(click.ClickException):
+    def __init__(self, directory: str, lookup: str):
+        super(NotRecorded, self).__init__(
+            "{} is not in the recording {}, record the run again with --record".format(lookup, directory)
+        )
+
+
+def record_series(session, disk_cache: cache.DiskCache, *series: str):
+    """Add the links of series, as names or versions, looked up with session to the recording"""
+    disk_cache.store(SERIES_STORE_NAME).update(
+        {name_or_version: str(session.get_series(name_or_version).self_link) for name_or_version in series}
+    )
+
+
+class _Offline:
+    """
+    Any Launchpad object, or the fetcher of ubuntu-cve-tracker files, when replaying.
+    Attributes and items are more _Offline objects; calling any of them raises NotRecorded.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self._directory = directory
+        self._name = name
+
+    def __getattr__(self, name):
+        return _Offline(self._directory, "{}.{}".format(self._name, name))
+
+    def __getitem__(self, key):
+        return _Offline(self._directory, "{}[{!r}]".format(self._name, key))
+
+    def __call__(self, *args, **kwargs):
+        arguments = [repr(arg) for arg in args] + ["{}={!r}".format(name, value) for name, value in kwargs.items()]
+        raise NotRecorded(self._directory, "{}({})".format(self._name, ", ".join(arguments)))
+
+
+class RecordedSeries:
+    def __init__(self, self_link: str):
+        self.self_link = self_link
+
+    def getDistroArchSeries(self, archtag: str):
+        return RecordedArchSeries(self, archtag)
+
+
+class RecordedArchSeries:
+    def __init__(self, distro_series: RecordedSeries, architecture_tag: str):
+        self.distro_series = distro_series
+        self.architecture_tag = architecture_tag
+        self.self_link = "{}/{}".format(distro_series.self_link, architecture_tag)
+
+
+class RecordedSession:
+    """
+    Stands in for a launchpadagent.LaunchpadSession when replaying the recording in
+    disk_cache. There is no login; series are looked up in the recording and any
+    Launchpad query raises NotRecorded.
+    """
+
+    def __init__(self, disk_cache: cache.DiskCache):
+        self.directory = disk_cache.directory
+        self.launchpad = _Offline(self.directory, "launchpad")
+        self.ubuntu = _Offline(self.directory, "ubuntu")
+        self._series = disk_cache.store(SERIES_STORE_NAME).load()
+
+    def get_series(self, name_or_version: str) -> RecordedSeries:
+        self_link: Optional[str] = self._series.get(name_or_version)
+        if self_link is None:
+            raise NotRecorded(self.directory, "Series {}".format(name_or_version))
+        return RecordedSeries(self_link)
+
+    def get_arch_series(self, name_or_version: str, archtag: str) -> RecordedArchSeries:
+        return self.get_series(name_or_version).getDistroArchSeries(archtag)
+
+
+def offline_fetcher(directory: str):
+    """returns a stand-in for transport.HTTPFetcher that raises NotRecorded for every URL"""
+    return _Offline(directory, "fetcher")
@@ -0,0 +1,22 @@
+import unittest.mock as mock
+
+import pytest
+
+from ubuntu_cloud_image_changelog import lib
+
+
+@pytest.fixture(autouse=True)
+def retry_policy():
+    """Each test starts with a full retry budget"""
+    with mock.patch("ubuntu_cloud_image_changelog.lib.retry_policy", lib.RetryPolicy()) as retry_policy:
+        yield retry_policy
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    """Tests that do not pass --cache-dir never use the real cache"""
+    cache_directory = tmp_path / "default-cache"
+    monkeypatch.setenv("UBUNTU_CLOUD_IMAGE_CHANGELOG_CACHE_DIR", str(cache_directory))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg-cache"))
+    monkeypatch.delenv("SNAP_USER_COMMON", raising=False)
+    return cache_directory
@@ -0,0 +1,106 @@
+import os
+import time
+
+from ubuntu_cloud_image_changelog import cache
+
+
+def _write_entry(directory, name, size, age):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as entry:
+        entry.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evict_least_recently_used_over_max_size(tmp_path):
+    """Eviction removes the least recently used entries until the cache fits"""
+    disk_cache = cache.DiskCache(str(tmp_path), max_size=250, max_age=30 * 24 * 60 * 60)
+    changelogs = disk_cache.path("changelogs")
+    oldest = _write_entry(changelogs, "changelog.a_1", 100, 3 * 60 * 60)
+    older = _write_entry(changelogs, "changelog.b_1", 100, 2 * 60 * 60)
+    newest = _write_entry(changelogs, "changelog.c_1", 100, 1.5 * 60 * 60)
+
+    disk_cache.evict()
+
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older)
+    assert os.path.exists(newest)
+
+
+def test_evict_unused_entries_and_keeps_recent(tmp_path):
+    """Entries unused for max_age are evicted but recently used entries are always kept"""
+    disk_cache = cache.DiskCache(str(tmp_path), max_size=0, max_age=24 * 60 * 60)
+    changelogs = disk_cache.path("changelogs")
+    unused = _write_entry(changelogs, "changelog.a_1", 10, 2 * 24 * 60 * 60)
+    recent = _write_entry(changelogs, "changelog.b_1", 10, 60)
+
+    disk_cache.evict()
+
+    assert not os.path.exists(unused)
+    assert os.path.exists(recent)
+
+
+def test_evict_keeps_stores_that_are_read(tmp_path):
+    """Reading a store counts as using it even if nothing is added to it"""
+    disk_cache = cache.DiskCache(str(tmp_path), max_size=0, max_age=24 * 60 * 60)
+    store = disk_cache.store("source-packages")
+    store.update({"noble amd64 sl 1.0": ["sl", "1.0"]})
+    mtime = time.time() - 2 * 24 * 60 * 60
+    os.utime(store.filename, (mtime, mtime))
+
+    assert store.load() == {"noble amd64 sl 1.0": ["sl", "1.0"]}
+    disk_cache.evict()
+
+    assert os.path.exists(store.filename)
+
+
+def _changelog(versions):
+    return b"".join(b"sl (%s) noble; urgency=medium\n\n  * Change\n\n" % version for version in versions)
+
+
+def test_changelog_store_deduplicates_versions(tmp_path):
+    """Older versions of a changelog are stored as the tail of the newest one"""
+    changelog_store = cache.ChangelogStore(str(tmp_path))
+    changelogs = {
+        b"1.0": _changelog([b"1.0"]),
+        b"3.0": _changelog([b"3.0", b"2.0", b"1.0"]),
+        b"2.0": _changelog([b"2.0", b"1.0"]),
+        b"4.0": _changelog([b"4.0", b"3.0", b"2.0", b"1.0"]),
+        # an unrelated changelog that shares no tail is stored separately
+        b"9.0": b"something else\n",
+    }
+    for version, content in changelogs.items():
+        changelog_store.put("sl", version.decode(), content)
+
+    for version, content in changelogs.items():
+        assert changelog_store.get("sl", version.decode()) == content
+    assert changelog_store.get("sl", "5.0") is None
+    assert sorted(os.listdir(tmp_path / "sl")) == ["4.0.zlib", "9.0.zlib", "index.json", "index.json.lock"]
+
+
+def test_changelog_store_misses_evicted_base(tmp_path):
+    changelog_store = cache.ChangelogStore(str(tmp_path))
+    changelog_store.put("sl", "1.0", _changelog([b"1.0"]))
+    os.unlink(tmp_path / "sl" / "1.0.zlib")
+    assert changelog_store.get("sl", "1.0") is None
+
+
+def test_negative_cache_expires_misses(tmp_path):
+    """Misses are shared between runs until they expire"""
+    store = cache.JsonStore(str(tmp_path / "missing"))
+    missing = cache.NegativeCache(store, ttl=60)
+    missing.add("binary", "noble", "sl", "1.0", "primary")
+    missing.save()
+    store.update({"binary noble sl 0.9 primary": time.time() - 120})
+
+    missing = cache.NegativeCache(store, ttl=60)
+    assert missing.is_missing("binary", "noble", "sl", "1.0", "primary")
+    assert not missing.is_missing("binary", "noble", "sl", "1.0", "ppa:someone/ppa")
+    assert not missing.is_missing("binary", "noble", "sl", "0.9", "primary")
+    assert (missing.hits, missing.misses) == (1, 0)
+
+    # expired misses are dropped when new ones are saved
+    missing.add("binary", "noble", "sl", "2.0", "primary")
+    missing.save()
+    assert sorted(store.load()) == ["binary noble sl 1.0 primary", "binary noble sl 2.0 primary"]
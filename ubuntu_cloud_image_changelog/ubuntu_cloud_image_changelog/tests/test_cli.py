@@ -0,0 +1,20 @@
+import subprocess
+import sys
+
+
+def test_cli_imports_no_heavy_dependencies():
+    """--help and the commands that do not generate a changelog start without launchpadlib, debian or pydantic"""
+    modules = ["launchpadlib", "lazr.restfulclient", "httplib2", "debian", "pydantic"]
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, ubuntu_cloud_image_changelog.cli; print(' '.join(m for m in {!r} if m in sys.modules))".format(
+                modules
+            ),
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout.split()
+    assert imported == []
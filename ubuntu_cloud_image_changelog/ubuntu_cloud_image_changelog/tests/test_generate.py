@@ -0,0 +1,383 @@
+import contextlib
+import json
+import time
+from typing import NamedTuple
+from unittest import mock
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from ubuntu_cloud_image_changelog import cache, lib
+from ubuntu_cloud_image_changelog.cli import generate, generate_batch
+from ubuntu_cloud_image_changelog.models import Change
+
+
+def _fake_get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package_name, version, ppas, **kwargs):
+    # Finish later the earlier a package appears so completion order is the reverse of manifest order
+    time.sleep(0.001 * (20 - int(binary_package_name.split("-")[1])))
+    return "src-{}".format(binary_package_name), version
+
+
+def _fake_parse_changelog(fetcher, to_changelog_filename, to_version, **kwargs):
+    return False, [
+        Change(
+            package=to_changelog_filename,
+            version=to_version,
+            urgency="medium",
+            distributions="noble",
+            author="Some One <someone@example.com>",
+            date="Mon, 01 Jan 2024 00:00:00 +0000",
+            log=["  * change"],
+        )
+    ]
+
+
+class FakeLookups(NamedTuple):
+    get_source_package_details: mock.Mock
+    get_changelog: mock.Mock
+    parse_changelog: mock.Mock
+
+
+@contextlib.contextmanager
+def _fake_launchpad(get_source_package_details=_fake_get_source_package_details):
+    """Stand in for Launchpad and changelog parsing, yielding the FakeLookups mocks"""
+    with mock.patch("ubuntu_cloud_image_changelog.launchpadagent.get_launchpad"), mock.patch(
+        "ubuntu_cloud_image_changelog.lib.get_source_package_details",
+        side_effect=get_source_package_details,
+    ) as mock_get_source_package_details, mock.patch(
+        "ubuntu_cloud_image_changelog.lib.get_changelog",
+        side_effect=lambda *args, **kwargs: args[4],
+    ) as mock_get_changelog, mock.patch(
+        "ubuntu_cloud_image_changelog.lib.parse_changelog",
+        side_effect=_fake_parse_changelog,
+    ) as mock_parse_changelog:
+        yield FakeLookups(mock_get_source_package_details, mock_get_changelog, mock_parse_changelog)
+
+
+def _write_manifests(tmp_path, from_content, to_content):
+    from_manifest = tmp_path / "from.manifest"
+    to_manifest = tmp_path / "to.manifest"
+    from_manifest.write_text(from_content)
+    to_manifest.write_text(to_content)
+    return from_manifest, to_manifest
+
+
+def _run_generate(tmp_path, from_manifest, to_manifest, *extra_args, exit_code=0):
+    """Run generate for noble with a cache in tmp_path, asserting that it exits with exit_code"""
+    result = CliRunner().invoke(
+        generate,
+        [
+            "--from-series",
+            "noble",
+            "--to-series",
+            "noble",
+            "--from-manifest",
+            str(from_manifest),
+            "--to-manifest",
+            str(to_manifest),
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            *extra_args,
+        ],
+    )
+    assert result.exit_code == exit_code, result.output
+    return result
+
+
+@pytest.mark.parametrize("jobs", ["1", "8"])
+def test_generate_output_order_is_deterministic(tmp_path, jobs):
+    """Concurrently resolved packages are output in manifest order"""
+    packages = ["pkg-{:02d}".format(i) for i in range(20)]
+    from_manifest, to_manifest = _write_manifests(
+        tmp_path,
+        "".join("{}\t1.0\n".format(package) for package in packages),
+        "".join("{}\t2.0\n".format(package) for package in packages),
+    )
+    output_json = tmp_path / "changelog.json"
+
+    with _fake_launchpad():
+        _run_generate(tmp_path, from_manifest, to_manifest, "--output-json", str(output_json), "--jobs", jobs)
+
+    changelog = json.loads(output_json.read_text())
+    assert [package["name"] for package in changelog["diff"]["deb"]] == packages
+    assert [package["changes"][0]["package"] for package in changelog["diff"]["deb"]] == [
+        "src-{}".format(package) for package in packages
+    ]
+
+
+def _run_generate_batch(tmp_path, from_manifest, to_manifests, *extra_args, **settings):
+    """
+    Run generate-batch with one job per manifest in to_manifests and returns the result.
+    settings are extra job settings by job index, e.g. {"1": {"ppas": [...]}}.
+    """
+    jobs = [
+        dict(
+            {
+                "from_series": "noble",
+                "to_series": "noble",
+                "from_manifest": str(from_manifest),
+                "to_manifest": str(to_manifest),
+                "output": str(tmp_path / "{}.txt".format(index)),
+                "output_json": str(tmp_path / "{}.json".format(index)),
+            },
+            **settings.get(str(index), {}),
+        )
+        for index, to_manifest in enumerate(to_manifests)
+    ]
+    job_file = tmp_path / "jobs.json"
+    job_file.write_text(json.dumps({"jobs": jobs}))
+    return CliRunner().invoke(generate_batch, [str(job_file), "--cache-dir", str(tmp_path / "cache"), *extra_args])
+
+
+def test_generate_batch_shares_lookups(tmp_path):
+    """Jobs in a batch share package lookups and each write their own output"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\npkg-02\t1.0\n", "pkg-01\t2.0\npkg-02\t2.0\n")
+    other_to_manifest = tmp_path / "other-to.manifest"
+    other_to_manifest.write_text("pkg-01\t2.0\npkg-02\t3.0\n")
+
+    with _fake_launchpad() as lookups:
+        result = _run_generate_batch(tmp_path, from_manifest, [to_manifest, other_to_manifest])
+
+    assert result.exit_code == 0, result.output
+    # pkg-01 1.0, pkg-01 2.0, pkg-02 1.0, pkg-02 2.0 and pkg-02 3.0
+    assert lookups.get_source_package_details.call_count == 5
+    for index in range(2):
+        assert "pkg-02 changed from version '1.0'" in (tmp_path / "{}.txt".format(index)).read_text()
+        changelog = json.loads((tmp_path / "{}.json".format(index)).read_text())
+        assert [package["name"] for package in changelog["diff"]["deb"]] == ["pkg-01", "pkg-02"]
+
+
+def test_generate_batch_looks_up_failures_again(tmp_path):
+    """A binary package one job could not find is looked up again for a job with more PPAs"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\n", "pkg-01\t2.0\n")
+
+    def _get_source_package_details(ubuntu, launchpad, lp_arch_series, binary_package_name, version, ppas, **kwargs):
+        if version == "2.0" and not ppas:
+            raise click.ClickException("Unable to find source package for {} {}".format(binary_package_name, version))
+        return "src-{}".format(binary_package_name), version
+
+    with _fake_launchpad(get_source_package_details=_get_source_package_details):
+        result = _run_generate_batch(
+            tmp_path, from_manifest, [to_manifest, to_manifest], "--concurrent-jobs", "1", **{"1": {"ppas": ["ppa"]}}
+        )
+
+    assert "1 of 2 jobs failed" in result.output
+    changelog = json.loads((tmp_path / "1.json").read_text())
+    assert [package["to_version"]["source_package_version"] for package in changelog["diff"]["deb"]] == ["2.0"]
+
+
+def _get_missing_source_package_details(
+    ubuntu, launchpad, lp_arch_series, binary_package_name, version, ppas, **kwargs
+):
+    if (binary_package_name, version) == ("pkg-02", "2.0"):
+        kwargs["missing"].add(
+            "binary", str(lp_arch_series.self_link), binary_package_name, version, lib.PRIMARY_ARCHIVE_NAME
+        )
+        raise click.ClickException("Unable to find source package for {} {}".format(binary_package_name, version))
+    return "src-{}".format(binary_package_name), version
+
+
+def test_generate_failed_run_saves_lookups(tmp_path):
+    """What a failed run looked up is saved, so the next run does not look it up again"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\npkg-02\t1.0\n", "pkg-01\t2.0\npkg-02\t2.0\n")
+
+    with _fake_launchpad(get_source_package_details=_get_missing_source_package_details):
+        _run_generate(tmp_path, from_manifest, to_manifest, exit_code=1)
+
+    assert sorted(cache.JsonStore(str(tmp_path / "cache" / "source-packages.json")).load().values()) == [
+        ["src-pkg-01", "1.0"],
+        ["src-pkg-01", "2.0"],
+        ["src-pkg-02", "1.0"],
+    ]
+
+    assert [key.split(" ")[-3:] for key in cache.JsonStore(str(tmp_path / "cache" / "missing.json")).load()] == [
+        ["pkg-02", "2.0", lib.PRIMARY_ARCHIVE_NAME]
+    ]
+
+
+def test_generate_batch_failed_job_saves_lookups(tmp_path):
+    """What a failed job looked up is saved"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\npkg-02\t1.0\n", "pkg-01\t2.0\npkg-02\t2.0\n")
+
+    with _fake_launchpad(get_source_package_details=_get_missing_source_package_details):
+        result = _run_generate_batch(tmp_path, from_manifest, [to_manifest])
+
+    assert "1 of 1 jobs failed" in result.output
+    assert [key.split(" ")[-3:] for key in cache.JsonStore(str(tmp_path / "cache" / "missing.json")).load()] == [
+        ["pkg-02", "2.0", lib.PRIMARY_ARCHIVE_NAME]
+    ]
+
+
+def test_generate_composes_previous_changelogs(tmp_path):
+    """Changed packages are composed from previous changelogs when their versions link up"""
+    manifests = {
+        "a": "pkg-01\t1.0\npkg-02\t1.0\n",
+        "b": "pkg-01\t2.0\npkg-02\t2.0\n",
+        "b2": "pkg-01\t2.0\npkg-02\t2.5\n",
+        "c": "pkg-01\t3.0\npkg-02\t3.0\n",
+    }
+    for name, content in manifests.items():
+        (tmp_path / "{}.manifest".format(name)).write_text(content)
+
+    def _generate(from_name, to_name, *args):
+        output_json = tmp_path / "{}-{}.json".format(from_name, to_name)
+        with _fake_launchpad() as lookups:
+            result = _run_generate(
+                tmp_path / "{}-{}".format(from_name, to_name),
+                tmp_path / "{}.manifest".format(from_name),
+                tmp_path / "{}.manifest".format(to_name),
+                "--output-json",
+                str(output_json),
+                *args,
+            )
+        return result, lookups.get_source_package_details.call_count, json.loads(output_json.read_text())
+
+    _generate("a", "b")
+    _generate("b2", "c")
+    _generate("b", "c")
+    result, lookups, changelog = _generate(
+        "a",
+        "c",
+        "--previous-changelog-json",
+        str(tmp_path / "a-b.json"),
+        "--previous-changelog-json",
+        str(tmp_path / "b2-c.json"),
+    )
+
+    assert "composed from previous changelogs: 1 of 2" in result.output
+    # only pkg-02 1.0 and 3.0 are looked up
+    assert lookups == 2
+    pkg_01, pkg_02 = changelog["diff"]["deb"]
+    assert [change["version"] for change in pkg_01["changes"]] == ["3.0", "2.0"]
+    assert pkg_01["from_version"]["version"] == "1.0"
+    assert pkg_01["to_version"]["version"] == "3.0"
+    assert [change["version"] for change in pkg_02["changes"]] == ["3.0"]
+
+
+def test_generate_ignores_previous_changelogs_of_other_images(tmp_path, caplog):
+    """Previous changelogs for another series or architecture are not composed from"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\n", "pkg-01\t2.0\n")
+    previous_changelog_jsons = []
+    for series, image_architecture in [("jammy", "amd64"), ("noble", "arm64")]:
+        output_json = tmp_path / "{}-{}.json".format(series, image_architecture)
+        with _fake_launchpad():
+            result = CliRunner().invoke(
+                generate,
+                [
+                    "--from-series",
+                    series,
+                    "--to-series",
+                    series,
+                    "--image-architecture",
+                    image_architecture,
+                    "--from-manifest",
+                    str(from_manifest),
+                    "--to-manifest",
+                    str(to_manifest),
+                    "--output-json",
+                    str(output_json),
+                    "--cache-dir",
+                    str(tmp_path / "cache"),
+                ],
+            )
+        assert result.exit_code == 0, result.output
+        previous_changelog_jsons += ["--previous-changelog-json", str(output_json)]
+
+    with _fake_launchpad():
+        result = _run_generate(tmp_path, from_manifest, to_manifest, *previous_changelog_jsons)
+
+    assert "composed from previous changelogs: 0 of 1" in result.output
+    assert "Ignoring previous changelog {}".format(tmp_path / "jammy-amd64.json") in caplog.text
+    assert "Ignoring previous changelog {}".format(tmp_path / "noble-arm64.json") in caplog.text
+
+
+def test_generate_fetches_each_changelog_once(tmp_path):
+    """All lookups happen up front and changelogs shared by binary packages are only fetched and diffed once"""
+    packages = ["pkg-{:02d}".format(i) for i in range(10)]
+    from_manifest, to_manifest = _write_manifests(
+        tmp_path,
+        "".join("{}\t1.0\n".format(package) for package in packages),
+        "".join("{}\t2.0\n".format(package) for package in packages) + "new-01\t2.0\n",
+    )
+
+    with _fake_launchpad(get_source_package_details=lambda *args, **kwargs: ("src", args[4])) as lookups:
+        result = _run_generate(tmp_path, from_manifest, to_manifest, "--jobs", "8")
+
+    assert "Binary packages to resolve: 21" in result.output
+    assert "Changelogs to fetch: 2" in result.output
+    # rendering uses the resolved source packages rather than looking them up again
+    assert "Source package lookups: 0 cached, 21 queried" in result.output
+    assert sorted(call.args[5] for call in lookups.get_changelog.call_args_list) == ["1.0", "2.0"]
+    # the binary packages all share one source package diff, and the added one needs its own
+    assert lookups.parse_changelog.call_count == 2
+
+
+def test_generate_trace_file(tmp_path):
+    """--trace-file writes the phases and each package rendered as Chrome trace events"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\npkg-02\t1.0\n", "pkg-01\t2.0\npkg-02\t2.0\n")
+    trace_file = tmp_path / "trace.json"
+
+    with _fake_launchpad():
+        _run_generate(
+            tmp_path,
+            from_manifest,
+            to_manifest,
+            "--output-json",
+            str(tmp_path / "changelog.json"),
+            "--trace-file",
+            str(trace_file),
+        )
+
+    events = [event for event in json.loads(trace_file.read_text())["traceEvents"] if event["ph"] == "X"]
+    names = {event["name"] for event in events}
+    assert {"resolve_binary_packages", "fetch_changelogs", "resolve_diff", "write_changelog_json"} <= names
+    assert sorted(event["args"]["package"] for event in events if event["name"] == "render") == ["pkg-01", "pkg-02"]
+
+
+def _fake_get_changelog(
+    launchpad, ubuntu, lp_series, cache_directory, source_package_name, source_package_version, *args, **kwargs
+):
+    content = b"".join(
+        b"%s (%s) noble; urgency=medium\n\n  * Change\n\n -- Some One <someone@example.com>  "
+        b"Mon, 01 Jan 2024 00:00:00 +0000\n\n" % (source_package_name.encode(), version)
+        for version in ([b"2.0", b"1.0"] if source_package_version == "2.0" else [b"1.0"])
+    )
+    cache.ChangelogStore(cache_directory).put(source_package_name, source_package_version, content)
+    return lib.ChangelogContent("changelog.{}_{}".format(source_package_name, source_package_version), content)
+
+
+def test_generate_replays_recording(tmp_path):
+    """A recorded run is replayed with no Launchpad login and the same result"""
+    from_manifest, to_manifest = _write_manifests(tmp_path, "pkg-01\t1.0\npkg-02\t1.0\n", "pkg-01\t2.0\npkg-02\t2.0\n")
+    recording = str(tmp_path / "recording")
+
+    parse_changelog = lib.parse_changelog
+    with _fake_launchpad() as lookups:
+        lookups.get_changelog.side_effect = _fake_get_changelog
+        lookups.parse_changelog.side_effect = parse_changelog
+        _run_generate(
+            tmp_path,
+            from_manifest,
+            to_manifest,
+            "--output-json",
+            str(tmp_path / "recorded.json"),
+            "--record",
+            recording,
+        )
+    with mock.patch(
+        "ubuntu_cloud_image_changelog.launchpadagent.get_launchpad", side_effect=AssertionError("no login")
+    ):
+        _run_generate(
+            tmp_path,
+            from_manifest,
+            to_manifest,
+            "--output-json",
+            str(tmp_path / "replayed.json"),
+            "--replay",
+            recording,
+        )
+
+    replayed = json.loads((tmp_path / "replayed.json").read_text())
+    assert [change["version"] for change in replayed["diff"]["deb"][0]["changes"]] == ["2.0"]
+    assert replayed == json.loads((tmp_path / "recorded.json").read_text())
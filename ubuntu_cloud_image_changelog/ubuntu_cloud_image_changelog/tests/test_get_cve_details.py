@@ -1,3 +1,5 @@
+import tarfile
+import time
 import unittest.mock as mock
 from unittest.mock import call
 
@@ -8,11 +10,129 @@ from ubuntu_cloud_image_changelog import lib
 
 def test_get_cve_details_retry():
     fake_url = "https://git.launchpad.net/ubuntu-cve-tracker/plain/active/somecve"
-    _mock_launchpad = mock.MagicMock()
-    _mock_launchpad._browser.get.side_effect = mock.Mock(side_effect=Exception("Test"))
+    _mock_fetcher = mock.MagicMock()
+    _mock_fetcher.get.side_effect = mock.Mock(side_effect=Exception("Test"))
     with mock.patch("time.sleep"):
         with pytest.raises(Exception):
-            lib._get_cve_details("somecve", _mock_launchpad)
+            lib._get_cve_details("somecve", _mock_fetcher)
     calls = [call(fake_url), call(fake_url), call(fake_url), call(fake_url), call(fake_url)]
-    _mock_launchpad._browser.get.assert_called()
-    _mock_launchpad._browser.get.assert_has_calls(calls)
+    _mock_fetcher.get.assert_called()
+    _mock_fetcher.get.assert_has_calls(calls)
+
+
+def test_cve_tracker_caches_cve_details(tmp_path):
+    """CVE details are fetched once and then served from memory and disk"""
+    _mock_fetcher = mock.MagicMock()
+    _mock_fetcher.get.return_value = b"Candidate: CVE-2024-0001\nPriority: high\n"
+
+    cve_tracker = lib.CveTracker(_mock_fetcher, cache_directory=str(tmp_path))
+    cve_tracker.prefetch(["CVE-2024-0001", "CVE-2024-0001"])
+    for _ in range(3):
+        assert cve_tracker.get_cve_record("CVE-2024-0001").priority == "high"
+    assert _mock_fetcher.get.call_count == 1
+
+    cve_tracker = lib.CveTracker(_mock_fetcher, cache_directory=str(tmp_path))
+    assert cve_tracker.get_cve_record("CVE-2024-0001").priority == "high"
+    assert _mock_fetcher.get.call_count == 1
+
+
+def test_cve_tracker_refetches_expired_active_cve_details(tmp_path):
+    """Cached details of active CVEs expire sooner than those of retired CVEs"""
+    _mock_fetcher = mock.MagicMock()
+    _mock_fetcher.get.side_effect = lambda url: b"Priority: low\n"
+
+    lib.CveTracker(_mock_fetcher, cache_directory=str(tmp_path)).get_cve_record("CVE-2024-0001")
+    two_days_later = time.time() + 2 * 24 * 60 * 60
+    with mock.patch("time.time", return_value=two_days_later):
+        lib.CveTracker(_mock_fetcher, cache_directory=str(tmp_path)).get_cve_record("CVE-2024-0001")
+    assert _mock_fetcher.get.call_count == 2
+
+
+@pytest.mark.parametrize("as_tarball", [False, True])
+def test_local_cve_tracker(tmp_path, as_tarball):
+    """CVE details are read from a local ubuntu-cve-tracker checkout or tarball"""
+    checkout = tmp_path / "ubuntu-cve-tracker"
+    for location, cve, priority in [
+        ("active", "CVE-2024-0001", "high"),
+        ("retired", "CVE-2024-0001", "low"),
+        ("ignored", "CVE-2024-0002", "negligible"),
+    ]:
+        (checkout / location).mkdir(parents=True, exist_ok=True)
+        (checkout / location / cve).write_text("Candidate: {}\nPriority: {}\n".format(cve, priority))
+    cve_tracker_path = checkout
+    if as_tarball:
+        cve_tracker_path = tmp_path / "ubuntu-cve-tracker.tar.gz"
+        with tarfile.open(cve_tracker_path, "w:gz") as tarball:
+            tarball.add(checkout, arcname="ubuntu-cve-tracker")
+
+    cve_tracker = lib.LocalCveTracker(str(cve_tracker_path))
+    assert cve_tracker.get_cve_record("CVE-2024-0001").priority == "high"
+    assert cve_tracker.get_cve_record("CVE-2024-0002").priority == "negligible"
+    assert cve_tracker.get_cve_record("CVE-2024-0003") == lib.CveRecord()
+
+
+CVE_DETAILS = """\
+PublicDateAtUSN: 2024-07-01 08:00:00 UTC
+Candidate: CVE-2024-6387
+PublicDate: 2024-07-01 08:00:00 UTC
+References:
+ https://www.qualys.com/regresshion.txt
+Description:
+ A signal handler race condition was found in sshd.
+Ubuntu-Description:
+ It was discovered that OpenSSH incorrectly handled signals.
+ A remote attacker could possibly use this issue to execute arbitrary code.
+Notes:
+Priority: high
+ Remote code execution
+Discovered-by: Qualys
+
+Patches_openssh:
+ upstream: https://anongit.mindrot.org/openssh.git/commit/?id=81c1099d22b81ebfd20a334ce986c4f753b0db29
+upstream_openssh: released (1:9.8p1-1)
+jammy_openssh: released (1:8.9p1-3ubuntu0.10)
+noble_openssh: released (1:9.6p1-3ubuntu13.3)
+Priority_openssh: high"""
+
+
+def test_parse_cve_record():
+    cve_record = lib.parse_cve_record(CVE_DETAILS)
+    assert cve_record.priority == "high"
+    assert cve_record.public_date == "2024-07-01 08:00:00 UTC"
+    assert cve_record.description == (
+        "It was discovered that OpenSSH incorrectly handled signals. "
+        "A remote attacker could possibly use this issue to execute arbitrary code."
+    )
+    assert cve_record.packages == {
+        "openssh": {
+            "upstream": "released (1:9.8p1-1)",
+            "jammy": "released (1:8.9p1-3ubuntu0.10)",
+            "noble": "released (1:9.6p1-3ubuntu13.3)",
+        }
+    }
+
+
+def test_parse_cve_record_description_at_end_of_file():
+    """The Description is used if there is no Ubuntu-Description, even at the end of the file"""
+    cve_record = lib.parse_cve_record("Candidate: CVE-2024-0001\nDescription:\n Something bad.")
+    assert cve_record.description == "Something bad."
+    assert cve_record.priority == "n/a"
+
+
+def test_parse_cve_details_memoises_records():
+    _mock_fetcher = mock.MagicMock()
+    _mock_fetcher.get.return_value = CVE_DETAILS.encode("utf-8")
+    cve_tracker = lib.CveTracker(_mock_fetcher)
+    with mock.patch("ubuntu_cloud_image_changelog.lib.parse_cve_record", wraps=lib.parse_cve_record) as parse:
+        for _ in range(2):
+            cves = lib._parse_cve_details(["  * Fix CVE-2024-6387 (CVE-2024-6387)"], cve_tracker)
+    assert cves == [
+        {
+            "cve": "CVE-2024-6387",
+            "url": "https://ubuntu.com/security/CVE-2024-6387",
+            "cve_description": lib.parse_cve_record(CVE_DETAILS).description,
+            "cve_priority": "high",
+            "cve_public_date": "2024-07-01 08:00:00 UTC",
+        }
+    ]
+    assert parse.call_count == 1
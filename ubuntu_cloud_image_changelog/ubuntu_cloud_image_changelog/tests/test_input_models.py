@@ -27,28 +27,28 @@ def dummy_manifests():
     ]
 )
 def test_generate_validate_inputs_and_run(
-    dummy_manifests, from_series, to_series, from_serial, to_serial, ppas,
+    tmp_path, dummy_manifests, from_series, to_series, from_serial, to_serial, ppas,
     image_architecture, exit_code
 ):
     # Dummy manifests from pytest fixture
     from_manifest, to_manifest = dummy_manifests
 
     with \
-        mock.patch("ubuntu_cloud_image_changelog.cli.launchpadagent.get_launchpad") as mock_get_launchpad, \
+        mock.patch("ubuntu_cloud_image_changelog.launchpadagent.get_launchpad") as mock_get_launchpad, \
         mock.patch(
-            "ubuntu_cloud_image_changelog.cli.lib.arch_independent_package_name",
+            "ubuntu_cloud_image_changelog.lib.arch_independent_package_name",
             return_value="dummy-package-name-no-arch"
         ), \
         mock.patch(
-            "ubuntu_cloud_image_changelog.cli.lib.get_source_package_details",
+            "ubuntu_cloud_image_changelog.lib.get_source_package_details",
             return_value=("srcpkg", "1.0-0")
         ), \
         mock.patch(
-            "ubuntu_cloud_image_changelog.cli.lib.get_changelog",
+            "ubuntu_cloud_image_changelog.lib.get_changelog",
             return_value="/tmp/changelog"
         ), \
         mock.patch(
-            "ubuntu_cloud_image_changelog.cli.lib.parse_changelog",
+            "ubuntu_cloud_image_changelog.lib.parse_changelog",
             return_value=(False, [])
         ), \
         mock.patch("ubuntu_cloud_image_changelog.cli.click.echo"):
@@ -70,6 +70,7 @@ def test_generate_validate_inputs_and_run(
                 "--from-manifest", from_manifest.name,
                 "--to-manifest", to_manifest.name,
                 "--image-architecture", image_architecture,
+                "--cache-dir", str(tmp_path / "cache"),
                 *[f"--ppa={ppa}" for ppa in ppas],
             ]
         )
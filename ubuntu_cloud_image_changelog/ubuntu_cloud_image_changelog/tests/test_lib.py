@@ -1,10 +1,16 @@
+import gzip
+import io
+import lzma
 import tempfile
+import time
 import unittest.mock as mock
 from unittest.mock import call
 
+import click
 import pytest
 
-from ubuntu_cloud_image_changelog import lib
+from ubuntu_cloud_image_changelog import cache, lib
+from ubuntu_cloud_image_changelog.models import Change
 
 
 def test_get_source_package_retry():
@@ -36,6 +42,20 @@ def test_get_source_package_retry():
     assert calls == expected_calls
 
 
+def test_get_source_package_not_found_is_not_retried():
+    """A binary package that is not published is not looked up again"""
+    mock_launchpad = mock.MagicMock()
+    mock_ubuntu = mock_launchpad.distributions["ubuntu"]
+    mock_ubuntu.main_archive.getPublishedBinaries.return_value = []
+
+    with mock.patch("time.sleep") as mock_sleep:
+        with pytest.raises(click.ClickException):
+            lib.get_source_package_details(mock_ubuntu, mock_launchpad, "noble", "sl", "1.0", [])
+
+    assert mock_ubuntu.main_archive.getPublishedBinaries.call_count == 1
+    mock_sleep.assert_not_called()
+
+
 def test_get_changelog_retry():
     """Archive sources queries should retry on server error"""
     mock_launchpad = mock.MagicMock()
@@ -65,3 +85,259 @@ def test_get_changelog_retry():
     ] * 5
     calls = mock_ubuntu.main_archive.getPublishedSources.mock_calls
     assert calls == expected_calls
+
+
+def test_source_package_resolver_shares_lookups():
+    """Binaries built from the same source only need one published binary query"""
+    mock_session = mock.MagicMock()
+    main_archive = mock_session.ubuntu.main_archive
+    main_archive.getPublishedBinaries.return_value = [
+        mock.Mock(source_package_name="systemd", source_package_version="255-1")
+    ]
+    mock_source = mock.Mock()
+    mock_source.getPublishedBinaries.return_value = [
+        mock.Mock(
+            distro_arch_series_link="https://api.launchpad.net/devel/ubuntu/noble/amd64",
+            binary_package_name=binary_package_name,
+            binary_package_version="255-1",
+        )
+        for binary_package_name in ["systemd", "libsystemd0", "udev"]
+    ]
+    main_archive.getPublishedSources.return_value = [mock_source]
+
+    resolver = lib.SourcePackageResolver(mock_session)
+    resolver.expect("amd64", [("systemd", "255-1"), ("libsystemd0", "255-1"), ("udev", "255-1")])
+    for binary_package_name in ["systemd", "libsystemd0", "udev", "systemd"]:
+        assert resolver.get_source_package_details("noble", "amd64", binary_package_name, "255-1", []) == (
+            "systemd",
+            "255-1",
+        )
+
+    assert main_archive.getPublishedBinaries.call_count == 1
+    assert main_archive.getPublishedSources.call_count == 1
+
+
+def test_source_package_resolver_persists_lookups(tmp_path):
+    """Resolved binary packages are stored and reused by later runs"""
+    store = cache.JsonStore(str(tmp_path / "source-packages.json"))
+    mock_session = mock.MagicMock()
+    main_archive = mock_session.ubuntu.main_archive
+    main_archive.getPublishedBinaries.return_value = [
+        mock.Mock(source_package_name="sl", source_package_version="5.02-1")
+    ]
+
+    resolver = lib.SourcePackageResolver(mock_session, store=store)
+    assert resolver.get_source_package_details("noble", "amd64", "sl", "5.02-1", []) == ("sl", "5.02-1")
+    assert (resolver.hits, resolver.misses) == (0, 1)
+    resolver.save()
+
+    resolver = lib.SourcePackageResolver(mock_session, store=store)
+    assert resolver.get_source_package_details("noble", "amd64", "sl", "5.02-1", []) == ("sl", "5.02-1")
+    assert (resolver.hits, resolver.misses) == (1, 0)
+    assert main_archive.getPublishedBinaries.call_count == 1
+
+
+def test_ppa_archives_search_returns_first_hit_in_order():
+    """PPAs are searched concurrently, the first PPA in order with a result wins and
+    each PPA archive is only looked up once per thread"""
+    mock_session = mock.MagicMock()
+    mock_session.launchpad.people.__getitem__.return_value.getPPAByName.side_effect = lambda name: name
+    ppa_archives = lib.PpaArchives(mock_session, max_workers=1)
+
+    def search_archive(launchpad, archive, ppa):
+        time.sleep(0.01 if archive == "fips" else 0)
+        return None if archive == "proposed" else archive
+
+    for _ in range(2):
+        assert ppa_archives.search(["someone/proposed", "someone/fips", "someone/tools"], search_archive) == "fips"
+    getppabyname_names = [
+        getppabyname_call.kwargs["name"]
+        for getppabyname_call in mock_session.launchpad.people.__getitem__.return_value.getPPAByName.mock_calls
+    ]
+    assert sorted(set(getppabyname_names)) == sorted(getppabyname_names)
+
+
+def test_changelog_diffs_are_computed_once_and_stored(tmp_path):
+    """A source package diff is computed once and reused by later runs, unless a changelog was missing"""
+    store = cache.JsonEntryStore(str(tmp_path))
+    changelog_diff = lib.ChangelogDiff(
+        False,
+        [
+            Change(
+                package="sl",
+                version="2.0",
+                urgency="medium",
+                distributions="noble",
+                author="Some One <someone@example.com>",
+                date="Mon, 01 Jan 2024 00:00:00 +0000",
+            )
+        ],
+    )
+    compute_diff = mock.Mock(return_value=(changelog_diff, True))
+    key = ("sl", "1.0", "sl", "2.0", False)
+
+    changelog_diffs = lib.ChangelogDiffs(store)
+    for _ in range(2):
+        assert changelog_diffs.get(key, compute_diff) == changelog_diff
+    assert compute_diff.call_count == 1
+
+    changelog_diffs = lib.ChangelogDiffs(store)
+    assert changelog_diffs.is_known(key)
+    assert changelog_diffs.get(key, compute_diff) == changelog_diff
+    assert compute_diff.call_count == 1
+    assert (changelog_diffs.hits, changelog_diffs.misses) == (1, 0)
+
+    # stored diffs with highlighted CVEs expire
+    highlight_key = ("sl", "1.0", "sl", "2.0", True)
+    lib.ChangelogDiffs(store).get(highlight_key, compute_diff)
+    assert not lib.ChangelogDiffs(store, cves_ttl=0).is_known(highlight_key)
+
+    # diffs of missing changelogs are neither stored nor kept, e.g. for a later job with more PPAs
+    missing_key = ("sl", "1.0", "sl", "3.0", False)
+    changelog_diffs = lib.ChangelogDiffs(store)
+    changelog_diffs.get(missing_key, mock.Mock(return_value=(lib.ChangelogDiff(False, []), False)))
+    assert not changelog_diffs.is_known(missing_key)
+    assert not lib.ChangelogDiffs(store).is_known(missing_key)
+    assert changelog_diffs.get(missing_key, compute_diff) == changelog_diff
+
+
+def _write_changelog(path, versions):
+    path.write_text(
+        "".join(
+            "sl ({}) noble; urgency=medium\n\n  * Change in {}\n\n"
+            " -- Some One <someone@example.com>  Mon, 01 Jan 2024 00:00:00 +0000\n\n".format(version, version)
+            for version in versions
+        )
+    )
+
+
+def test_parse_changelog_reuses_parsed_changelogs(tmp_path):
+    """Each changelog is parsed once however many packages it is diffed for, and only as far as needed"""
+    from_changelog = tmp_path / "changelog.sl_1.0"
+    to_changelog = tmp_path / "changelog.sl_3.0"
+    _write_changelog(from_changelog, ["1.0", "0.2", "0.1"])
+    _write_changelog(to_changelog, ["3.0", "2.0", "1.0", "0.2", "0.1"])
+
+    parsed_changelogs = lib.ParsedChangelogs()
+    with mock.patch("ubuntu_cloud_image_changelog.lib.parsed_changelogs", parsed_changelogs), mock.patch(
+        "ubuntu_cloud_image_changelog.lib.Changelog", wraps=lib.Changelog
+    ) as mock_changelog:
+        for _ in range(3):
+            _, changes = lib.parse_changelog(
+                None, str(to_changelog), "3.0", from_changelog_filename=str(from_changelog), count=None
+            )
+            assert [change.version for change in changes] == ["3.0", "2.0"]
+    # only the 3.0 and 2.0 blocks are parsed
+    assert mock_changelog.call_count == 2
+    assert (parsed_changelogs.hits, parsed_changelogs.misses) == (4, 2)
+
+
+def test_parsed_changelogs_evicts_least_recently_used(tmp_path):
+    changelogs = [tmp_path / "changelog.sl_{}.0".format(version) for version in range(3)]
+    for changelog in changelogs:
+        _write_changelog(changelog, ["1.0"])
+    changelog_size = changelogs[0].stat().st_size * lib.PARSED_CHANGELOG_SIZE_FACTOR
+
+    parsed_changelogs = lib.ParsedChangelogs(max_size=2 * changelog_size)
+    for changelog in [changelogs[0], changelogs[1], changelogs[0], changelogs[2], changelogs[0]]:
+        parsed_changelogs.get(str(changelog))
+    assert parsed_changelogs.misses == 3
+    assert parsed_changelogs.size == 2 * changelog_size
+    parsed_changelogs.get(str(changelogs[1]))
+    assert parsed_changelogs.misses == 4
+
+
+def test_get_changelog_returns_downloaded_content(tmp_path):
+    """The downloaded changelog is returned as is and stored for later runs"""
+    changelog = (
+        b"sl (1.0) noble; urgency=medium\n\n  * Change \xc3\xa9\n\n"
+        b" -- Some One <someone@example.com>  Mon, 01 Jan 2024 00:00:00 +0000\n"
+    )
+    mock_launchpad = mock.MagicMock()
+    mock_launchpad._browser.get.return_value = changelog
+    mock_ubuntu = mock_launchpad.distributions["ubuntu"]
+    mock_source = mock.MagicMock()
+    mock_source.changelogUrl.return_value = "https://api.launchpad.net/devel/ubuntu/+archive/primary/+files/changelog"
+    mock_ubuntu.main_archive.getPublishedSources.return_value = [mock_source]
+
+    for _ in range(2):
+        changelog_content = lib.get_changelog(mock_launchpad, mock_ubuntu, "noble", str(tmp_path), "sl", "1.0", [])
+        assert changelog_content == lib.ChangelogContent("changelog.sl_1.0", changelog)
+    assert mock_launchpad._browser.get.call_count == 1
+    assert [block.version.full_version for block in lib.get_changelog_diff(None, changelog_content, None)] == ["1.0"]
+
+
+def test_get_changelog_skips_known_missing_archives(tmp_path):
+    """Archives known not to have a changelog are not searched again"""
+    mock_launchpad = mock.MagicMock()
+    mock_ubuntu = mock_launchpad.distributions["ubuntu"]
+    mock_ubuntu.main_archive.getPublishedSources.return_value = []
+    mock_launchpad.people["someone"].getPPAByName.return_value.getPublishedSources.return_value = []
+    mock_series = mock.Mock(self_link="https://api.launchpad.net/devel/ubuntu/noble")
+    missing = cache.NegativeCache()
+
+    for _ in range(2):
+        changelog_content = lib.get_changelog(
+            mock_launchpad, mock_ubuntu, mock_series, str(tmp_path), "sl", "1.0", ["someone/ppa"], missing=missing
+        )
+        assert changelog_content.name == "changelog.sl_1.0.missing"
+    assert mock_ubuntu.main_archive.getPublishedSources.call_count == 1
+    assert mock_launchpad.people["someone"].getPPAByName.call_count == 1
+    assert (missing.hits, missing.misses) == (2, 2)
+
+
+def test_changelog_resolver_retries_failed_changelogs(tmp_path):
+    """A changelog that failed to download is downloaded again when it is next needed"""
+    resolver = lib.ChangelogResolver(mock.MagicMock(), "noble", "noble", "amd64", str(tmp_path), [])
+    with mock.patch(
+        "ubuntu_cloud_image_changelog.lib.get_changelog",
+        side_effect=[click.ClickException("Launchpad is down"), lib.ChangelogContent("changelog.sl_1.0", b"")],
+    ) as mock_get_changelog:
+        with pytest.raises(click.ClickException):
+            resolver.get_changelog("noble", "sl", "1.0")
+        for _ in range(2):
+            assert resolver.get_changelog("noble", "sl", "1.0") == lib.ChangelogContent("changelog.sl_1.0", b"")
+    assert mock_get_changelog.call_count == 2
+
+
+def test_diff_manifests():
+    from_manifest = [
+        b"snap:lxd\t5.0/stable\t100\n",
+        b"zlib1g:amd64\t1.0\n",
+        b"sl\t1.0\n",
+        b"gone\t1.0\n",
+        b"same\t1.0\n",
+    ]
+    to_manifest = [b"snap:lxd\t5.0/stable\t101\n", b"new\t1.0\n", b"sl\t2.0\n", b"zlib1g:amd64\t2.0\n", b"same\t1.0\n"]
+    manifests_diff = lib.diff_manifests(from_manifest, to_manifest)
+    assert manifests_diff.deb == lib.ManifestDiff(
+        added={"new": "1.0"},
+        removed={"gone": "1.0"},
+        changed={"sl": ("1.0", "2.0"), "zlib1g": ("1.0", "2.0")},
+        unchanged=1,
+    )
+    assert manifests_diff.snap == lib.ManifestDiff(added={}, removed={}, changed={"lxd": ("100", "101")}, unchanged=0)
+    assert lib.diff_manifests([], []).snap.has_packages() is False
+
+
+@pytest.mark.parametrize("suffix, opener", [("", open), (".gz", gzip.open), (".xz", lzma.open)])
+def test_open_manifest(tmp_path, suffix, opener):
+    """Manifests are streamed from plain, gzip and xz compressed files"""
+    manifest_filename = str(tmp_path / "to.manifest{}".format(suffix))
+    with opener(manifest_filename, "wt") as manifest_file:
+        manifest_file.write("sl\t2.0\nsl\t1.0\nnew\t1.0\n")
+    with lib.open_manifest(manifest_filename) as manifest_lines:
+        manifests_diff = lib.diff_manifests([b"sl\t1.0\n", b"gone\t1.0\n"], manifest_lines)
+    # the last line for a package wins
+    assert manifests_diff.deb == lib.ManifestDiff(
+        added={"new": "1.0"}, removed={"gone": "1.0"}, changed={}, unchanged=1
+    )
+
+
+def test_open_manifest_stdin():
+    """A manifest named - is read from stdin, which is left open"""
+    stdin = io.TextIOWrapper(io.BytesIO(b"sl\t1.0\n"))
+    with mock.patch("sys.stdin", stdin):
+        with lib.open_manifest("-") as manifest_lines:
+            assert lib.parse_manifest(manifest_lines) == ({"sl": "1.0"}, {})
+    assert not stdin.closed
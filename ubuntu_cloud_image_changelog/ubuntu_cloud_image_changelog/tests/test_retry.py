@@ -2,7 +2,7 @@ import unittest.mock as mock
 
 import pytest
 
-from ubuntu_cloud_image_changelog import lib
+from ubuntu_cloud_image_changelog import lib, transport
 
 
 def test_retry_first_try():
@@ -33,4 +33,46 @@ def test_retry_raises():
             lib.retry(fn, num_attempts=3)(arg)
 
     assert fn.mock_calls == [mock.call(arg)] * 3
-    assert mock_sleep.mock_calls == [mock.call(0), mock.call(1), mock.call(2)]
+    # exponential backoff with jitter between attempts, none after the last
+    delays = [sleep_call.args[0] for sleep_call in mock_sleep.mock_calls]
+    assert len(delays) == 2
+    assert 0 <= delays[0] <= 1 and 0 <= delays[1] <= 2
+
+
+def test_retry_permanent_error():
+    """Permanent errors are raised straight away"""
+    fn = mock.MagicMock(side_effect=[transport.HTTPError("https://example.com", 403), None])
+
+    with mock.patch("time.sleep") as mock_sleep:
+        with pytest.raises(transport.HTTPError):
+            lib.retry(fn)()
+
+    assert fn.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_retry_after():
+    """A Retry-After header sets the delay before retrying"""
+    return_value = object()
+    fn = mock.MagicMock(
+        side_effect=[transport.HTTPError("https://example.com", 503, {"Retry-After": "7"}), return_value]
+    )
+
+    with mock.patch("time.sleep") as mock_sleep:
+        assert lib.retry(fn)() is return_value
+
+    assert mock_sleep.mock_calls == [mock.call(7.0)]
+
+
+def test_retry_budget():
+    """Once the retry budget is spent errors are raised without retrying"""
+    policy = lib.RetryPolicy(budget_ratio=0, budget_minimum=3)
+    fn = mock.MagicMock(side_effect=transport.HTTPError("https://example.com", 503))
+
+    with mock.patch("time.sleep"):
+        for _ in range(2):
+            with pytest.raises(transport.HTTPError):
+                lib.retry(fn, policy=policy)()
+
+    # 3 retries of the first call and none of the second
+    assert fn.call_count == 5
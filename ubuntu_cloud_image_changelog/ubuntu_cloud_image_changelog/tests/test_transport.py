@@ -0,0 +1,59 @@
+import http.server
+import threading
+
+import pytest
+
+from ubuntu_cloud_image_changelog import transport
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/active/CVE-2024-0001")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/active/CVE-2024-0001":
+            body = b"Candidate: CVE-2024-0001\n"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    connections = []
+
+    class CountingServer(http.server.ThreadingHTTPServer):
+        def process_request(self, request, client_address):
+            connections.append(client_address)
+            super().process_request(request, client_address)
+
+    httpd = CountingServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1]), connections
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetcher_reuses_connection(server):
+    """Requests from one thread to one host share a keep-alive connection"""
+    url, connections = server
+    fetcher = transport.HTTPFetcher()
+    for _ in range(5):
+        assert fetcher.get("{}/active/CVE-2024-0001".format(url)) == b"Candidate: CVE-2024-0001\n"
+    assert fetcher.get("{}/redirect".format(url)) == b"Candidate: CVE-2024-0001\n"
+    with pytest.raises(transport.NotFound):
+        fetcher.get("{}/retired/CVE-2024-0001".format(url))
+    assert len(connections) == 1
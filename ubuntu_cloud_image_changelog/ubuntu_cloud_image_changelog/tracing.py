@@ -0,0 +1,111 @@
+"""Timing spans exported as Chrome trace events.
+
+Tracing is off until start() is called, and span() and traced() do next to nothing
+until then. The file written by stop() can be opened in chrome://tracing or
+https://ui.perfetto.dev, which show the spans of every thread on a timeline.
+"""
+
+import contextlib
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+_tracer = None
+
+
+class Tracer:
+    """Collect complete ("X") trace events from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._events = []
+        # thread id -> thread name
+        self._threads = {}
+
+    def add(self, name: str, start: float, end: float, args: dict):
+        """Record a span from start to end, both time.perf_counter() values"""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._start) * 1000000,
+            "dur": (end - start) * 1000000,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append(event)
+
+    def write(self, filename: str):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        thread_names = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        with open(filename, "w") as trace_file:
+            json.dump({"traceEvents": thread_names + events, "displayTimeUnit": "ms"}, trace_file)
+
+
+def start() -> Tracer:
+    """Start recording spans"""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop(filename: Optional[str] = None):
+    """Stop recording spans and write the ones recorded to filename, if set"""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer and filename:
+        tracer.write(filename)
+
+
+@contextlib.contextmanager
+def span(name: str, **args):
+    """Record the time spent in the with block as a span called name with args, e.g. the package"""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    except BaseException as ex:
+        args["error"] = type(ex).__name__
+        raise
+    finally:
+        tracer.add(name, start_time, time.perf_counter(), args)
+
+
+def traced(*arg_names: str):
+    """
+    Decorate a function so that every call is recorded as a span named after the
+    function. The arguments named in arg_names are added to the span.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with span(
+                func.__name__, **{arg_name: str(arguments[arg_name]) for arg_name in arg_names if arg_name in arguments}
+            ):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,104 @@
+"""Plain HTTP(S) GETs over persistent connections."""
+
+import gzip
+import http.client
+import threading
+import urllib.parse
+
+from ubuntu_cloud_image_changelog import __version__
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+USER_AGENT = "ubuntu-cloud-image-changelog/{}".format(__version__)
+
+
+class HTTPError(Exception):
+    def __init__(self, url, status, headers=None):
+        super(HTTPError, self).__init__("HTTP {} fetching {}".format(status, url))
+        self.url = url
+        self.status = status
+        self.headers = headers or {}
+
+
+class NotFound(HTTPError):
+    pass
+
+
+class HTTPFetcher:
+    """
+    Fetch URLs with plain, unauthenticated GET requests.
+
+    Each thread keeps one HTTP/1.1 keep-alive connection per host, so the TCP and
+    TLS setup is paid once per thread and host instead of once per request. At most
+    max_connections requests are in flight at any time across all threads.
+    """
+
+    def __init__(self, max_connections: int = 16, timeout: int = 60, max_redirects: int = 5):
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._semaphore = threading.BoundedSemaphore(max_connections)
+        self._local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        return self._local.connections
+
+    def _connection(self, scheme, netloc):
+        connections = self._connections()
+        if (scheme, netloc) not in connections:
+            if scheme == "https":
+                connections[(scheme, netloc)] = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            elif scheme == "http":
+                connections[(scheme, netloc)] = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise ValueError("Unsupported URL scheme {}".format(scheme))
+        return connections[(scheme, netloc)]
+
+    def _close(self, scheme, netloc):
+        connection = self._connections().pop((scheme, netloc), None)
+        if connection:
+            connection.close()
+
+    def _request(self, scheme, netloc, path):
+        # A kept alive connection may have been closed by the server since it was last
+        # used, in which case the request is sent once more on a new connection.
+        for attempt in range(2):
+            connection = self._connection(scheme, netloc)
+            try:
+                connection.request("GET", path, headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._close(scheme, netloc)
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                self._close(scheme, netloc)
+                raise
+            if response.will_close:
+                self._close(scheme, netloc)
+            return response, body
+
+    def get(self, url: str) -> bytes:
+        """returns the body of url, following redirects. Raises NotFound on a 404
+        and HTTPError on any other error response"""
+        for _ in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path = "{}?{}".format(path, parts.query)
+            with self._semaphore:
+                response, body = self._request(parts.scheme, parts.netloc, path)
+            headers = dict(response.getheaders())
+            if response.status in REDIRECT_STATUSES and response.getheader("Location"):
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            if response.status == 404:
+                raise NotFound(url, response.status, headers)
+            if response.status >= 400:
+                raise HTTPError(url, response.status, headers)
+            if response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            return body
+        raise HTTPError(url, response.status, headers)